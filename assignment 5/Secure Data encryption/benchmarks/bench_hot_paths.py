@@ -0,0 +1,336 @@
+"""Benchmarks for the crypto, serialization and storage hot paths.
+
+Runs the app's functions through the headless secure_data package (no
+Streamlit import, no server):
+
+    hash_passkey            - legacy passkey hashing (SHA-256)
+    verify_password         - a failed login checked on the password pool (scrypt)
+    login_burst             - a credential-stuffing burst of failed logins against 1000
+                              usernames from 50 clients, through the login rate limiter
+    encrypt:<bytes>         - Vault.encrypt_data() for one payload size
+    decrypt:<bytes>         - Vault.decrypt_data() for one payload size
+    save:<items>            - Vault.save_item() into a store already holding <items> items
+    save_durable:<items>    - the same, waiting until the item is on disk
+    sessions:<threads>      - <threads> concurrent sessions each saving items durably into a
+                              store of 1000 items; reports backend commits per save
+    load:<items>            - cold load of a store holding <items> items
+                              (backend open and parse, as at process start)
+    load_data:<items>       - Vault.load_data(), as on every rerun of a warm process
+    search:<items>          - one page of Vault.list_page() with search criteria, for a
+                              user holding <items> items (index already built)
+
+Every case runs in a fresh process inside its own temporary directory, so
+peak RSS is per case and no case sees another's files or caches. Results
+(throughput, p50/p99 latency, peak RSS) are printed and saved as JSON; pass
+--baseline to compare against an earlier run:
+
+    python benchmarks/bench_hot_paths.py --output baseline.json
+    python benchmarks/bench_hot_paths.py --baseline baseline.json --output current.json
+
+--quick limits payloads to 16MB and stores to 10k items for a fast check.
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+KB = 1024
+MB = 1024 * KB
+PAYLOAD_SIZES = [1 * KB, 64 * KB, 1 * MB, 16 * MB, 64 * MB]
+STORE_SIZES = [10, 1000, 10000, 100000]
+SESSION_COUNTS = [1, 8, 32]
+QUICK_MAX_PAYLOAD = 16 * MB
+QUICK_MAX_STORE = 10000
+PASSKEY = "benchmark-passkey"
+DEFAULT_THRESHOLD = 0.10
+MIN_DELTA_MS = 0.05  # smaller p50 changes are timer noise, never regressions
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (MB if sys.platform == "darwin" else KB)
+
+
+def _percentile(samples, fraction):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _repeats(size, budget=256 * MB, low=3, high=50):
+    """Repeat small payloads often and large ones a few times"""
+    return max(low, min(high, budget // max(size, 1)))
+
+
+def _open_vault(workdir, options):
+    """Create a vault with all of its files inside workdir"""
+    os.chdir(workdir)
+    sys.path.insert(0, APP_DIR)
+    logging.basicConfig(level=logging.WARNING)
+    from secure_data import Vault
+    return Vault(backend=options["backend"], kdf_log2_n=options["kdf_log2_n"])
+
+
+def _synthetic_item(index):
+    """Metadata shaped like a stored file item (payload blobs are not needed)"""
+    return {
+        "blob": {"hash": f"{index:064x}", "size": 4096, "offset": 0},
+        "kdf": {"alg": "scrypt", "salt": "c2FsdHNhbHRzYWx0c2FsdA==", "ln": 15, "r": 8, "p": 1},
+        "key_id": "k1-00000000",
+        "wrapped_key": "A" * 104,
+        "timestamp": "2024-01-01 00:00:00",
+        "type": "file",
+        "file_info": {"filename": f"file-{index}.bin", "type": "application/octet-stream", "size": 4096},
+    }
+
+
+def _populate(vault, count, users=10):
+    store = vault.store
+    batch = []
+    for index in range(count):
+        batch.append((f"user{index % users}", f"item-{index}", _synthetic_item(index)))
+        if len(batch) >= 5000:
+            store.put_many(batch)
+            batch = []
+    if batch:
+        store.put_many(batch)
+    store.flush().result()
+
+
+def _commit_count():
+    """Return how many backend writes the store has made so far"""
+    from secure_data import metrics
+    return next((row["count"] for row in metrics.REGISTRY.summary() if row["operation"] == "commit"), 0)
+
+
+def _time_calls(fn, repeats):
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def _run_case(case, options):
+    """Run one case in the current (fresh) process and return its result dict"""
+    name, _, arg = case.partition(":")
+    size = int(arg) if arg else 0
+    with tempfile.TemporaryDirectory(prefix="bench-") as workdir:
+        vault = _open_vault(workdir, options)
+        baseline_rss = _peak_rss_mb()
+        nbytes = 0
+        commits = None
+
+        if name == "hash_passkey":
+            repeats = options["repeat"] or 10000
+            from secure_data import hash_passkey
+            samples = _time_calls(lambda: hash_passkey(PASSKEY), repeats)
+        elif name == "verify_password":
+            repeats = options["repeat"] or 20
+            from secure_data import authenticate, default_accounts
+            accounts = default_accounts()
+            samples = _time_calls(lambda: authenticate(accounts, "admin", PASSKEY), repeats)
+        elif name == "login_burst":
+            repeats = options["repeat"] or 50000
+            from secure_data import LoginLimiter, LoginRateLimited, default_accounts, login
+            limiter = LoginLimiter()
+            accounts = default_accounts()
+            counter = iter(range(repeats))
+
+            def attempt():
+                index = next(counter)
+                try:
+                    login(limiter, accounts, f"user{index % 1000}", PASSKEY, f"10.0.0.{index % 50}")
+                except LoginRateLimited:
+                    pass
+            samples = _time_calls(attempt, repeats)
+        elif name == "encrypt":
+            data = os.urandom(size)
+            repeats = options["repeat"] or _repeats(size)
+            samples = _time_calls(lambda: vault.encrypt_data(data, PASSKEY, is_binary=True), repeats)
+            nbytes = size
+        elif name == "decrypt":
+            payload = vault.encrypt_data(os.urandom(size), PASSKEY, is_binary=True)
+            vault.decrypt_data(payload, PASSKEY, is_binary=True)  # warm the derived-key cache
+            repeats = options["repeat"] or _repeats(size)
+            samples = _time_calls(lambda: vault.decrypt_data(payload, PASSKEY, is_binary=True), repeats)
+            nbytes = size
+        elif name in ("save", "save_durable"):
+            _populate(vault, size)
+            repeats = options["repeat"] or 200
+            counter = iter(range(repeats))
+            wait = name == "save_durable"
+            samples = _time_calls(
+                lambda: vault.save_item("bench", f"new-{next(counter)}", _synthetic_item(0), wait=wait), repeats)
+        elif name == "sessions":
+            _populate(vault, 1000)
+            repeats = options["repeat"] or 50
+            samples = []
+            commits_before = _commit_count()
+
+            def session(number):
+                for index in range(repeats):
+                    start = time.perf_counter()
+                    vault.save_item(f"user{number}", f"new-{index}", _synthetic_item(index), wait=True)
+                    samples.append(time.perf_counter() - start)
+            threads = [threading.Thread(target=session, args=(number,)) for number in range(size)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            commits = _commit_count() - commits_before
+        elif name == "load":
+            _populate(vault, size)
+            vault.store.close()
+            from secure_data import storage
+            repeats = options["repeat"] or _repeats(size * 1024, low=3, high=20)
+
+            def cold_load():
+                backend = storage.BACKENDS[options["backend"]](vault.path)
+                storage.CachedStore(backend)
+                backend.close()
+            samples = _time_calls(cold_load, repeats)
+        elif name == "load_data":
+            _populate(vault, size)
+            repeats = options["repeat"] or 1000
+            samples = _time_calls(vault.load_data, repeats)
+        elif name == "search":
+            _populate(vault, size, users=1)
+            queries = [
+                {"prefix": "item-12"},
+                {"contains": "-99"},
+                {"sort": "size", "descending": True},
+                {"since": "2024-01-01", "until": "2024-01-01", "sort": "timestamp"},
+            ]
+            vault.store.index("user0")
+            repeats = options["repeat"] or 400
+            counter = iter(range(repeats))
+            samples = _time_calls(
+                lambda: vault.list_page("user0", 0, 24, **queries[next(counter) % len(queries)]), repeats)
+        else:
+            raise ValueError(f"Unknown benchmark case: {case}")
+
+    total = sum(samples)
+    result = {
+        "case": case,
+        "repeats": len(samples),
+        "p50_ms": _percentile(samples, 0.50) * 1000,
+        "p99_ms": _percentile(samples, 0.99) * 1000,
+        "mean_ms": statistics.fmean(samples) * 1000,
+        "ops_per_s": len(samples) / total if total else None,
+        "peak_rss_mb": _peak_rss_mb(),
+        "baseline_rss_mb": baseline_rss,
+    }
+    if commits is not None:
+        result["commits_per_save"] = commits / len(samples)
+    if nbytes:
+        result["mb_per_s"] = nbytes * len(samples) / MB / total if total else None
+    return result
+
+
+def _run_isolated(case, options):
+    """Run a case in a fresh spawned process so its peak RSS is its own"""
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(_run_case, (case, options))
+
+
+def build_cases(args):
+    max_payload = QUICK_MAX_PAYLOAD if args.quick else args.max_payload
+    payload_sizes = [size for size in PAYLOAD_SIZES if size <= max_payload]
+    if max_payload not in payload_sizes and not args.quick:
+        payload_sizes.append(max_payload)
+    store_sizes = [size for size in STORE_SIZES if not args.quick or size <= QUICK_MAX_STORE]
+
+    cases = ["hash_passkey", "verify_password", "login_burst"]
+    cases += [f"encrypt:{size}" for size in payload_sizes]
+    cases += [f"decrypt:{size}" for size in payload_sizes]
+    cases += [f"{name}:{size}" for name in ("save", "save_durable", "load", "load_data", "search")
+              for size in store_sizes]
+    cases += [f"sessions:{count}" for count in SESSION_COUNTS]
+    if args.filter:
+        cases = [case for case in cases if any(case.startswith(prefix) for prefix in args.filter)]
+    return cases
+
+
+def compare(results, baseline, threshold):
+    """Return (case, baseline p50, current p50, change) for cases slower than threshold"""
+    previous = {result["case"]: result for result in baseline["results"]}
+    regressions = []
+    for result in results:
+        old = previous.get(result["case"])
+        if not old or not old["p50_ms"]:
+            continue
+        change = result["p50_ms"] / old["p50_ms"] - 1
+        if change > threshold and result["p50_ms"] - old["p50_ms"] >= MIN_DELTA_MS:
+            regressions.append((result["case"], old["p50_ms"], result["p50_ms"], change))
+    return regressions
+
+
+def _format(result):
+    throughput = f"{result['mb_per_s']:9.1f} MB/s" if "mb_per_s" in result else f"{result['ops_per_s']:9.1f} op/s"
+    return (f"{result['case']:<18} n={result['repeats']:<6} p50={result['p50_ms']:10.3f}ms "
+            f"p99={result['p99_ms']:10.3f}ms {throughput}  peak RSS={result['peak_rss_mb']:.0f}MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the app's crypto and storage hot paths")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--baseline", help="compare against results from an earlier --output")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="p50 slowdown counted as a regression (default 0.10 = 10%%)")
+    parser.add_argument("--backend", default=os.getenv("SECURE_APP_STORAGE_BACKEND", "journal"),
+                        choices=["json", "journal", "sqlite", "sharded"])
+    parser.add_argument("--kdf-log2-n", type=int, default=int(os.getenv("SECURE_APP_KDF_LOG2_N", 15)))
+    parser.add_argument("--max-payload", type=int,
+                        default=int(os.getenv("SECURE_APP_MAX_FILE_SIZE", 200 * MB)),
+                        help="largest payload size in bytes (default MAX_FILE_SIZE)")
+    parser.add_argument("--repeat", type=int, default=0, help="override the repeat count of every case")
+    parser.add_argument("--quick", action="store_true", help="payloads up to 16MB, stores up to 10k items")
+    parser.add_argument("--filter", nargs="*", help="only run cases starting with these prefixes")
+    args = parser.parse_args()
+
+    options = {"backend": args.backend, "kdf_log2_n": args.kdf_log2_n, "repeat": args.repeat}
+    results = []
+    for case in build_cases(args):
+        result = _run_isolated(case, options)
+        print(_format(result), flush=True)
+        results.append(result)
+
+    report = {
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "options": options,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for case, old, new, change in regressions:
+            print(f"REGRESSION {case}: p50 {old:.3f}ms -> {new:.3f}ms (+{change:.0%})")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions over {args.threshold:.0%} against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
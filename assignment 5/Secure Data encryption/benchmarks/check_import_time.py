@@ -0,0 +1,82 @@
+"""Check that importing the headless core stays fast and Streamlit-free.
+
+Imports secure_data in fresh interpreters, takes the best of several runs and
+fails if it is over budget or if the import pulled in Streamlit:
+
+    python benchmarks/check_import_time.py
+    python benchmarks/check_import_time.py --budget-ms 100 --runs 10
+
+Run with -v to see the slowest modules of the last import
+(from python -X importtime).
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BUDGET_MS = 150
+DEFAULT_RUNS = 5
+
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import secure_data
+elapsed = time.perf_counter() - start
+print(json.dumps({"ms": elapsed * 1000, "streamlit": "streamlit" in sys.modules}))
+"""
+
+
+def measure(runs=DEFAULT_RUNS):
+    """Return (best import time in ms, whether Streamlit was imported)"""
+    best = None
+    streamlit_loaded = False
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", _PROBE], cwd=APP_DIR, check=True,
+                                capture_output=True, text=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        best = result["ms"] if best is None else min(best, result["ms"])
+        streamlit_loaded = streamlit_loaded or result["streamlit"]
+    return best, streamlit_loaded
+
+
+def slowest_modules(limit=15):
+    """Return the slowest (cumulative microseconds, module) pairs from -X importtime"""
+    stderr = subprocess.run([sys.executable, "-X", "importtime", "-c", "import secure_data"], cwd=APP_DIR,
+                            check=True, capture_output=True, text=True).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = line[len("import time:"):].split("|")
+        rows.append((int(cumulative), module.strip()))
+    return sorted(rows, reverse=True)[:limit]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the import time budget of the secure_data package")
+    parser.add_argument("--budget-ms", type=float,
+                        default=float(os.getenv("SECURE_DATA_IMPORT_BUDGET_MS", DEFAULT_BUDGET_MS)))
+    parser.add_argument("--runs", type=int, default=DEFAULT_RUNS)
+    parser.add_argument("-v", "--verbose", action="store_true", help="list the slowest imported modules")
+    args = parser.parse_args()
+
+    best_ms, streamlit_loaded = measure(args.runs)
+    print(f"import secure_data: {best_ms:.1f}ms (best of {args.runs}, budget {args.budget_ms:.0f}ms)")
+    if args.verbose:
+        for cumulative, module in slowest_modules():
+            print(f"  {cumulative / 1000:8.1f}ms  {module}")
+
+    failed = False
+    if streamlit_loaded:
+        print("FAIL: importing secure_data imported streamlit")
+        failed = True
+    if best_ms > args.budget_ms:
+        print(f"FAIL: import time is over budget by {best_ms - args.budget_ms:.1f}ms")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""Load test for the HTTP API (python -m secure_data.api).
+
+Drives a running local instance with concurrent keep-alive clients and
+reports requests per second and latency per operation:
+
+    python -m secure_data.api --port 8765 &
+    python benchmarks/load_test_api.py --url http://127.0.0.1:8765 --clients 16 --duration 10
+
+Each client thread loops over a mix of store (PUT), retrieve (GET) and list
+requests on its own labels, then deletes what it stored. Use a throwaway
+store for the server: the test writes real items for --user.
+"""
+import argparse
+import base64
+import http.client
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from urllib.parse import quote, urlsplit
+
+DEFAULT_URL = "http://127.0.0.1:8765"
+DEFAULT_MIX = "store=1,retrieve=4,list=1"
+
+
+def _percentile(samples, fraction):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def parse_mix(spec):
+    """Parse 'store=1,retrieve=4,list=1' into a repeating list of operations"""
+    operations = []
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        if name not in ("store", "retrieve", "list"):
+            raise SystemExit(f"Unknown operation in --mix: {name}")
+        operations.extend([name] * int(weight or 1))
+    return operations
+
+
+class Client:
+    def __init__(self, url, username, password, passkey):
+        parts = urlsplit(url)
+        self.connection = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=60)
+        token = base64.b64encode(f"{username}:{password}".encode()).decode()
+        self.headers = {"Authorization": f"Basic {token}", "X-Passkey": passkey}
+
+    def request(self, method, path, body=None):
+        self.connection.request(method, path, body=body, headers=self.headers)
+        response = self.connection.getresponse()
+        data = response.read()
+        if response.status >= 400:
+            raise RuntimeError(f"{method} {path}: {response.status} {data[:200]!r}")
+        return data
+
+    def close(self):
+        self.connection.close()
+
+
+def run_client(index, args, operations, deadline, results, errors):
+    client = Client(args.url, args.user, args.password, args.passkey)
+    body = os.urandom(args.size)
+    labels = []
+    step = 0
+    try:
+        while time.perf_counter() < deadline:
+            operation = operations[step % len(operations)]
+            # Retrieving needs something stored first
+            if operation == "retrieve" and not labels:
+                operation = "store"
+            start = time.perf_counter()
+            try:
+                if operation == "store":
+                    label = f"loadtest/{index}/{step}"
+                    client.request("PUT", f"/items/{quote(label, safe='')}", body)
+                    labels.append(label)
+                elif operation == "retrieve":
+                    label = labels[step % len(labels)]
+                    client.request("GET", f"/items/{quote(label, safe='')}")
+                else:
+                    client.request("GET", "/items")
+                results[operation].append(time.perf_counter() - start)
+            except Exception as e:
+                errors.append(f"{operation}: {str(e)}")
+                client.close()
+                client = Client(args.url, args.user, args.password, args.passkey)
+            step += 1
+        for label in labels:
+            client.request("DELETE", f"/items/{quote(label, safe='')}")
+    finally:
+        client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test a local secure_data HTTP API")
+    parser.add_argument("--url", default=DEFAULT_URL)
+    parser.add_argument("--user", default="admin")
+    parser.add_argument("--password", default="admin123")
+    parser.add_argument("--passkey", default="load-test-passkey")
+    parser.add_argument("--clients", type=int, default=8, help="concurrent keep-alive connections")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds to run")
+    parser.add_argument("--size", type=int, default=64 * 1024, help="bytes per stored item")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"operation weights (default {DEFAULT_MIX})")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    operations = parse_mix(args.mix)
+    # Fail fast if the server is not up or the credentials are wrong
+    Client(args.url, args.user, args.password, args.passkey).request("GET", "/items")
+
+    results = {name: [] for name in ("store", "retrieve", "list")}
+    errors = []
+    deadline = time.perf_counter() + args.duration
+    threads = [threading.Thread(target=run_client, args=(i, args, operations, deadline, results, errors))
+               for i in range(args.clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    summary = {"clients": args.clients, "size": args.size, "seconds": round(elapsed, 2), "errors": len(errors)}
+    total = sum(len(samples) for samples in results.values())
+    print(f"{args.clients} clients, {args.size} byte items, {elapsed:.1f}s: "
+          f"{total / elapsed:.1f} req/s, {len(errors)} error(s)")
+    print(f"{'operation':<10} {'requests':>9} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9}")
+    for name, samples in results.items():
+        if not samples:
+            continue
+        row = {
+            "requests": len(samples),
+            "rps": len(samples) / elapsed,
+            "p50_ms": statistics.median(samples) * 1000,
+            "p99_ms": _percentile(samples, 0.99) * 1000,
+        }
+        summary[name] = row
+        print(f"{name:<10} {row['requests']:>9} {row['rps']:>9.1f} {row['p50_ms']:>9.2f} {row['p99_ms']:>9.2f}")
+    for error in errors[:5]:
+        print(f"error: {error}", file=sys.stderr)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=2)
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+    main()
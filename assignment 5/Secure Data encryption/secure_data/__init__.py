@@ -0,0 +1,35 @@
+"""Headless core of the Secure Data Encryption app.
+
+Everything except the Streamlit UI: payload crypto, storage backends, key
+management, account checks and metrics. Nothing here imports Streamlit, so
+the package can be used from scripts, workers and tests:
+
+    from secure_data import Vault
+
+    vault = Vault()
+    payload = vault.encrypt_data("secret", "passkey")
+    vault.save_item("alice", "note", {**payload, "type": "text"})
+    vault.decrypt_data(payload, "passkey")
+
+Importing the package must stay fast (see benchmarks/check_import_time.py).
+"""
+from .auth import LoginRateLimited, authenticate, change_password, default_accounts, hash_passkey, login
+from .passwords import VerifierBusy, hash_password, verify_password
+from .rate_limit import LoginLimiter
+from .vault import Vault, describe_payload, get_payload
+
+__all__ = [
+    "LoginLimiter",
+    "LoginRateLimited",
+    "Vault",
+    "VerifierBusy",
+    "authenticate",
+    "change_password",
+    "default_accounts",
+    "describe_payload",
+    "get_payload",
+    "hash_passkey",
+    "hash_password",
+    "login",
+    "verify_password",
+]
@@ -0,0 +1,449 @@
+"""Local HTTP API over the vault, built on asyncio streams.
+
+    python -m secure_data.api --port 8765
+
+Requests authenticate with HTTP Basic auth against the app's accounts and
+act on that user's items. Failed logins are rate limited per username and
+per client address (see rate_limit.py); a limited attempt gets 429 with a
+Retry-After header before its password is checked. Passwords are verified
+on the shared password pool (see passwords.py); when its queue is full the
+request gets 503 with Retry-After instead of waiting. Item passkeys travel in the ``X-Passkey`` header.
+
+    GET    /health               -> {"status": "ok"}
+    GET    /items?offset=0&limit=100
+                                 -> {"items": [{"label", "type", "timestamp", "size"}, ...],
+                                     "total", "offset", "limit"}
+           optional filters: q (label contains), prefix, type, mime,
+           since / until (timestamps, may be partial dates),
+           sort (label, timestamp or size), order (asc or desc)
+    PUT    /items/<label>        body = plaintext; ?type=text for text items,
+                                 X-Filename / Content-Type describe files -> 201
+    GET    /items/<label>        -> plaintext (403 if the passkey is wrong)
+    DELETE /items/<label>        -> 204
+
+Labels are URL-encoded in the path. The event loop only parses requests and
+moves bytes: key derivation, encryption, decryption and store writes run on
+a thread pool. Upload bodies are never buffered whole; the worker thread
+encrypting a body pulls it from the socket chunk by chunk, and downloads are
+decrypted to a spool file and streamed back the same way.
+
+Only HTTP/1.1 with Content-Length bodies is supported (no chunked uploads).
+A malformed or negative Content-Length gets 400 and the connection is
+closed; a body sent to a route that takes none is read and dropped before
+the request is handled (or the connection is closed, past MAX_DISCARD_SIZE)
+so it is never parsed as the next request. A download that fails after its
+200 has been sent is cut off by resetting the connection, never by appending
+an error response to the body. The server is meant to listen on localhost behind the host's own TLS
+termination if exposed further.
+
+The API opens the same store as the app; with the default journal backend
+only one of them can run at a time (a second one exits with an error), so
+serve the sqlite or sharded backend to run both.
+"""
+import argparse
+import asyncio
+import base64
+import binascii
+import json
+import logging
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from . import auth, config, metrics
+from .journal_store import JournalLockedError
+from .passwords import VerifierBusy
+from .rate_limit import LoginLimiter
+from .vault import Vault, get_payload
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+MAX_HEADER_SIZE = 64 * 1024
+MAX_DISCARD_SIZE = 64 * 1024  # largest unexpected body read and dropped to keep a connection open
+STREAM_CHUNK_SIZE = 256 * 1024
+LIST_PAGE_SIZE = 100
+MAX_LIST_PAGE_SIZE = 1000
+_SEARCH_PARAMS = {"q": "contains", "prefix": "prefix", "type": "item_type", "mime": "mime_type",
+                  "since": "since", "until": "until"}
+
+_REASONS = {
+    200: "OK", 201: "Created", 204: "No Content", 400: "Bad Request", 401: "Unauthorized",
+    403: "Forbidden", 404: "Not Found", 405: "Method Not Allowed", 411: "Length Required",
+    413: "Payload Too Large", 422: "Unprocessable Entity", 429: "Too Many Requests", 500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+
+class HTTPError(Exception):
+    """Raised by handlers to send an error response"""
+
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = headers or {}
+
+
+class Request:
+    def __init__(self, method, target, headers, reader, client=None):
+        self.method = method
+        self.client = client
+        url = urlsplit(target)
+        self.path = url.path
+        self.query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        self.headers = headers
+        self.reader = reader
+        self.content_length = int(headers.get("content-length", 0) or 0)
+        self.body_remaining = self.content_length
+        self.username = None
+
+    def keep_alive(self):
+        return self.headers.get("connection", "").lower() != "close"
+
+
+class BodyReader:
+    """Blocking file-like view of a request body, for use on a worker thread
+
+    Each read() schedules a read on the event loop and waits for it, so the
+    body flows from the socket to the cipher without being buffered whole.
+    """
+
+    def __init__(self, request, loop):
+        self._request = request
+        self._loop = loop
+
+    def read(self, size=-1):
+        remaining = self._request.body_remaining
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        if size == 0:
+            return b""
+        data = asyncio.run_coroutine_threadsafe(self._request.reader.readexactly(size), self._loop).result()
+        self._request.body_remaining -= len(data)
+        return data
+
+    def seek(self, offset, whence=0):
+        # The vault rewinds inputs before encrypting; a fresh body is already at 0
+        if offset or whence:
+            raise OSError("Request bodies are not seekable")
+        return 0
+
+
+class VaultAPI:
+    """Routes requests to a Vault, running its blocking calls on a thread pool"""
+
+    def __init__(self, vault, accounts=None, workers=DEFAULT_WORKERS, max_body_size=config.MAX_FILE_SIZE,
+                 limiter=None):
+        self.vault = vault
+        self.accounts = accounts if accounts is not None else auth.default_accounts()
+        self.limiter = limiter if limiter is not None else LoginLimiter()
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="api")
+        self.max_body_size = max_body_size
+
+    async def run_blocking(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.pool, fn, *args)
+
+    # Connection handling
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request = await self._read_request(reader, writer)
+                if request is None:
+                    break
+                keep_alive = await self._dispatch(request, writer)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader, writer):
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError:
+            return None
+        except asyncio.LimitOverrunError:
+            await self._send_json(writer, 400, {"error": "Request headers too large"}, keep_alive=False)
+            return None
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, _ = lines[0].split(" ", 2)
+        except ValueError:
+            await self._send_json(writer, 400, {"error": "Malformed request line"}, keep_alive=False)
+            return None
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        length = headers.get("content-length", "")
+        if length and not (length.isascii() and length.isdigit()):
+            # The body's end is unknown, so the connection cannot be reused
+            await self._send_json(writer, 400, {"error": "Content-Length must be a non-negative integer"},
+                                  keep_alive=False)
+            return None
+        peer = writer.get_extra_info("peername")
+        return Request(method.upper(), target, headers, reader, peer[0] if peer else None)
+
+    async def _dispatch(self, request, writer):
+        start = time.perf_counter()
+        action = "unknown"
+        try:
+            if "chunked" in request.headers.get("transfer-encoding", "").lower():
+                raise HTTPError(411, "Chunked request bodies are not supported; send Content-Length")
+            action, handler, label = self._route(request)
+            if action != "store" and request.body_remaining:
+                await self._discard_body(request)
+            if action != "health":
+                request.username = await self._authenticate(request)
+            keep_alive = await handler(request, writer, label)
+        except HTTPError as e:
+            # Unread body bytes would be parsed as the next request, so close instead
+            keep_alive = request.keep_alive() and request.body_remaining == 0
+            await self._send_json(writer, e.status, {"error": e.message}, keep_alive=keep_alive, headers=e.headers)
+        except Exception as e:
+            logger.error(f"API error: {str(e)}")
+            metrics.count_error(f"api_{action}")
+            keep_alive = False
+            await self._send_json(writer, 500, {"error": "Internal server error"}, keep_alive=False)
+        metrics.observe(f"api_{action}", time.perf_counter() - start)
+        return keep_alive
+
+    async def _discard_body(self, request):
+        """Read and drop the body of a request that takes none, so the connection can be reused"""
+        if request.body_remaining > MAX_DISCARD_SIZE:
+            raise HTTPError(413, f"{request.method} {request.path} takes no request body")
+        while request.body_remaining:
+            data = await request.reader.read(min(request.body_remaining, STREAM_CHUNK_SIZE))
+            if not data:
+                raise asyncio.IncompleteReadError(b"", request.body_remaining)
+            request.body_remaining -= len(data)
+
+    def _route(self, request):
+        if request.path == "/health":
+            return "health", self.health, None
+        if request.path == "/items":
+            if request.method == "GET":
+                return "list", self.list_items, None
+            raise HTTPError(405, "Use GET on /items")
+        if request.path.startswith("/items/"):
+            label = unquote(request.path[len("/items/"):])
+            if not label:
+                raise HTTPError(404, "Missing item label")
+            routes = {"GET": ("retrieve", self.retrieve), "PUT": ("store", self.store), "DELETE": ("delete", self.delete)}
+            if request.method not in routes:
+                raise HTTPError(405, "Use GET, PUT or DELETE on /items/<label>")
+            action, handler = routes[request.method]
+            return action, handler, label
+        raise HTTPError(404, "Not found")
+
+    async def _authenticate(self, request):
+        challenge = {"WWW-Authenticate": 'Basic realm="secure-data"'}
+        header = request.headers.get("authorization", "")
+        if not header.startswith("Basic "):
+            raise HTTPError(401, "Authentication required", challenge)
+        try:
+            username, _, password = base64.b64decode(header[6:]).decode("utf-8").partition(":")
+        except (binascii.Error, UnicodeDecodeError):
+            raise HTTPError(401, "Malformed credentials", challenge)
+        # Checked on the event loop, so a rate-limited attempt never reaches the pool
+        retry_after = self.limiter.retry_after(username, request.client)
+        if retry_after:
+            metrics.count_error("login_rate_limited")
+            raise HTTPError(429, "Too many failed login attempts", {"Retry-After": str(math.ceil(retry_after))})
+        # Verified on the password pool, which refuses work past its queue depth
+        start = time.perf_counter()
+        try:
+            check = auth.check_password(self.accounts, username, password)
+        except VerifierBusy as e:
+            raise HTTPError(503, str(e), {"Retry-After": "1"})
+        verified = await asyncio.wrap_future(check)
+        metrics.observe("authenticate", time.perf_counter() - start)
+        if not verified:
+            self.limiter.failure(username, request.client)
+            raise HTTPError(401, "Invalid username or password", challenge)
+        self.limiter.success(username)
+        return username
+
+    def _passkey(self, request):
+        passkey = request.headers.get("x-passkey")
+        if not passkey:
+            raise HTTPError(400, "The X-Passkey header is required")
+        return passkey
+
+    # Responses
+
+    async def _send(self, writer, status, body=b"", content_type=None, keep_alive=True, headers=None):
+        lines = [f"HTTP/1.1 {status} {_REASONS.get(status, 'Unknown')}", f"Content-Length: {len(body)}"]
+        if content_type:
+            lines.append(f"Content-Type: {content_type}")
+        lines.extend(f"{name}: {value}" for name, value in (headers or {}).items())
+        lines.append("Connection: keep-alive" if keep_alive else "Connection: close")
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+
+    async def _send_json(self, writer, status, payload, keep_alive=True, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        await self._send(writer, status, body, "application/json", keep_alive, headers)
+
+    # Handlers
+
+    async def health(self, request, writer, label):
+        await self._send_json(writer, 200, {"status": "ok"}, request.keep_alive())
+        return request.keep_alive()
+
+    async def list_items(self, request, writer, label):
+        try:
+            offset = max(0, int(request.query.get("offset", 0)))
+            limit = min(MAX_LIST_PAGE_SIZE, max(1, int(request.query.get("limit", LIST_PAGE_SIZE))))
+        except ValueError:
+            raise HTTPError(400, "offset and limit must be integers")
+        criteria = {name: request.query[param] for param, name in _SEARCH_PARAMS.items() if request.query.get(param)}
+        if "sort" in request.query or "order" in request.query:
+            criteria["sort"] = request.query.get("sort", "timestamp")
+            criteria["descending"] = request.query.get("order", "asc") == "desc"
+        store = (await self.run_blocking(self.vault.load_data)).store
+        if criteria:
+            try:
+                labels, total = store.search(request.username, offset, limit, **criteria)
+            except ValueError as e:
+                raise HTTPError(400, str(e))
+            items = store.list_items(request.username)
+            page = [(item_label, items[item_label]) for item_label in labels if item_label in items]
+        else:
+            page, total = store.page(request.username, offset, limit), store.count(request.username)
+        listing = [{
+            "label": item_label,
+            "type": item.get("type", "text"),
+            "timestamp": item.get("timestamp"),
+            "size": item.get("file_info", {}).get("size"),
+        } for item_label, item in page]
+        body = {"items": listing, "total": total, "offset": offset, "limit": limit}
+        await self._send_json(writer, 200, body, request.keep_alive())
+        return request.keep_alive()
+
+    async def store(self, request, writer, label):
+        if "content-length" not in request.headers:
+            raise HTTPError(411, "Content-Length is required")
+        if request.content_length > self.max_body_size:
+            raise HTTPError(413, f"Body exceeds the {self.max_body_size} byte limit")
+        passkey = self._passkey(request)
+        item_type = request.query.get("type", "file")
+        if item_type not in ("file", "text"):
+            raise HTTPError(400, "type must be 'file' or 'text'")
+
+        body = BodyReader(request, asyncio.get_running_loop())
+        content_type = request.headers.get("content-type") or ("text/plain" if item_type == "text" else None)
+        payload = await self.run_blocking(self.vault.encrypt_data, body, passkey, True,
+                                          content_type, request.content_length, request.username)
+        if request.body_remaining:
+            raise HTTPError(400, "Request body ended early")
+        if payload is None:
+            raise HTTPError(500, "Encryption failed")
+
+        item = {**payload, "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"), "type": item_type}
+        if item_type == "file":
+            item["file_info"] = {
+                "filename": request.headers.get("x-filename", label),
+                "type": request.headers.get("content-type", "application/octet-stream"),
+                "size": request.content_length,
+            }
+        durable = await self.run_blocking(self.vault.save_item, request.username, label, item)
+        await asyncio.wrap_future(durable)
+        await self._send_json(writer, 201, {"label": label, "size": request.content_length,
+                                            "encrypted_size": payload["blob"]["size"]}, request.keep_alive())
+        return request.keep_alive()
+
+    def _get_item(self, request, label):
+        item = self.vault.store.get(request.username, label)
+        if item is None:
+            raise HTTPError(404, f"No item labelled {label!r}")
+        return item
+
+    async def retrieve(self, request, writer, label):
+        passkey = self._passkey(request)
+        item = self._get_item(request, label)
+        if not await self.run_blocking(self.vault.verify_passkey, item, passkey):
+            raise HTTPError(403, "Incorrect passkey")
+        size_hint = item.get("file_info", {}).get("size")
+        plaintext = await self.run_blocking(self.vault.decrypt_to_file, get_payload(item), passkey, size_hint)
+        if plaintext is None:
+            raise HTTPError(422, "The item could not be decrypted")
+        with plaintext:
+            size = plaintext.seek(0, os.SEEK_END)
+            plaintext.seek(0)
+            content_type = (item.get("file_info", {}).get("type") if item.get("type") == "file"
+                            else "text/plain; charset=utf-8")
+            head = [f"HTTP/1.1 200 OK", f"Content-Length: {size}",
+                    f"Content-Type: {content_type or 'application/octet-stream'}",
+                    "Connection: keep-alive" if request.keep_alive() else "Connection: close"]
+            writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1"))
+            try:
+                while True:
+                    chunk = await self.run_blocking(plaintext.read, STREAM_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    writer.write(chunk)
+                    await writer.drain()
+            except ConnectionError:
+                raise
+            except Exception as e:
+                # The 200 and part of the body are already sent, so an error response would be
+                # read as body bytes; reset the connection so the client sees a truncated download
+                logger.error(f"API error while streaming {label!r}: {str(e)}")
+                metrics.count_error("api_retrieve")
+                writer.transport.abort()
+                return False
+        return request.keep_alive()
+
+    async def delete(self, request, writer, label):
+        self._get_item(request, label)
+        await self.run_blocking(self.vault.delete_item, request.username, label)
+        await asyncio.wrap_future(self.vault.store.flush())
+        await self._send(writer, 204, keep_alive=request.keep_alive())
+        return request.keep_alive()
+
+
+async def serve(api, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    """Run the API until cancelled"""
+    server = await asyncio.start_server(api.handle_connection, host, port, limit=MAX_HEADER_SIZE)
+    logger.info(f"Serving the vault API on http://{host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m secure_data.api", description="Serve the vault over HTTP")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="threads for crypto and storage")
+    parser.add_argument("--backend", default=config.STORAGE_BACKEND, choices=sorted(config.STORE_PATHS))
+    parser.add_argument("--store", help="store file (default: the backend's SECURE_APP_* path)")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    try:
+        vault = Vault(backend=args.backend, path=args.store)
+    except JournalLockedError as e:
+        parser.exit(2, f"Cannot open the store: {e}\n")
+    vault.resume_rotation()
+    vault.collect_chunks()
+    api = VaultAPI(vault, workers=args.workers)
+    try:
+        asyncio.run(serve(api, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        api.pool.shutdown(wait=True)
+        vault.store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Account password checks.
+
+Accounts are a plain {username: password hash} mapping owned by the caller
+(the Streamlit app keeps one per session), so these functions work the same
+from the UI, scripts and tests. Hashes are salted scrypt strings (see
+passwords.py), checked on the shared verification pool; a legacy SHA-256
+hash is replaced in the mapping by a scrypt one on the first successful
+login. login() puts authenticate() behind a LoginLimiter (see rate_limit.py)
+so rejected attempts cost no hashing.
+"""
+import hashlib
+import logging
+import threading
+
+from . import metrics, passwords
+from .group_commit import completed
+
+logger = logging.getLogger(__name__)
+
+
+class LoginRateLimited(Exception):
+    """Raised when a login attempt is rejected by the rate limiter, before any hashing"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Too many failed login attempts; retry in {retry_after:.0f} seconds")
+        self.retry_after = retry_after
+
+
+_DEMO_PASSWORDS = {"admin": "admin123", "user1": "password1"}
+_hashes = {}
+_hashes_lock = threading.Lock()
+_verified = passwords.VerifiedCache()
+
+
+def hash_passkey(passkey):
+    """Hash the passkey using SHA-256 (legacy item passkeys and account hashes)"""
+    return hashlib.sha256(passkey.encode()).hexdigest()
+
+
+def _cached_hashes():
+    """Return the demo account hashes and a dummy hash, computed once per process"""
+    with _hashes_lock:
+        if not _hashes:
+            for username, password in _DEMO_PASSWORDS.items():
+                _hashes[username] = passwords.hash_password(password)
+            # Unknown usernames are checked against this, so they take as long as known ones
+            _hashes[None] = passwords.hash_password("")
+        return _hashes
+
+
+def default_accounts():
+    """Return the demo accounts as a new {username: password hash} dict"""
+    return {username: stored for username, stored in _cached_hashes().items() if username is not None}
+
+
+def _check(accounts, username, password):
+    """Verify a password on a pool worker, rehashing a legacy or outdated hash that matches"""
+    stored = accounts.get(username)
+    if stored is None:
+        passwords.verify_password(password, _cached_hashes()[None])
+        return False
+    if not passwords.verify_password(password, stored):
+        return False
+    if passwords.needs_rehash(stored):
+        stored = accounts[username] = passwords.hash_password(password)
+        logger.info(f"Rehashed password for user: {username}")
+    _verified.add(username, password, stored)
+    return True
+
+
+def check_password(accounts, username, password, pool=None):
+    """Start checking a password on the verification pool, returning a Future of True or False
+
+    A password verified within the last PASSWORD_CACHE_TTL seconds is not
+    hashed again. Raises VerifierBusy if the pool's queue is full.
+    """
+    stored = accounts.get(username)
+    if stored is not None and (username, password, stored) in _verified:
+        return completed(True)
+    return (pool or passwords.default_pool()).submit(_check, accounts, username, password)
+
+
+@metrics.timed("authenticate")
+def authenticate(accounts, username, password):
+    """Return True if the password matches the account's hash, waiting for the verification pool"""
+    return check_password(accounts, username, password).result()
+
+
+def login(limiter, accounts, username, password, client=None):
+    """Authenticate through a LoginLimiter, raising LoginRateLimited if the attempt is not allowed"""
+    retry_after = limiter.retry_after(username, client)
+    if retry_after:
+        metrics.count_error("login_rate_limited")
+        raise LoginRateLimited(retry_after)
+    if authenticate(accounts, username, password):
+        limiter.success(username)
+        return True
+    limiter.failure(username, client)
+    return False
+
+
+def change_password(accounts, username, old_password, new_password, limiter=None, client=None):
+    """Change an account's password in place, returning False if the old password is wrong
+
+    With a limiter, the old password is checked through login().
+    """
+    if limiter is not None:
+        verified = login(limiter, accounts, username, old_password, client)
+    else:
+        verified = authenticate(accounts, username, old_password)
+    if verified:
+        accounts[username] = passwords.default_pool().submit(passwords.hash_password, new_password).result()
+        logger.info(f"Password changed for user: {username}")
+        return True
+    return False
@@ -0,0 +1,302 @@
+"""Incremental backups of the JSON store with point-in-time restore.
+
+Instead of a full copy of the data file per save, backups form chains under
+``<data file>.backups/``. A chain is one base snapshot followed by a segment
+of deltas, plus a fixed-width index of the restore points in the segment:
+
+    manifest.json       chains in order: {"id", "first_seq", "created"}
+    base-<id>.json      the whole store when the chain started (point first_seq)
+    delta-<id>.jsonl    one line per later save: {"seq", "time", "changes": [[user, label, item|null], ...]}
+    delta-<id>.idx      one 24-byte (seq, time, end offset in the segment) record per point
+
+Every save appends one delta line and one index record, so backup I/O is
+proportional to the change, not the store. A new chain starts once a
+segment has grown as large as its base (so a restore never replays more
+than about one base's worth of deltas), and only the newest max_chains
+chains are kept.
+
+Restoring to a point finds its chain in the manifest, binary-searches the
+chain's index for the point, then loads the base and replays the segment up
+to the point's offset. Nothing past that offset is read.
+
+Points only hold item metadata; the encrypted payloads stay in the blob
+store. So that a restored point can still be decrypted, the vault hands the
+payload of a deleted or overwritten item to hold() instead of deleting it,
+and ``held.jsonl`` records it with the newest chain at that time. Once every
+chain up to that one has expired, expired_holds() gives it back for deletion.
+
+``python -m secure_data.restore`` lists the points and restores one to a file.
+"""
+import json
+import logging
+import os
+import struct
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+MAX_CHAINS = 5
+MIN_SEGMENT_SIZE = 1024 * 1024  # chains of small stores still cover many saves
+MANIFEST = "manifest.json"
+HELD = "held.jsonl"
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+_POINT = struct.Struct(">QdQ")  # seq, time, end offset of the point's delta line
+
+
+def write_atomic(path, write):
+    """Write a text file through write(f) to a temporary file, then move it into place"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _append(path, data):
+    with open(path, "ab") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def apply_changes(data, changes):
+    """Apply [username, label, item or None] changes to a {username: {label: item}} dict"""
+    for username, label, item in changes:
+        if item is None:
+            items = data.get(username, {})
+            items.pop(label, None)
+            if not items:
+                data.pop(username, None)
+        else:
+            data.setdefault(username, {})[label] = item
+    return data
+
+
+class BackupChains:
+    """Base snapshots and delta segments of one store, with an index of restore points"""
+
+    def __init__(self, directory, max_chains=MAX_CHAINS, min_segment_size=MIN_SEGMENT_SIZE):
+        self.directory = directory
+        self.max_chains = max(1, max_chains)
+        self.min_segment_size = min_segment_size
+        self._chains = self._read_manifest()
+        self._next_seq = None
+        self._broken = False
+        self._held_lock = threading.Lock()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _files(self, chain):
+        chain_id = chain["id"]
+        return (self._path(f"base-{chain_id:06d}.json"), self._path(f"delta-{chain_id:06d}.jsonl"),
+                self._path(f"delta-{chain_id:06d}.idx"))
+
+    def _read_manifest(self):
+        try:
+            with open(self._path(MANIFEST), "r") as f:
+                return json.load(f)["chains"]
+        except FileNotFoundError:
+            return []
+
+    def _write_manifest(self):
+        write_atomic(self._path(MANIFEST), lambda f: json.dump({"chains": self._chains}, f, indent=2))
+
+    def _last_point(self, chain):
+        """Return the (seq, time, offset) of a chain's newest point"""
+        index_path = self._files(chain)[2]
+        size = os.path.getsize(index_path)
+        count = size // _POINT.size
+        with open(index_path, "rb") as f:
+            f.seek((count - 1) * _POINT.size)
+            return _POINT.unpack(f.read(_POINT.size))
+
+    def _segment_seq(self, segment_path):
+        """Return the highest seq of the complete delta lines in a segment, or 0"""
+        newest = 0
+        try:
+            with open(segment_path, "rb") as f:
+                for line in f:
+                    try:
+                        newest = max(newest, json.loads(line)["seq"])
+                    except (ValueError, KeyError, TypeError):
+                        continue
+        except OSError:
+            pass
+        return newest
+
+    def _resume_seq(self):
+        """Return the point number after the highest one found in any chain
+
+        A crash in the middle of a record can leave a delta line, or part of
+        one, past the chain's last point, or part of an index record. Appending
+        after either would corrupt the chain, so it is marked broken and the
+        next save starts a fresh chain instead. Every chain is scanned, and a
+        torn chain's segment too, so a new point never reuses a number.
+        """
+        newest = 0
+        for chain in self._chains:
+            newest = max(newest, chain["first_seq"])
+            _, segment_path, index_path = self._files(chain)
+            try:
+                seq, _, end = self._last_point(chain)
+                newest = max(newest, seq)
+                torn = os.path.getsize(segment_path) != end or os.path.getsize(index_path) % _POINT.size
+            except (OSError, struct.error):
+                torn = True
+            if torn:
+                newest = max(newest, self._segment_seq(segment_path))
+                if chain is self._chains[-1]:
+                    logger.warning(f"Backup chain {chain['id']} has a torn record; starting a new chain")
+                    self._broken = True
+        return newest + 1
+
+    def _start_chain(self, data, seq, now):
+        os.makedirs(self.directory, exist_ok=True)
+        chain = {"id": self._chains[-1]["id"] + 1 if self._chains else 1, "first_seq": seq,
+                 "created": time.strftime(TIME_FORMAT, time.localtime(now))}
+        base_path, segment_path, index_path = self._files(chain)
+        write_atomic(base_path, lambda f: json.dump(data, f, separators=(",", ":")))
+        open(segment_path, "wb").close()
+        _append(index_path, _POINT.pack(seq, now, 0))
+        self._chains.append(chain)
+        expired, self._chains = self._chains[:-self.max_chains], self._chains[-self.max_chains:]
+        self._write_manifest()
+        for old in expired:
+            for path in self._files(old):
+                if os.path.exists(path):
+                    os.remove(path)
+            logger.info(f"Removed backup chain {old['id']}")
+        logger.info(f"Started backup chain {chain['id']} at point {seq}")
+
+    def record(self, data, changes):
+        """Record one save: the changes it made and, when a new chain starts, the resulting data
+
+        A failed record marks the current chain broken, so the next save starts
+        a fresh chain from a full snapshot instead of leaving a gap in the deltas.
+        """
+        now = time.time()
+        try:
+            if self._next_seq is None:
+                self._next_seq = self._resume_seq()
+            seq = self._next_seq
+            if not self._chains or self._broken:
+                self._start_chain(data, seq, now)
+            else:
+                base_path, segment_path, index_path = self._files(self._chains[-1])
+                segment_size = os.path.getsize(segment_path)
+                if segment_size >= max(self.min_segment_size, os.path.getsize(base_path)):
+                    self._start_chain(data, seq, now)
+                else:
+                    line = json.dumps({"seq": seq, "time": now, "changes": changes}, separators=(",", ":"))
+                    line = line.encode("utf-8") + b"\n"
+                    # The index record goes last, so a point always refers to a complete delta
+                    _append(segment_path, line)
+                    _append(index_path, _POINT.pack(seq, now, segment_size + len(line)))
+            self._next_seq = seq + 1
+            self._broken = False
+        except Exception as e:
+            self._broken = True
+            logger.error(f"Error recording backup: {str(e)}")
+
+    def _read_held(self):
+        holds = []
+        try:
+            with open(self._path(HELD), "rb") as f:
+                for line in f:
+                    try:
+                        holds.append(json.loads(line))
+                    except ValueError:
+                        # A torn line loses its hold, so that payload is kept for good rather than deleted early
+                        continue
+        except FileNotFoundError:
+            pass
+        return holds
+
+    def hold(self, payload):
+        """Keep a released payload for as long as a retained point may refer to it"""
+        with self._held_lock:
+            os.makedirs(self.directory, exist_ok=True)
+            chain_id = self._chains[-1]["id"] if self._chains else 0
+            line = json.dumps({"chain": chain_id, "payload": payload}, separators=(",", ":"))
+            _append(self._path(HELD), line.encode("utf-8") + b"\n")
+
+    def held(self):
+        """Return every held payload, oldest first"""
+        with self._held_lock:
+            return [hold["payload"] for hold in self._read_held()]
+
+    def expired_holds(self):
+        """Remove and return the held payloads whose chains have all expired"""
+        with self._held_lock:
+            holds = self._read_held()
+            oldest = self._chains[0]["id"] if self._chains else None
+            expired, kept = [], []
+            for hold in holds:
+                (expired if oldest is None or hold["chain"] < oldest else kept).append(hold)
+            if expired:
+                write_atomic(self._path(HELD), lambda f: f.writelines(
+                    json.dumps(hold, separators=(",", ":")) + "\n" for hold in kept))
+            return [hold["payload"] for hold in expired]
+
+    def has_points(self):
+        """Return True if at least one restore point is retained"""
+        return bool(self._chains)
+
+    def points(self):
+        """Return every retained restore point as (seq, time) pairs, oldest first"""
+        found = []
+        for chain in self._chains:
+            with open(self._files(chain)[2], "rb") as f:
+                data = f.read()
+            for offset in range(0, len(data) - _POINT.size + 1, _POINT.size):
+                seq, at, _ = _POINT.unpack_from(data, offset)
+                found.append((seq, at))
+        return found
+
+    def _find(self, chain, seq=None, at=None):
+        """Binary-search a chain's index for the newest point with seq or time at or before the target"""
+        index_path = self._files(chain)[2]
+        with open(index_path, "rb") as f:
+            low, high = 0, os.path.getsize(index_path) // _POINT.size
+            while low < high:
+                middle = (low + high) // 2
+                f.seek(middle * _POINT.size)
+                point_seq, point_time, _ = _POINT.unpack(f.read(_POINT.size))
+                if (point_seq <= seq) if seq is not None else (point_time <= at):
+                    low = middle + 1
+                else:
+                    high = middle
+            if low == 0:
+                return None
+            f.seek((low - 1) * _POINT.size)
+            return _POINT.unpack(f.read(_POINT.size))
+
+    def restore(self, seq=None, at=None):
+        """Return the store as of a point: seq, the newest point at or before time at, or the newest
+
+        Raises LookupError if no retained point is that old.
+        """
+        for chain in reversed(self._chains):
+            if seq is not None and chain["first_seq"] > seq:
+                continue
+            if seq is None and at is None:
+                point = self._last_point(chain)
+            else:
+                point = self._find(chain, seq, at)
+            if point is None:
+                continue
+            base_path, segment_path, _ = self._files(chain)
+            with open(base_path, "r") as f:
+                data = json.load(f)
+            with open(segment_path, "rb") as f:
+                deltas = f.read(point[2])
+            for line in deltas.splitlines():
+                apply_changes(data, json.loads(line)["changes"])
+            logger.info(f"Restored backup point {point[0]}")
+            return data
+        raise LookupError("No retained backup point is that old")
+
@@ -0,0 +1,177 @@
+"""Content-addressed store for encrypted payloads.
+
+Payloads are written as raw binary objects under ``<root>/<hh>/<sha256>``,
+where ``hh`` is the first two hex digits of the digest. The metadata document
+only keeps a small reference to each object:
+
+    {"hash": "<sha256 hex>", "size": <bytes>, "offset": <start of payload>}
+
+``offset`` is the position of the payload inside the object file; standalone
+objects always start at 0, but readers honour it so objects can later be packed.
+"""
+import contextlib
+import hashlib
+import logging
+import mmap
+import os
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+
+class BlobNotFoundError(FileNotFoundError):
+    """Raised when a referenced blob is missing from the store"""
+
+
+def is_blob_ref(value):
+    """Return True if value looks like a blob reference"""
+    return isinstance(value, dict) and {"hash", "size", "offset"} <= value.keys()
+
+
+class BlobStore:
+    """Content-addressed directory of immutable binary objects"""
+
+    def __init__(self, root):
+        self.root = root
+        self._tmp_dir = os.path.join(root, "tmp")
+        os.makedirs(self._tmp_dir, exist_ok=True)
+
+    def path(self, ref_or_hash):
+        """Return the filesystem path of a blob"""
+        digest = ref_or_hash["hash"] if isinstance(ref_or_hash, dict) else ref_or_hash
+        if len(digest) != 64 or not all(c in "0123456789abcdef" for c in digest):
+            raise ValueError(f"Invalid blob hash: {digest!r}")
+        return os.path.join(self.root, digest[:2], digest)
+
+    def put_chunks(self, chunks):
+        """Write an iterable of byte chunks as a blob and return its reference
+
+        The data is hashed while it is written to a temporary file, so only one
+        chunk is held in memory at a time. Identical content is stored once.
+        """
+        return self._write(chunks)
+
+    def put_named(self, name, chunks):
+        """Write an iterable of byte chunks as a blob under a caller-chosen 64 hex digit name
+
+        Used for deduplicated chunks, whose names are keyed hashes of their
+        plaintext rather than hashes of the stored bytes. A blob already stored
+        under the name is replaced.
+        """
+        return self._write(chunks, name)
+
+    def _write(self, chunks, name=None):
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self._tmp_dir, prefix="blob-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    digest.update(chunk)
+                    size += len(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+            ref = {"hash": name or digest.hexdigest(), "size": size, "offset": 0}
+            final_path = self.path(ref)
+            if name is None and os.path.exists(final_path):
+                os.remove(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(final_path), exist_ok=True)
+                os.replace(tmp_path, final_path)
+            return ref
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def put_bytes(self, data):
+        """Store an in-memory buffer as a blob and return its reference"""
+        return self.put_chunks([data])
+
+    def open(self, ref):
+        """Open a blob for reading, positioned at the start of its payload"""
+        try:
+            f = open(self.path(ref), "rb")
+        except FileNotFoundError:
+            raise BlobNotFoundError(f"Blob not found: {ref['hash']}") from None
+        f.seek(ref["offset"])
+        return _LimitedReader(f, ref["size"])
+
+    def read(self, ref):
+        """Read a whole blob payload into memory"""
+        with self.open(ref) as f:
+            return f.read()
+
+    @contextlib.contextmanager
+    def map(self, ref):
+        """Memory-map a blob and yield a read-only memoryview of its payload
+
+        Pages are only read from disk as the view is consumed, so decrypting a
+        large payload never needs a heap copy of the ciphertext. The view must
+        not be used after the with block exits.
+        """
+        try:
+            f = open(self.path(ref), "rb")
+        except FileNotFoundError:
+            raise BlobNotFoundError(f"Blob not found: {ref['hash']}") from None
+        with f:
+            if ref["size"] == 0:
+                yield memoryview(b"")
+                return
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            view = memoryview(mapped)[ref["offset"]:ref["offset"] + ref["size"]]
+            try:
+                yield view
+            finally:
+                try:
+                    view.release()
+                    mapped.close()
+                except BufferError:
+                    # A slice is still referenced (e.g. by an exception traceback);
+                    # the mapping is released when the last slice is collected
+                    pass
+
+    def ref(self, name):
+        """Return the reference of a standalone blob stored under name"""
+        try:
+            size = os.path.getsize(self.path(name))
+        except FileNotFoundError:
+            raise BlobNotFoundError(f"Blob not found: {name}") from None
+        return {"hash": name, "size": size, "offset": 0}
+
+    def exists(self, ref):
+        """Return True if the blob is present"""
+        return os.path.exists(self.path(ref))
+
+    def delete(self, ref):
+        """Remove a blob, ignoring blobs that are already gone"""
+        try:
+            os.remove(self.path(ref))
+            logger.info(f"Removed blob: {ref['hash']}")
+        except FileNotFoundError:
+            pass
+
+
+class _LimitedReader:
+    """File wrapper that stops reading at the end of a blob's payload"""
+
+    def __init__(self, f, size):
+        self._f = f
+        self._remaining = size
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._f.read(size)
+        self._remaining -= len(data)
+        return data
+
+    def close(self):
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
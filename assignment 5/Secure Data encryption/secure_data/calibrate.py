@@ -0,0 +1,42 @@
+"""Pick scrypt costs for this host.
+
+    python -m secure_data.calibrate --target-ms 250 --password-target-ms 100
+
+prints the SECURE_APP_KDF_LOG2_N setting whose key derivation stays within
+the target time, and the SECURE_APP_PASSWORD_LOG2_N setting whose login
+password check does, with the memory and login throughput that cost gives
+the verification pool.
+"""
+import argparse
+import time
+
+from . import config, kdf, passwords
+
+MB = 1024 * 1024
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m secure_data.calibrate",
+                                     description="Pick scrypt costs for target derivation and password check times")
+    parser.add_argument("--target-ms", type=float, default=250.0, help="target derivation time in milliseconds")
+    parser.add_argument("--password-target-ms", type=float, default=100.0,
+                        help="target password check time in milliseconds")
+    parser.add_argument("--workers", type=int, default=config.PASSWORD_WORKERS,
+                        help="password pool size to estimate for (default: SECURE_APP_PASSWORD_WORKERS)")
+    args = parser.parse_args(argv)
+    log2_n = kdf.calibrate(args.target_ms / 1000)
+    print(f"SECURE_APP_KDF_LOG2_N={log2_n}")
+
+    password_log2_n = kdf.calibrate(args.password_target_ms / 1000)
+    stored = passwords.hash_password("calibration", password_log2_n)
+    start = time.perf_counter()
+    passwords.verify_password("calibration", stored)
+    seconds = time.perf_counter() - start
+    memory = 128 * kdf.DEFAULT_R * 2 ** password_log2_n
+    print(f"SECURE_APP_PASSWORD_LOG2_N={password_log2_n}")
+    print(f"# one check: {seconds * 1000:.0f}ms, {memory / MB:.0f}MB; {args.workers} workers: "
+          f"about {args.workers / seconds:.0f} logins/s, {args.workers * memory / MB:.0f}MB at peak")
+
+
+if __name__ == "__main__":
+    main()
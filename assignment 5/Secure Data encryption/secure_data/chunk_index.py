@@ -0,0 +1,162 @@
+"""Reference-counted index of deduplicated chunks.
+
+Chunked items (see chunking.py) store each distinct chunk once per user. This
+SQLite index records, per user, every chunk ID with its plaintext size and a
+reference count, and per manifest (one chunked payload) the chunks it uses:
+
+    chunks(username, chunk_id, size, refs)
+    manifest_chunks(manifest_id, username, chunk_id, count, created)
+
+The ordering of updates keeps a crash from ever leaving an item pointing at a
+missing chunk; the worst case is a chunk that is no longer needed:
+
+- storing acquires the references before the chunk blobs are written, so a
+  concurrent delete cannot remove a chunk that is about to be used
+- deleting removes the item first, then releases its manifest; chunk blobs
+  whose count drops to zero are removed inside the same write transaction,
+  so a concurrent store either sees the chunk gone or keeps it alive
+- manifests left behind by interrupted uploads are released by
+  Vault.collect_chunks() once no item refers to them
+"""
+import sqlite3
+import threading
+import time
+
+
+class ChunkIndex:
+    """Per-user chunk reference counts in a SQLite file, safe to share between threads"""
+
+    def __init__(self, path, timeout=30.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        with self._connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS chunks (
+                    username TEXT NOT NULL,
+                    chunk_id TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    refs INTEGER NOT NULL,
+                    PRIMARY KEY (username, chunk_id)
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS manifest_chunks (
+                    manifest_id TEXT NOT NULL,
+                    username TEXT NOT NULL,
+                    chunk_id TEXT NOT NULL,
+                    count INTEGER NOT NULL,
+                    created REAL NOT NULL,
+                    PRIMARY KEY (manifest_id, chunk_id)
+                )
+            """)
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False,
+                                   isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def _transaction(self, work):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = work(conn)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return result
+
+    def acquire(self, username, manifest_id, chunks):
+        """Add a reference from a manifest to each (chunk ID, size) pair
+
+        Returns the set of chunk IDs that were not referenced before, whose
+        blobs the caller must write.
+        """
+        counts, sizes = {}, {}
+        for chunk_id, size in chunks:
+            counts[chunk_id] = counts.get(chunk_id, 0) + 1
+            sizes[chunk_id] = size
+        if not counts:
+            return set()
+        now = time.time()
+
+        def work(conn):
+            placeholders = ",".join("?" * len(counts))
+            known = {row[0] for row in conn.execute(
+                f"SELECT chunk_id FROM chunks WHERE username = ? AND chunk_id IN ({placeholders})",
+                (username, *counts))}
+            conn.executemany("""
+                INSERT INTO chunks (username, chunk_id, size, refs) VALUES (?, ?, ?, ?)
+                ON CONFLICT (username, chunk_id) DO UPDATE SET refs = refs + excluded.refs
+            """, [(username, chunk_id, sizes[chunk_id], count) for chunk_id, count in counts.items()])
+            conn.executemany("""
+                INSERT INTO manifest_chunks (manifest_id, username, chunk_id, count, created) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (manifest_id, chunk_id) DO UPDATE SET count = count + excluded.count
+            """, [(manifest_id, username, chunk_id, count, now) for chunk_id, count in counts.items()])
+            return set(counts) - known
+
+        return self._transaction(work)
+
+    def release(self, manifest_id, on_unreferenced):
+        """Drop every reference held by a manifest
+
+        on_unreferenced(chunk_id) is called, inside the write transaction, for
+        each chunk no manifest refers to any more; it should delete the blob.
+        Returns the number of chunks released.
+        """
+        def work(conn):
+            rows = conn.execute(
+                "SELECT username, chunk_id, count FROM manifest_chunks WHERE manifest_id = ?",
+                (manifest_id,)).fetchall()
+            conn.execute("DELETE FROM manifest_chunks WHERE manifest_id = ?", (manifest_id,))
+            conn.executemany("UPDATE chunks SET refs = refs - ? WHERE username = ? AND chunk_id = ?",
+                             [(count, username, chunk_id) for username, chunk_id, count in rows])
+            for username, chunk_id, _ in rows:
+                dead = conn.execute("DELETE FROM chunks WHERE username = ? AND chunk_id = ? AND refs <= 0",
+                                    (username, chunk_id)).rowcount
+                if dead:
+                    on_unreferenced(chunk_id)
+            return len(rows)
+
+        return self._transaction(work)
+
+    def manifests(self, older_than=None):
+        """Return {manifest ID: username} for every manifest, optionally only those created before a time"""
+        query = "SELECT DISTINCT manifest_id, username FROM manifest_chunks"
+        params = ()
+        if older_than is not None:
+            query += " WHERE created < ?"
+            params = (older_than,)
+        return dict(self._connection().execute(query, params).fetchall())
+
+    def stats(self, username=None):
+        """Return chunk counts and sizes: how much plaintext is referenced versus stored once"""
+        query = "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(size * refs), 0), COALESCE(SUM(refs), 0) FROM chunks"
+        params = ()
+        if username is not None:
+            query += " WHERE username = ?"
+            params = (username,)
+        chunks, unique_bytes, referenced_bytes, references = self._connection().execute(query, params).fetchone()
+        return {
+            "chunks": chunks,
+            "references": references,
+            "unique_bytes": unique_bytes,
+            "referenced_bytes": referenced_bytes,
+        }
+
+    def close(self):
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+        self._local = threading.local()
@@ -0,0 +1,155 @@
+"""Content-defined chunking of item plaintext for deduplication.
+
+A chunk ends wherever a rolling hash of the last WINDOW_SIZE bytes has its top
+AVERAGE_BITS bits clear, so boundaries follow the content rather than fixed
+offsets: inserting or removing bytes early in a file only changes the chunks
+around the edit, and the rest of a near-identical upload is found again.
+Chunks are kept between MIN_CHUNK_SIZE and MAX_CHUNK_SIZE.
+
+The hash is a polynomial over the window (each byte first mapped through a
+fixed random table) computed mod 2**32 for a whole block at once with numpy:
+
+    H(i) = sum(T[b(k)] * P**(i - k) for k in window) = P**i * (S(i) - S(i - w))
+    S(i) = sum(T[b(k)] * P**-k for k <= i)
+
+so finding the boundaries of a block costs a few vector operations per byte.
+
+Chunks are stored once per user under an ID keyed by a per-user secret, and
+encrypted under a key derived from their content with the same secret (see
+chunk_ids() and Vault.seal_chunks()). Each stored chunk starts with a codec
+byte, so chunks are compressed independently of the item they first came from.
+"""
+import bz2
+import hashlib
+import hmac
+import zlib
+
+MIN_CHUNK_SIZE = 16 * 1024
+MAX_CHUNK_SIZE = 256 * 1024
+AVERAGE_BITS = 16  # about 64KB between boundaries, on top of MIN_CHUNK_SIZE
+WINDOW_SIZE = 48
+READ_SIZE = 1024 * 1024
+MIN_ITEM_SIZE = 2 * MIN_CHUNK_SIZE  # smaller items are stored as one blob
+
+_MULTIPLIER = 0x01000193  # odd, so it has an inverse mod 2**32
+_CODEC_BYTES = {None: b"\x00", "zlib": b"\x01", "bz2": b"\x02"}
+_CODEC_NAMES = {value[0]: name for name, value in _CODEC_BYTES.items()}
+_tables = {}
+
+
+def _arrays(length):
+    """Return (byte table, powers, inverse powers) as uint32 arrays covering length positions"""
+    import numpy as np
+    cached = _tables.get("arrays")
+    if cached is None or len(cached[1]) < length:
+        length = max(length, READ_SIZE + MAX_CHUNK_SIZE)
+        table = np.frombuffer(hashlib.shake_128(b"secure-data/chunking/v1").digest(1024), dtype="<u4")
+        powers = np.full(length, _MULTIPLIER, dtype=np.uint32)
+        powers[0] = 1
+        np.cumprod(powers, out=powers)
+        inverses = np.full(length, pow(_MULTIPLIER, -1, 2 ** 32), dtype=np.uint32)
+        inverses[0] = 1
+        np.cumprod(inverses, out=inverses)
+        cached = _tables["arrays"] = (table.astype(np.uint32), powers, inverses)
+    return cached
+
+
+def boundaries(data, final=False, min_size=MIN_CHUNK_SIZE, max_size=MAX_CHUNK_SIZE, bits=AVERAGE_BITS):
+    """Return the end offsets of the complete chunks at the start of data
+
+    Without final, bytes after the last boundary are left for the caller to
+    carry into the next block; with it they form the last chunk.
+    """
+    import numpy as np
+    length = len(data)
+    if length == 0:
+        return []
+    table, powers, inverses = _arrays(length)
+    mapped = table[np.frombuffer(data, dtype=np.uint8)]
+    sums = np.cumsum(mapped * inverses[:length], dtype=np.uint32)
+    window = sums.copy()
+    window[WINDOW_SIZE:] -= sums[:-WINDOW_SIZE]
+    hashes = window * powers[:length]
+    candidates = np.flatnonzero((hashes >> np.uint32(32 - bits)) == 0) + 1
+
+    cuts = []
+    start = 0
+    for end in candidates.tolist():
+        while end - start > max_size:
+            start += max_size
+            cuts.append(start)
+        if end - start >= min_size:
+            cuts.append(end)
+            start = end
+    while length - start > max_size:
+        start += max_size
+        cuts.append(start)
+    if final and start < length:
+        cuts.append(length)
+    return cuts
+
+
+def iter_chunks(src, read_size=READ_SIZE):
+    """Yield the content-defined chunks of bytes or a readable file-like object"""
+    if isinstance(src, (bytes, bytearray, memoryview)):
+        data = bytes(src)
+        start = 0
+        for end in boundaries(data, final=True):
+            yield data[start:end]
+            start = end
+        return
+    buffer = b""
+    while True:
+        block = src.read(read_size)
+        final = not block
+        buffer += block or b""
+        start = 0
+        for end in boundaries(buffer, final=final):
+            yield buffer[start:end]
+            start = end
+        buffer = buffer[start:]
+        if final:
+            return
+
+
+def chunk_ids(secret, chunk):
+    """Return (chunk ID, chunk key) for a chunk under a user's chunk secret
+
+    Both are keyed hashes of the content, so the same chunk always gets the
+    same ID and key for one user and unrelated ones for anyone else.
+    """
+    chunk_id = hmac.new(secret, b"id\x00" + chunk, hashlib.sha256).hexdigest()
+    chunk_key = hmac.new(secret, b"key\x00" + chunk, hashlib.sha256).digest()
+    return chunk_id, chunk_key
+
+
+def pack_chunk(chunk, codec=None):
+    """Return a chunk prefixed with its codec byte, compressed if that makes it smaller"""
+    if codec == "zlib":
+        packed = zlib.compress(chunk, 6)
+    elif codec == "bz2":
+        packed = bz2.compress(chunk, 9)
+    else:
+        packed = None
+    if packed is None or len(packed) >= len(chunk):
+        return _CODEC_BYTES[None] + chunk
+    return _CODEC_BYTES[codec] + packed
+
+
+def unpack_chunk(packed, size):
+    """Reverse pack_chunk(), checking the result is size bytes long"""
+    packed = bytes(packed)
+    try:
+        codec = _CODEC_NAMES[packed[0]]
+    except (IndexError, KeyError):
+        raise ValueError("Unknown chunk codec") from None
+    if codec == "zlib":
+        decompressor = zlib.decompressobj()
+        chunk = decompressor.decompress(packed[1:], size + 1)
+    elif codec == "bz2":
+        chunk = bz2.BZ2Decompressor().decompress(packed[1:], size + 1)
+    else:
+        chunk = packed[1:]
+    if len(chunk) != size:
+        raise ValueError("Chunk does not match its recorded size")
+    return chunk
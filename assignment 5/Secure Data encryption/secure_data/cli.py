@@ -0,0 +1,254 @@
+"""Batch encrypt and decrypt directory trees against the app's store.
+
+    python -m secure_data.cli encrypt ./reports --user admin --prefix reports/
+    python -m secure_data.cli decrypt ./restored --user admin --prefix reports/
+
+``encrypt`` walks a directory tree and stores every file as a "file" item
+labelled with its relative path (after an optional prefix), exactly as if it
+had been uploaded in the app. Files are streamed through the cipher on a pool
+of worker threads and committed to the store one batch at a time. A file
+whose item already records the same size and modification time is skipped,
+so an interrupted run picks up where it stopped when started again.
+
+``decrypt`` writes the items under a prefix back out as files. Each file is
+written to a ``.part`` file and renamed when complete, and files already
+present with the recorded size are skipped, so it resumes the same way.
+
+The passkey is read from --passkey-file, the SECURE_APP_PASSKEY environment
+variable, or prompted for; it is never taken on the command line. Storage
+options default to the same SECURE_APP_* settings as the app. The default
+journal store can only be open in one process, so while the app or API is
+running the CLI refuses to start; use --backend sqlite or sharded instead.
+"""
+import argparse
+import getpass
+import logging
+import mimetypes
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from cryptography.exceptions import InvalidTag
+
+from . import config
+from .journal_store import JournalLockedError
+from .vault import Vault, get_payload
+
+DEFAULT_BATCH_SIZE = 256
+PART_SUFFIX = ".part"
+
+
+def read_passkey(args, confirm=False):
+    """Return the passkey from a file, the environment or an interactive prompt"""
+    if args.passkey_file:
+        with open(args.passkey_file, "r") as f:
+            return f.read().rstrip("\r\n")
+    if os.getenv("SECURE_APP_PASSKEY"):
+        return os.environ["SECURE_APP_PASSKEY"]
+    passkey = getpass.getpass("Passkey: ")
+    if confirm and getpass.getpass("Confirm passkey: ") != passkey:
+        raise SystemExit("Passkeys do not match")
+    if not passkey:
+        raise SystemExit("A passkey is required")
+    return passkey
+
+
+def open_vault(args, workers):
+    return Vault(
+        backend=args.backend,
+        path=args.store,
+        blob_dir=args.blob_dir,
+        keyring_file=args.keyring,
+        upload_workers=workers,
+        export_workers=workers,
+    )
+
+
+def walk_files(root):
+    """Yield (path, relative posix path) for every regular file under root, in sorted order"""
+    for directory, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            path = os.path.join(directory, filename)
+            if os.path.isfile(path) and not os.path.islink(path):
+                yield path, os.path.relpath(path, root).replace(os.sep, "/")
+
+
+def label_to_path(label):
+    """Turn a label into a relative path that cannot escape the output directory"""
+    parts = [part for part in label.replace("\\", "/").split("/") if part not in ("", ".", "..")]
+    return os.path.join(*parts) if parts else "_"
+
+
+def _is_current(item, stat):
+    info = (item or {}).get("file_info", {})
+    return info.get("size") == stat.st_size and info.get("mtime") == stat.st_mtime_ns
+
+
+def encrypt_tree(vault, root, username, passkey, prefix="", batch_size=DEFAULT_BATCH_SIZE, log=print):
+    """Encrypt every new or changed file under root into the store, returning (stored, skipped, failed)"""
+    if not os.path.isdir(root):
+        raise SystemExit(f"Not a directory: {root}")
+    stored = skipped = failed = 0
+    pending = []
+
+    def flush():
+        nonlocal stored, failed
+        files = []
+        try:
+            for path, label, stat in pending:
+                f = open(path, "rb")
+                files.append(f)
+            content_types = [mimetypes.guess_type(path)[0] for path, label, stat in pending]
+            results = vault.encrypt_files(files, passkey, content_types=content_types, username=username)
+        finally:
+            for f in files:
+                f.close()
+        timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
+        entries = []
+        for (path, label, stat), (_, payload) in zip(pending, results):
+            if payload is None:
+                failed += 1
+                log(f"FAILED {path}")
+                continue
+            entries.append((username, label, {
+                **payload,
+                "timestamp": timestamp,
+                "type": "file",
+                "file_info": {
+                    "filename": os.path.basename(path),
+                    "type": mimetypes.guess_type(path)[0] or "application/octet-stream",
+                    "size": stat.st_size,
+                    "mtime": stat.st_mtime_ns,
+                },
+            }))
+        # Each committed batch is a resume point
+        if entries:
+            vault.save_items(entries, wait=True)
+        stored += len(entries)
+        log(f"stored {stored} file(s), skipped {skipped}, failed {failed}")
+        pending.clear()
+
+    existing = vault.store.list_items(username)
+    for path, relative in walk_files(root):
+        label = f"{prefix}{relative}"
+        stat = os.stat(path)
+        if stat.st_size > config.MAX_FILE_SIZE:
+            failed += 1
+            log(f"FAILED {path}: larger than SECURE_APP_MAX_FILE_SIZE")
+            continue
+        if _is_current(existing.get(label), stat):
+            skipped += 1
+            continue
+        pending.append((path, label, stat))
+        if len(pending) >= batch_size:
+            flush()
+    if pending:
+        flush()
+    return stored, skipped, failed
+
+
+def decrypt_tree(vault, out_dir, username, passkey, prefix="", workers=config.EXPORT_WORKERS, log=print):
+    """Write the user's items under prefix into out_dir, returning (written, skipped, failed)"""
+    items = [(label, item) for label, item in vault.store.list_items(username).items()
+             if label.startswith(prefix)]
+    written = skipped = failed = 0
+
+    def decrypt_one(label, item):
+        path = os.path.join(out_dir, label_to_path(label[len(prefix):]))
+        if item.get("type") != "file":
+            path += ".txt"
+        expected_size = item.get("file_info", {}).get("size")
+        if expected_size is not None and os.path.isfile(path) and os.path.getsize(path) == expected_size:
+            return "skipped", path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        part_path = path + PART_SUFFIX
+        try:
+            with open(part_path, "wb") as out:
+                vault.decrypt_into(get_payload(item), passkey, out)
+            os.replace(part_path, path)
+        except Exception:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            raise
+        return "written", path
+
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="decrypt") as pool:
+        futures = {pool.submit(decrypt_one, label, item): label for label, item in items}
+        for future in as_completed(futures):
+            try:
+                outcome, _ = future.result()
+            except InvalidTag:
+                failed += 1
+                log(f"FAILED {futures[future]}: the passkey does not open this item")
+                continue
+            except Exception as e:
+                failed += 1
+                log(f"FAILED {futures[future]}: {type(e).__name__} {str(e)}".rstrip())
+                continue
+            if outcome == "written":
+                written += 1
+            else:
+                skipped += 1
+            if (written + skipped) % 100 == 0:
+                log(f"written {written} file(s), skipped {skipped}, failed {failed}")
+    return written, skipped, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m secure_data.cli",
+                                     description="Batch encrypt and decrypt directory trees")
+    parser.add_argument("--backend", default=config.STORAGE_BACKEND, choices=sorted(config.STORE_PATHS))
+    parser.add_argument("--store", help="store file (default: the backend's SECURE_APP_* path)")
+    parser.add_argument("--blob-dir", default=config.BLOB_DIR)
+    parser.add_argument("--keyring", default=config.KEYRING_FILE)
+    parser.add_argument("--passkey-file", help="read the passkey from this file")
+    parser.add_argument("--workers", type=int, default=config.UPLOAD_WORKERS)
+    parser.add_argument("-q", "--quiet", action="store_true", help="only report failures and the summary")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    encrypt = commands.add_parser("encrypt", help="encrypt a directory tree into the store")
+    encrypt.add_argument("source", help="directory to encrypt")
+    encrypt.add_argument("--user", required=True, help="owner of the stored items")
+    encrypt.add_argument("--prefix", default="", help="prepended to every label, e.g. 'reports/'")
+    encrypt.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                         help="files committed to the store per write")
+
+    decrypt = commands.add_parser("decrypt", help="decrypt stored items into a directory")
+    decrypt.add_argument("output", help="directory to write into")
+    decrypt.add_argument("--user", required=True, help="owner of the items")
+    decrypt.add_argument("--prefix", default="", help="only items whose label starts with this")
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    def log(message):
+        if not args.quiet or message.startswith("FAILED"):
+            print(message, file=sys.stderr, flush=True)
+
+    passkey = read_passkey(args, confirm=args.command == "encrypt")
+    try:
+        vault = open_vault(args, args.workers)
+    except JournalLockedError as e:
+        print(f"Cannot open the store: {e}", file=sys.stderr)
+        return 2
+    start = time.perf_counter()
+    try:
+        if args.command == "encrypt":
+            done, skipped, failed = encrypt_tree(vault, args.source, args.user, passkey,
+                                                 args.prefix, args.batch_size, log)
+            verb = "Encrypted"
+        else:
+            done, skipped, failed = decrypt_tree(vault, args.output, args.user, passkey,
+                                                 args.prefix, args.workers, log)
+            verb = "Decrypted"
+    finally:
+        vault.store.close()
+    print(f"{verb} {done} file(s) in {time.perf_counter() - start:.1f}s; "
+          f"{skipped} already done, {failed} failed")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,212 @@
+"""Optional compression applied to plaintext before it is encrypted.
+
+Encrypted data does not compress, so this is the only point where stored
+items can shrink. choose_codec() picks a codec per item from its MIME type
+and the byte entropy of a sample from the start of the data:
+
+    already-compressed media and archives   -> stored as is
+    sample entropy >= 7.5 bits/byte         -> stored as is (random-looking)
+    text-like or entropy < 5 bits/byte      -> bz2 (zlib above BZ2_MAX_SIZE)
+    anything else                           -> zlib
+
+bz2 at level 9 compresses text almost as well as lzma's default preset at
+several times its speed; zlib is faster again and covers large and mixed
+binary items.
+
+The codec name is recorded on the item as ``compression``; items without it
+are stored uncompressed. Both directions stream: compressing_reader() wraps
+the plaintext source for the encryptor and DecompressingWriter wraps the
+decryptor's output, so memory stays bounded regardless of item size.
+"""
+import bz2
+import zlib
+
+SAMPLE_SIZE = 64 * 1024
+MIN_SIZE = 512  # smaller items are not worth a codec header
+READ_SIZE = 256 * 1024
+OUTPUT_CHUNK_SIZE = 1024 * 1024
+BZ2_MAX_SIZE = 32 * 1024 * 1024  # larger items use zlib, which is several times faster
+HIGH_ENTROPY = 7.5
+LOW_ENTROPY = 5.0
+ZLIB_LEVEL = 6
+BZ2_LEVEL = 9
+
+# MIME types whose content is already compressed
+_COMPRESSED_TYPES = {
+    "application/zip", "application/gzip", "application/x-gzip", "application/x-bzip2",
+    "application/x-xz", "application/x-7z-compressed", "application/vnd.rar", "application/x-rar-compressed",
+    "application/zstd", "application/x-zstd", "application/java-archive", "application/epub+zip",
+    "application/vnd.android.package-archive",
+}
+_COMPRESSED_PREFIXES = ("image/", "video/", "audio/", "application/vnd.openxmlformats-officedocument.",
+                        "application/vnd.oasis.opendocument.")
+_UNCOMPRESSED_MEDIA = {"image/svg+xml", "image/bmp", "image/x-ms-bmp", "image/tiff", "audio/wav", "audio/x-wav"}
+_TEXT_TYPES = {"application/json", "application/xml", "application/javascript", "application/x-ndjson",
+               "application/sql", "application/x-yaml", "application/yaml", "application/x-sh", "image/svg+xml"}
+# Leading bytes of compressed formats, for uploads with a generic MIME type
+_COMPRESSED_MAGIC = (
+    b"\x89PNG", b"\xff\xd8\xff", b"GIF8", b"PK\x03\x04", b"\x1f\x8b", b"BZh", b"\xfd7zXZ",
+    b"7z\xbc\xaf", b"Rar!", b"\x28\xb5\x2f\xfd", b"OggS", b"fLaC", b"ID3", b"RIFF",
+)
+
+CODECS = ("zlib", "bz2")
+
+
+def entropy(sample):
+    """Return the Shannon entropy of a byte sample in bits per byte (0 to 8)"""
+    if not sample:
+        return 0.0
+    import numpy as np
+    counts = np.bincount(np.frombuffer(sample, dtype=np.uint8), minlength=256)
+    probabilities = counts[counts > 0] / len(sample)
+    return float(-(probabilities * np.log2(probabilities)).sum())
+
+
+def _is_compressed_type(mime_type):
+    if mime_type in _UNCOMPRESSED_MEDIA:
+        return False
+    return mime_type in _COMPRESSED_TYPES or mime_type.startswith(_COMPRESSED_PREFIXES)
+
+
+def _is_text_type(mime_type):
+    return mime_type.startswith("text/") or mime_type in _TEXT_TYPES or mime_type.endswith(("+json", "+xml"))
+
+
+def choose_codec(mime_type, sample, size=None):
+    """Return the codec for data of the given MIME type starting with sample, or None to store it as is
+
+    size is the total plaintext size if known; without it the sample is taken
+    to be all of the data when it is shorter than SAMPLE_SIZE.
+    """
+    mime_type = (mime_type or "").split(";")[0].strip().lower()
+    if size is None and len(sample) < SAMPLE_SIZE:
+        size = len(sample)
+    if size is not None and size < MIN_SIZE:
+        return None
+    if _is_compressed_type(mime_type) or bytes(sample[:4]).startswith(_COMPRESSED_MAGIC):
+        return None
+    bits = entropy(sample)
+    if bits >= HIGH_ENTROPY:
+        return None
+    if _is_text_type(mime_type) or bits < LOW_ENTROPY:
+        return "bz2" if size is not None and size <= BZ2_MAX_SIZE else "zlib"
+    return "zlib"
+
+
+def _compressor(codec):
+    if codec == "zlib":
+        return zlib.compressobj(ZLIB_LEVEL)
+    if codec == "bz2":
+        return bz2.BZ2Compressor(BZ2_LEVEL)
+    raise ValueError(f"Unknown compression codec: {codec!r} (expected one of {', '.join(CODECS)})")
+
+
+class _PrefixedReader:
+    """Reader that replays already-read leading bytes before the rest of a source"""
+
+    def __init__(self, head, reader):
+        self._head = memoryview(head)
+        self._reader = reader
+
+    def read(self, size=-1):
+        if self._head:
+            if size is None or size < 0 or size > len(self._head):
+                size = len(self._head)
+            chunk, self._head = self._head[:size], self._head[size:]
+            return bytes(chunk)
+        return self._reader.read(size) if self._reader is not None else b""
+
+
+def source_size(src):
+    """Return the number of bytes left in src if it can be told without reading it, else None"""
+    if isinstance(src, (bytes, bytearray)):
+        return len(src)
+    if isinstance(src, memoryview):
+        return src.nbytes
+    try:
+        if src.seekable():
+            position = src.tell()
+            end = src.seek(0, 2)
+            src.seek(position)
+            return end - position
+    except (AttributeError, OSError):
+        pass
+    return None
+
+
+def sample_source(src, size=SAMPLE_SIZE):
+    """Return (sample, source): the first size bytes of src and a source still yielding all of it"""
+    if isinstance(src, (bytes, bytearray, memoryview)):
+        return bytes(src[:size]), src
+    head = src.read(size) or b""
+    return head, _PrefixedReader(head, src)
+
+
+class _CompressingReader:
+    """File-like view of a source that yields its compressed bytes"""
+
+    def __init__(self, reader, codec):
+        self._reader = reader
+        self._compressor = _compressor(codec)
+        self._buffer = bytearray()
+        self._done = False
+
+    def read(self, size=-1):
+        while not self._done and (size is None or size < 0 or len(self._buffer) < size):
+            data = self._reader.read(READ_SIZE)
+            if data:
+                self._buffer += self._compressor.compress(data)
+            else:
+                self._buffer += self._compressor.flush()
+                self._done = True
+        if size is None or size < 0:
+            size = len(self._buffer)
+        chunk = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return chunk
+
+
+def compressing_reader(src, codec):
+    """Wrap bytes or a readable file so reading it yields the data compressed with codec"""
+    if isinstance(src, (bytes, bytearray, memoryview)):
+        src = _PrefixedReader(src, None)
+    return _CompressingReader(src, codec)
+
+
+class DecompressingWriter:
+    """Writable that decompresses what is written to it into out
+
+    Output is produced at most OUTPUT_CHUNK_SIZE bytes at a time, so a highly
+    compressible item cannot balloon memory. close() checks that the
+    compressed stream was complete; it does not close out.
+    """
+
+    def __init__(self, out, codec):
+        if codec == "zlib":
+            self._decompressor = zlib.decompressobj()
+        elif codec == "bz2":
+            self._decompressor = bz2.BZ2Decompressor()
+        else:
+            raise ValueError(f"Unknown compression codec: {codec!r} (expected one of {', '.join(CODECS)})")
+        self._codec = codec
+        self._out = out
+
+    def write(self, data):
+        decompressor = self._decompressor
+        if self._codec == "zlib":
+            pending = bytes(data)
+            while pending:
+                self._out.write(decompressor.decompress(pending, OUTPUT_CHUNK_SIZE))
+                pending = decompressor.unconsumed_tail
+        else:
+            self._out.write(decompressor.decompress(bytes(data), OUTPUT_CHUNK_SIZE))
+            while not decompressor.eof and not decompressor.needs_input:
+                self._out.write(decompressor.decompress(b"", OUTPUT_CHUNK_SIZE))
+        return len(data)
+
+    def close(self):
+        if self._codec == "zlib":
+            self._out.write(self._decompressor.flush())
+        if not self._decompressor.eof:
+            raise ValueError("Compressed payload is truncated")
+
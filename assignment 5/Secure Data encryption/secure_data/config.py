@@ -0,0 +1,37 @@
+"""Settings read from SECURE_APP_* environment variables.
+
+Shared by the Streamlit app and headless users of the package; every value
+can also be overridden per Vault through its constructor.
+"""
+import os
+
+from . import kdf
+
+DATA_FILE = os.getenv('SECURE_APP_DATA_FILE', 'encrypted_data.json')
+JOURNAL_FILE = os.getenv('SECURE_APP_JOURNAL_FILE', 'encrypted_data.journal')
+SQLITE_FILE = os.getenv('SECURE_APP_SQLITE_FILE', 'encrypted_data.db')
+SHARD_DIR = os.getenv('SECURE_APP_SHARD_DIR', 'encrypted_data.shards')
+STORAGE_BACKEND = os.getenv('SECURE_APP_STORAGE_BACKEND', 'journal')  # json, journal, sqlite or sharded
+STORE_PATHS = {"json": DATA_FILE, "journal": JOURNAL_FILE, "sqlite": SQLITE_FILE, "sharded": SHARD_DIR}
+BLOB_DIR = os.getenv('SECURE_APP_BLOB_DIR', 'encrypted_blobs')
+KEYRING_FILE = os.getenv('SECURE_APP_KEYRING_FILE', 'keyring.json')
+MAX_FILE_SIZE = int(os.getenv('SECURE_APP_MAX_FILE_SIZE', 200 * 1024 * 1024))  # 200MB default
+DOWNLOAD_SPOOL_SIZE = int(os.getenv('SECURE_APP_DOWNLOAD_SPOOL_SIZE', 8 * 1024 * 1024))  # decrypt in memory up to 8MB
+KDF_LOG2_N = int(os.getenv('SECURE_APP_KDF_LOG2_N', kdf.DEFAULT_LOG2_N))  # scrypt cost; see `python -m secure_data.calibrate`
+KEY_CACHE_SIZE = int(os.getenv('SECURE_APP_KEY_CACHE_SIZE', kdf.DEFAULT_CACHE_SIZE))
+KEY_CACHE_TTL = int(os.getenv('SECURE_APP_KEY_CACHE_TTL', kdf.DEFAULT_CACHE_TTL))  # seconds
+UPLOAD_WORKERS = int(os.getenv('SECURE_APP_UPLOAD_WORKERS', min(8, os.cpu_count() or 1)))  # files encrypted concurrently
+EXPORT_WORKERS = int(os.getenv('SECURE_APP_EXPORT_WORKERS', min(8, os.cpu_count() or 1)))  # items decrypted concurrently
+EXPORT_MAX_SIZE = int(os.getenv('SECURE_APP_EXPORT_MAX_SIZE', 512 * 1024 * 1024))  # largest archive the app offers; Streamlit holds downloads in memory
+WRITE_BEHIND_MS = float(os.getenv('SECURE_APP_WRITE_BEHIND_MS', 2))  # group commit window; 0 writes synchronously
+COMPRESSION = os.getenv('SECURE_APP_COMPRESSION', 'auto')  # auto (per item, see compression.py) or off
+DEDUP = os.getenv('SECURE_APP_DEDUP', 'on')  # on (chunk and deduplicate files, see chunking.py) or off
+CHUNK_INDEX_FILE = os.getenv('SECURE_APP_CHUNK_INDEX_FILE', 'chunk_index.db')
+LOCKOUT_DURATION = int(os.getenv('SECURE_APP_LOCKOUT_DURATION', 30))  # seconds for a rate-limited login to regain one attempt
+LOGIN_MAX_FAILURES = int(os.getenv('SECURE_APP_LOGIN_MAX_FAILURES', 3))  # failed logins per username before the lockout
+LOGIN_CLIENT_MAX_FAILURES = int(os.getenv('SECURE_APP_LOGIN_CLIENT_MAX_FAILURES', 20))  # failed logins per client address
+LOGIN_LIMITER_MAX_KEYS = int(os.getenv('SECURE_APP_LOGIN_LIMITER_MAX_KEYS', 100000))  # usernames and clients tracked
+PASSWORD_LOG2_N = int(os.getenv('SECURE_APP_PASSWORD_LOG2_N', 14))  # scrypt cost of login passwords; see `python -m secure_data.calibrate`
+PASSWORD_WORKERS = int(os.getenv('SECURE_APP_PASSWORD_WORKERS', min(4, os.cpu_count() or 1)))  # password checks run at once
+PASSWORD_QUEUE_DEPTH = int(os.getenv('SECURE_APP_PASSWORD_QUEUE_DEPTH', 64))  # checks waiting before logins are refused
+PASSWORD_CACHE_TTL = int(os.getenv('SECURE_APP_PASSWORD_CACHE_TTL', 300))  # seconds a verified password is remembered; 0 disables
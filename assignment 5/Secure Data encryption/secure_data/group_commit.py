@@ -0,0 +1,133 @@
+"""Write-behind group commit for store writes.
+
+With write-behind enabled, CachedStore applies a write to its in-memory copy
+and hands the change to a GroupCommitWriter instead of writing the backend on
+the caller's thread. The writer's background thread waits a short window for
+more changes, from any session, coalesces them (the last change to a label
+wins) and commits them with one Store.apply() call: one rewrite of the JSON
+document, one journal append and fsync, or one SQLite transaction.
+
+Every submit() returns a concurrent.futures.Future that completes once the
+change is durable, or fails with the commit's exception, so callers that
+must not continue before the data is on disk (a batch resume point, an HTTP
+response, deleting the blobs of a deleted item) wait on it. Others do not,
+and a store click costs only the in-memory update.
+"""
+import atexit
+import logging
+import threading
+import time
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WINDOW = 0.002  # seconds to wait for more changes before committing
+MAX_BATCH = 10000  # changes committed in one write at most
+
+
+def completed(result=None):
+    """Return a Future that is already done, for writes that were made synchronously"""
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+class GroupCommitWriter:
+    """Background thread that commits queued changes in coalesced batches
+
+    commit(changes) receives a list of (username, label, item or None) tuples
+    with at most one change per label. on_failure(error), if given, is called
+    after a failed commit, while commit_lock is still held.
+    """
+
+    def __init__(self, commit, window=DEFAULT_WINDOW, max_batch=MAX_BATCH, on_failure=None):
+        self.commit = commit
+        self.window = window
+        self.max_batch = max_batch
+        self.on_failure = on_failure
+        # Held while a batch is taken from the queue and committed, so holders
+        # see every change either committed or still queued
+        self.commit_lock = threading.Lock()
+        self.batches = 0
+        self.changes = 0
+        self._queue = []  # (changes, future)
+        self._condition = threading.Condition()
+        self._thread = None
+        self._closed = False
+
+    def submit(self, changes):
+        """Queue (username, label, item or None) changes, returning a Future done when they are durable"""
+        future = Future()
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("The writer is closed")
+            self._queue.append((list(changes), future))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="group-commit", daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+            self._condition.notify()
+        return future
+
+    def flush(self):
+        """Return a Future done once everything submitted so far is durable"""
+        return self.submit([])
+
+    def queued(self):
+        """Return the changes submitted but not yet taken for a commit, in order"""
+        with self._condition:
+            return [change for changes, _ in self._queue for change in changes]
+
+    def _take_batch(self):
+        batch, count = [], 0
+        with self._condition:
+            while self._queue and (not batch or count + len(self._queue[0][0]) <= self.max_batch):
+                changes, future = self._queue.pop(0)
+                batch.append((changes, future))
+                count += len(changes)
+        return batch
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._queue and not self._closed:
+                    self._condition.wait()
+                if not self._queue:
+                    return
+            # Let changes from other sessions join this batch
+            if self.window > 0:
+                time.sleep(self.window)
+            with self.commit_lock:
+                batch = self._take_batch()
+                coalesced = {}
+                for changes, _ in batch:
+                    for username, label, item in changes:
+                        coalesced[(username, label)] = item
+                try:
+                    if coalesced:
+                        self.commit([(username, label, item) for (username, label), item in coalesced.items()])
+                except Exception as e:
+                    logger.error(f"Group commit of {len(coalesced)} changes failed: {str(e)}")
+                    if self.on_failure is not None:
+                        try:
+                            self.on_failure(e)
+                        except Exception as recovery_error:
+                            logger.error(f"Recovering from a failed commit failed: {str(recovery_error)}")
+                    for _, future in batch:
+                        future.set_exception(e)
+                    continue
+                self.batches += 1
+                self.changes += len(coalesced)
+            for _, future in batch:
+                future.set_result(None)
+
+    def close(self):
+        """Commit everything queued and stop the background thread"""
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._condition.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
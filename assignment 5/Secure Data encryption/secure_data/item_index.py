@@ -0,0 +1,236 @@
+"""In-memory search index over one user's items.
+
+Keeps the user's labels in sorted orders and small inverted indexes so that
+searching, filtering and sorting never walk every item:
+
+- labels sorted case-insensitively, for prefix search (bisect)
+- (timestamp, label) and (size, label) sorted lists, for sorting and time ranges
+- item type and file MIME type to labels, for filters
+- case-folded labels joined into one string per hash bucket, for substring
+  search: the scan runs at C speed and only buckets containing a match are
+  looked at label by label
+
+Timestamps are the "%Y-%m-%d %H:%M:%S" strings stored on items, which sort
+chronologically as plain strings. The index is updated per item on store and
+delete (a change only re-joins its own bucket, on the next substring search);
+see CachedStore.index().
+"""
+import bisect
+
+SORT_KEYS = ("label", "timestamp", "size")
+# Position of each sort key's value in an entry (folded label, timestamp, size, type, mime type)
+_SORT_FIELDS = {"label": 0, "timestamp": 1, "size": 2}
+SEARCH_BUCKETS = 64
+_SEPARATOR = "\x00"
+_MAX_CHAR = "\U0010ffff"
+
+
+def item_size(item):
+    """Return an item's plaintext size if recorded, else its ciphertext size, else 0"""
+    size = item.get("file_info", {}).get("size")
+    if size is None:
+        size = item.get("blob", {}).get("size", 0)
+    return size
+
+
+class _SearchBucket:
+    """Labels of one hash bucket, joined lazily for substring scans"""
+
+    def __init__(self):
+        self.folded = {}  # label -> case-folded label
+        self._joined = None
+
+    def add(self, label, folded):
+        self.folded[label] = folded
+        self._joined = None
+
+    def remove(self, label):
+        self.folded.pop(label, None)
+        self._joined = None
+
+    def matches(self, text):
+        if self._joined is None:
+            labels = list(self.folded)
+            offsets, position = [], 0
+            for label in labels:
+                offsets.append(position)
+                position += len(self.folded[label]) + 1
+            self._joined = (_SEPARATOR.join(self.folded[label] for label in labels), labels, offsets)
+        joined, labels, offsets = self._joined
+        found = []
+        position = joined.find(text)
+        while position != -1:
+            index = bisect.bisect_right(offsets, position) - 1
+            found.append(labels[index])
+            # Continue after this label so it is reported once
+            end = offsets[index + 1] if index + 1 < len(offsets) else len(joined)
+            position = joined.find(text, end)
+        return found
+
+
+class ItemIndex:
+    """Sorted and inverted indexes over one user's {label: item} mapping"""
+
+    def __init__(self, items=None):
+        self._entries = {}  # label -> (folded label, timestamp, size, type, mime type)
+        self._by_label = []
+        self._by_timestamp = []
+        self._by_size = []
+        self._buckets = [_SearchBucket() for _ in range(SEARCH_BUCKETS)]
+        self._types = {}
+        self._mime_types = {}
+        for label, item in (items or {}).items():
+            self._insert(label, item, bulk=True)
+        self._by_label.sort()
+        self._by_timestamp.sort()
+        self._by_size.sort()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _insert(self, label, item, bulk=False):
+        folded = label.casefold()
+        entry = (folded, item.get("timestamp", ""), item_size(item), item.get("type", "text"),
+                 item.get("file_info", {}).get("type", ""))
+        self._entries[label] = entry
+        add = list.append if bulk else bisect.insort
+        add(self._by_label, (folded, label))
+        add(self._by_timestamp, (entry[1], label))
+        add(self._by_size, (entry[2], label))
+        self._buckets[hash(label) % SEARCH_BUCKETS].add(label, folded)
+        self._types.setdefault(entry[3], set()).add(label)
+        if entry[4]:
+            self._mime_types.setdefault(entry[4], set()).add(label)
+
+    @staticmethod
+    def _discard(sorted_list, key):
+        position = bisect.bisect_left(sorted_list, key)
+        if position < len(sorted_list) and sorted_list[position] == key:
+            del sorted_list[position]
+
+    @staticmethod
+    def _unlink(postings, key, label):
+        labels = postings.get(key)
+        if labels is not None:
+            labels.discard(label)
+            if not labels:
+                del postings[key]
+
+    def remove(self, label):
+        entry = self._entries.pop(label, None)
+        if entry is None:
+            return
+        folded, timestamp, size, item_type, mime_type = entry
+        self._discard(self._by_label, (folded, label))
+        self._discard(self._by_timestamp, (timestamp, label))
+        self._discard(self._by_size, (size, label))
+        self._buckets[hash(label) % SEARCH_BUCKETS].remove(label)
+        self._unlink(self._types, item_type, label)
+        if mime_type:
+            self._unlink(self._mime_types, mime_type, label)
+
+    def update(self, label, item):
+        """Apply a stored (item) or deleted (None) label"""
+        self.remove(label)
+        if item is not None:
+            self._insert(label, item)
+
+    def types(self):
+        return sorted(self._types)
+
+    def mime_types(self):
+        return sorted(self._mime_types)
+
+    # Queries
+
+    @staticmethod
+    def _bounds(sorted_list, low, high):
+        """Return the (start, end) positions of (key, label) pairs with low <= key <= high, high as a prefix"""
+        start = bisect.bisect_left(sorted_list, (low,)) if low else 0
+        end = bisect.bisect_left(sorted_list, (high + _MAX_CHAR,)) if high is not None else len(sorted_list)
+        return start, end
+
+    def _substring_matches(self, text):
+        text = text.replace(_SEPARATOR, "")
+        matches = set()
+        for bucket in self._buckets:
+            matches.update(bucket.matches(text))
+        return matches
+
+    def query(self, prefix=None, contains=None, item_type=None, mime_type=None,
+              since=None, until=None, sort="label", descending=False, offset=0, limit=None):
+        """Return (labels, total): one page of the labels matching every criterion, in sort order
+
+        prefix and contains match labels case-insensitively. since and until are
+        inclusive timestamp bounds and may be partial ("2024-01-31" as until
+        covers that whole day). sort is one of SORT_KEYS. total counts every
+        match, so a caller can page through results without listing them all.
+        """
+        if sort not in SORT_KEYS:
+            raise ValueError(f"Unknown sort key: {sort!r} (expected one of {', '.join(SORT_KEYS)})")
+        ordered = {"label": self._by_label, "timestamp": self._by_timestamp, "size": self._by_size}[sort]
+        # Ranges on the sort key narrow ordered[lo:hi]; other criteria narrow a candidate set
+        lo, hi = 0, len(ordered)
+        candidates = None
+
+        def narrow(labels):
+            nonlocal candidates
+            candidates = labels if candidates is None else candidates & labels
+
+        if prefix:
+            start, end = self._bounds(self._by_label, prefix.casefold(), prefix.casefold())
+            if sort == "label":
+                lo, hi = start, end
+            else:
+                narrow({label for _, label in self._by_label[start:end]})
+        if since or until:
+            start, end = self._bounds(self._by_timestamp, since, until)
+            if sort == "timestamp":
+                lo, hi = start, end
+            else:
+                narrow({label for _, label in self._by_timestamp[start:end]})
+        if item_type:
+            narrow(self._types.get(item_type, set()))
+        if mime_type:
+            narrow(self._mime_types.get(mime_type, set()))
+        if contains:
+            text = contains.casefold()
+            # A few candidates are cheaper to test one by one than to scan every label
+            if candidates is not None and len(candidates) * 16 < len(self._entries):
+                narrow({label for label in candidates if text in self._entries[label][0]})
+            elif (hi - lo) * 16 < len(self._entries):
+                narrow({label for _, label in ordered[lo:hi] if text in self._entries[label][0]})
+            else:
+                narrow(self._substring_matches(text))
+
+        if candidates is None:
+            total = hi - lo
+            if descending:
+                end = max(lo, hi - offset)
+                start = max(lo, end - limit) if limit is not None else lo
+                return [label for _, label in reversed(ordered[start:end])], total
+            end = min(hi, lo + offset + limit) if limit is not None else hi
+            return [label for _, label in ordered[lo + offset:end]], total
+
+        position = _SORT_FIELDS[sort]
+        if lo > 0 or hi < len(ordered):
+            first = ordered[lo] if lo < len(ordered) else None
+            after = ordered[hi] if hi < len(ordered) else None
+            candidates = {label for label in candidates
+                          if (first is None or (self._entries[label][position], label) >= first)
+                          and (after is None or (self._entries[label][position], label) < after)}
+        total = len(candidates)
+        wanted = offset + limit if limit is not None else total
+        # Walking the sort order until the page is full costs about wanted * (hi - lo) / total
+        # steps; sorting the matches costs total * log(total). Take the cheaper.
+        if total and wanted * (hi - lo) < total * total * max(1, total.bit_length()):
+            found = []
+            for index in (range(hi - 1, lo - 1, -1) if descending else range(lo, hi)):
+                label = ordered[index][1]
+                if label in candidates:
+                    found.append(label)
+                    if len(found) >= wanted:
+                        break
+            return found[offset:], total
+        labels = sorted(candidates, key=lambda label: (self._entries[label][position], label), reverse=descending)
+        return labels[offset:wanted], total
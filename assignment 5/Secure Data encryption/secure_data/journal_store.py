@@ -0,0 +1,361 @@
+"""Append-only journaled storage engine for item metadata.
+
+Every put or delete is appended to the journal as one checksummed record:
+
+    record = length (4, big endian) | crc32 (4, big endian) | body (JSON)
+    body   = {"op": "put", "user": ..., "label": ..., "item": {...}}
+           | {"op": "del", "user": ..., "label": ...}
+
+An in-memory index maps (username, label) to the offset and length of the
+live record, so a write costs one append regardless of the store size.
+Opening the journal replays it to rebuild the index; a torn or corrupt tail
+left by a crash is truncated away. Superseded and deleted records are garbage,
+and once garbage crosses a threshold a background thread rewrites the live
+records into a fresh journal and swaps it in atomically.
+
+Writes go to the offset this process last appended at, so only one process
+may have a journal open: opening takes an exclusive fcntl lock on
+``<journal>.lock``, held until close(), and a second opener fails at once
+with JournalLockedError. Use the sqlite or sharded backend for several
+writing processes.
+"""
+import json
+import logging
+import os
+import struct
+import threading
+import zlib
+
+from .storage import Store
+
+try:
+    import fcntl
+except ImportError:  # Windows: the journal is not locked against other processes
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+FILE_MAGIC = b"SDEJ\x00\x00\x00\x01"
+_RECORD_HEADER = struct.Struct(">II")
+RECORD_HEADER_SIZE = _RECORD_HEADER.size
+MAX_RECORD_SIZE = 64 * 1024 * 1024
+
+DEFAULT_COMPACT_RATIO = 0.5
+DEFAULT_COMPACT_MIN_BYTES = 1024 * 1024
+
+
+class JournalCorruptError(IOError):
+    """Raised when a journal file cannot be opened as a journal"""
+
+
+class JournalLockedError(IOError):
+    """Raised when another process (or store) already has the journal open"""
+
+
+def _encode_record(body):
+    payload = json.dumps(body, separators=(",", ":")).encode("utf-8")
+    return _RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def _iter_records(fd, start, end):
+    """Yield (offset, length, body) for each valid record between start and end
+
+    Iteration stops at the first torn or corrupt record; the caller can compare
+    the last yielded position against end to detect it.
+    """
+    offset = start
+    while offset + RECORD_HEADER_SIZE <= end:
+        header = os.pread(fd, RECORD_HEADER_SIZE, offset)
+        size, crc = _RECORD_HEADER.unpack(header)
+        if size > MAX_RECORD_SIZE or offset + RECORD_HEADER_SIZE + size > end:
+            return
+        payload = os.pread(fd, size, offset + RECORD_HEADER_SIZE)
+        if zlib.crc32(payload) != crc:
+            return
+        try:
+            body = json.loads(payload)
+        except ValueError:
+            return
+        yield offset, RECORD_HEADER_SIZE + size, body
+        offset += RECORD_HEADER_SIZE + size
+
+
+def _apply(index, body, offset, length):
+    """Apply a record to an index, returning the change in live bytes"""
+    delta = 0
+    user_index = index.setdefault(body["user"], {})
+    previous = user_index.get(body["label"])
+    if previous is not None:
+        delta -= previous[1]
+    if body["op"] == "put":
+        user_index[body["label"]] = (offset, length)
+        delta += length
+    else:
+        user_index.pop(body["label"], None)
+        if not user_index:
+            del index[body["user"]]
+    return delta
+
+
+class JournalStore(Store):
+    """Log-structured store of items keyed by (username, label)"""
+
+    def __init__(self, path, compact_ratio=DEFAULT_COMPACT_RATIO,
+                 compact_min_bytes=DEFAULT_COMPACT_MIN_BYTES, sync=True):
+        self.path = path
+        self.compact_ratio = compact_ratio
+        self.compact_min_bytes = compact_min_bytes
+        self.sync = sync
+        self._lock = threading.RLock()
+        self._compact_lock = threading.Lock()
+        self._index = {}
+        self._live_bytes = 0
+        self._compacting = False
+        self._file = None
+        self._lock_file = None
+        self._open()
+
+    # -- opening and replay -------------------------------------------------
+
+    def _open(self):
+        self._acquire_lock()
+        try:
+            self._open_file()
+        except BaseException:
+            self._release_lock()
+            raise
+
+    def _acquire_lock(self):
+        lock_path = f"{self.path}.lock"
+        self._lock_file = open(lock_path, "a")
+        if fcntl is None:
+            return
+        try:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._release_lock()
+            raise JournalLockedError(
+                f"Journal {self.path} is already open in another process (lock: {lock_path}); stop it, "
+                f"or use the sqlite or sharded backend for several processes") from None
+
+    def _release_lock(self):
+        if self._lock_file is not None:
+            # Closing the file releases the lock
+            self._lock_file.close()
+            self._lock_file = None
+
+    def _open_file(self):
+        if not os.path.exists(self.path):
+            with open(self.path, "wb") as f:
+                f.write(FILE_MAGIC)
+                f.flush()
+                os.fsync(f.fileno())
+        self._file = open(self.path, "r+b")
+        if self._file.read(len(FILE_MAGIC)) != FILE_MAGIC:
+            self._file.close()
+            raise JournalCorruptError(f"Not a journal file: {self.path}")
+        self._replay()
+
+    def _replay(self):
+        """Rebuild the index from the journal, truncating a torn tail"""
+        end = os.fstat(self._file.fileno()).st_size
+        self._index = {}
+        self._live_bytes = 0
+        good_end = len(FILE_MAGIC)
+        for offset, length, body in _iter_records(self._file.fileno(), good_end, end):
+            self._live_bytes += _apply(self._index, body, offset, length)
+            good_end = offset + length
+        if good_end < end:
+            logger.warning(f"Truncating {end - good_end} bytes of torn journal tail in {self.path}")
+            self._file.truncate(good_end)
+            os.fsync(self._file.fileno())
+        self._end = good_end
+        logger.info(f"Replayed journal {self.path}: {self.count()} live items")
+
+    # -- writes -------------------------------------------------------------
+
+    def _append(self, bodies):
+        records = [_encode_record(body) for body in bodies]
+        with self._lock:
+            offset = self._end
+            os.pwrite(self._file.fileno(), b"".join(records), offset)
+            if self.sync:
+                os.fsync(self._file.fileno())
+            for body, record in zip(bodies, records):
+                self._live_bytes += _apply(self._index, body, offset, len(record))
+                offset += len(record)
+            self._end = offset
+        self.maybe_compact()
+
+    def put(self, username, label, item):
+        """Store or replace an item"""
+        self._append([{"op": "put", "user": username, "label": label, "item": item}])
+
+    def put_many(self, entries):
+        """Store several (username, label, item) entries with a single append"""
+        bodies = [{"op": "put", "user": u, "label": l, "item": item} for u, l, item in entries]
+        if bodies:
+            self._append(bodies)
+
+    def delete(self, username, label):
+        """Delete an item, returning False if it did not exist"""
+        with self._lock:
+            if label not in self._index.get(username, {}):
+                return False
+            self._append([{"op": "del", "user": username, "label": label}])
+        return True
+
+    def apply(self, changes):
+        """Apply (username, label, item or None) changes with a single append"""
+        with self._lock:
+            present = {}
+            bodies = []
+            for username, label, item in changes:
+                key = (username, label)
+                if item is not None:
+                    bodies.append({"op": "put", "user": username, "label": label, "item": item})
+                    present[key] = True
+                elif present.get(key, label in self._index.get(username, {})):
+                    bodies.append({"op": "del", "user": username, "label": label})
+                    present[key] = False
+            if bodies:
+                self._append(bodies)
+
+    # -- reads --------------------------------------------------------------
+
+    def _read_body(self, location):
+        offset, length = location
+        payload = os.pread(self._file.fileno(), length - RECORD_HEADER_SIZE, offset + RECORD_HEADER_SIZE)
+        return json.loads(payload)
+
+    def get(self, username, label):
+        """Return an item, or None if it does not exist"""
+        with self._lock:
+            location = self._index.get(username, {}).get(label)
+            if location is None:
+                return None
+            return self._read_body(location)["item"]
+
+    def labels(self, username):
+        """Return the labels stored for a user, in insertion order"""
+        with self._lock:
+            return list(self._index.get(username, {}))
+
+    def users(self):
+        """Return the users that have at least one item"""
+        with self._lock:
+            return list(self._index)
+
+    def list_items(self, username):
+        """Return a {label: item} dict for one user"""
+        with self._lock:
+            return {label: self._read_body(location)["item"]
+                    for label, location in self._index.get(username, {}).items()}
+
+    def snapshot(self):
+        """Return every live item as a {username: {label: item}} dict"""
+        with self._lock:
+            return {username: self.list_items(username) for username in self._index}
+
+    def count(self):
+        """Return the number of live items"""
+        with self._lock:
+            return sum(len(labels) for labels in self._index.values())
+
+    def stats(self):
+        """Return size accounting used to decide when to compact"""
+        with self._lock:
+            total = self._end - len(FILE_MAGIC)
+            return {
+                "items": self.count(),
+                "file_bytes": self._end,
+                "live_bytes": self._live_bytes,
+                "garbage_bytes": total - self._live_bytes,
+            }
+
+    # -- compaction ---------------------------------------------------------
+
+    def needs_compaction(self):
+        """Return True once garbage crosses both the ratio and size thresholds"""
+        stats = self.stats()
+        garbage = stats["garbage_bytes"]
+        return (garbage >= self.compact_min_bytes
+                and garbage >= self.compact_ratio * (stats["file_bytes"] - len(FILE_MAGIC)))
+
+    def maybe_compact(self):
+        """Start a background compaction if one is due and none is running"""
+        with self._lock:
+            if self._compacting or not self.needs_compaction():
+                return
+            self._compacting = True
+        threading.Thread(target=self._compact_in_background, name="journal-compaction", daemon=True).start()
+
+    def _compact_in_background(self):
+        try:
+            self.compact()
+        except Exception as e:
+            logger.error(f"Journal compaction failed: {str(e)}")
+        finally:
+            with self._lock:
+                self._compacting = False
+
+    def compact(self):
+        """Rewrite live records into a fresh journal and swap it in
+
+        Live records are copied without holding the lock, so writers are only
+        blocked while records appended during the copy are carried over.
+        """
+        with self._compact_lock:
+            self._compact()
+
+    def _compact(self):
+        tmp_path = f"{self.path}.compact"
+        with self._lock:
+            copy_end = self._end
+            live = [(username, label, location)
+                    for username, labels in self._index.items()
+                    for label, location in labels.items()]
+            source = os.dup(self._file.fileno())
+
+        try:
+            new_index = {}
+            with open(tmp_path, "wb") as out:
+                out.write(FILE_MAGIC)
+                position = len(FILE_MAGIC)
+                for username, label, (offset, length) in live:
+                    out.write(os.pread(source, length, offset))
+                    new_index.setdefault(username, {})[label] = (position, length)
+                    position += length
+
+                live_bytes = position - len(FILE_MAGIC)
+
+                with self._lock:
+                    # Carry over anything appended while the live set was copied
+                    for offset, length, body in _iter_records(source, copy_end, self._end):
+                        out.write(os.pread(source, length, offset))
+                        live_bytes += _apply(new_index, body, position, length)
+                        position += length
+                    out.flush()
+                    os.fsync(out.fileno())
+                    os.replace(tmp_path, self.path)
+
+                    reclaimed = self._end - position
+                    self._file.close()
+                    self._file = open(self.path, "r+b")
+                    self._index = new_index
+                    self._live_bytes = live_bytes
+                    self._end = position
+            logger.info(f"Compacted journal {self.path}: reclaimed {reclaimed} bytes")
+        finally:
+            os.close(source)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def close(self):
+        """Close the journal file and release its lock"""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self._release_lock()
+
@@ -0,0 +1,138 @@
+"""Passkey-based key derivation with a bounded cache of derived keys.
+
+Each item gets its own random salt and a scrypt cost recorded next to it:
+
+    {"alg": "scrypt", "salt": "<base64>", "ln": 15, "r": 8, "p": 1}
+
+so the cost can be raised for new items without breaking old ones. Deriving a
+key deliberately takes hundreds of milliseconds; DerivedKeyCache keeps recent
+results (LRU with a time-to-live) so repeated decrypts of the same item within
+a session pay for one derivation, not one per click or rerun.
+
+calibrate() finds the cost that takes a target time on this host; run it as
+``python -m secure_data.calibrate --target-ms 250``.
+"""
+import base64
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
+
+KEY_SIZE = 32
+SALT_SIZE = 16
+DEFAULT_LOG2_N = 15
+DEFAULT_R = 8
+DEFAULT_P = 1
+MIN_LOG2_N = 10
+MAX_LOG2_N = 22
+
+DEFAULT_CACHE_SIZE = 256
+DEFAULT_CACHE_TTL = 15 * 60
+
+
+def new_params(log2_n=DEFAULT_LOG2_N, r=DEFAULT_R, p=DEFAULT_P):
+    """Return fresh KDF parameters with a random salt"""
+    if not MIN_LOG2_N <= log2_n <= MAX_LOG2_N:
+        raise ValueError(f"scrypt cost must be between 2^{MIN_LOG2_N} and 2^{MAX_LOG2_N}")
+    return {
+        "alg": "scrypt",
+        "salt": base64.b64encode(os.urandom(SALT_SIZE)).decode("utf-8"),
+        "ln": log2_n,
+        "r": r,
+        "p": p,
+    }
+
+
+def derive_key(passkey, params):
+    """Derive a 32-byte key from a passkey (uncached; see DerivedKeyCache)"""
+    if params.get("alg") != "scrypt":
+        raise ValueError(f"Unsupported KDF: {params.get('alg')!r}")
+    kdf = Scrypt(
+        salt=base64.b64decode(params["salt"]),
+        length=KEY_SIZE,
+        n=2 ** params["ln"],
+        r=params["r"],
+        p=params["p"],
+    )
+    return kdf.derive(passkey.encode("utf-8"))
+
+
+class DerivedKeyCache:
+    """Thread-safe LRU + TTL cache of derived keys
+
+    Entries are keyed by the item's KDF parameters and an HMAC of the passkey
+    under a per-process random key, so the cache never holds passkeys or an
+    offline-crackable unsalted hash of them.
+    """
+
+    def __init__(self, max_entries=DEFAULT_CACHE_SIZE, ttl=DEFAULT_CACHE_TTL, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._secret = os.urandom(32)
+        self.hits = 0
+        self.misses = 0
+
+    def _cache_key(self, passkey, params):
+        digest = hmac.new(self._secret, passkey.encode("utf-8"), hashlib.sha256).digest()
+        return (params["alg"], params["salt"], params["ln"], params["r"], params["p"], digest)
+
+    def get_or_derive(self, passkey, params):
+        """Return the derived key, deriving and caching it on a miss"""
+        cache_key = self._cache_key(passkey, params)
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(cache_key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        # Derive outside the lock so other sessions are not blocked behind it
+        key = derive_key(passkey, params)
+        with self._lock:
+            self._entries[cache_key] = (key, now + self.ttl)
+            self._entries.move_to_end(cache_key)
+            self._evict(now)
+        return key
+
+    def _evict(self, now):
+        expired = [cache_key for cache_key, (_, expires) in self._entries.items() if expires <= now]
+        for cache_key in expired:
+            del self._entries[cache_key]
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        """Drop every cached key"""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def calibrate(target_seconds=0.25, r=DEFAULT_R, p=DEFAULT_P, max_log2_n=MAX_LOG2_N):
+    """Return the largest scrypt log2(N) whose derivation stays within target_seconds on this host
+
+    Each step doubles N and roughly doubles the cost, so timing stops at the
+    first step over the target.
+    """
+    params = new_params(MIN_LOG2_N, r, p)
+    best = MIN_LOG2_N
+    for log2_n in range(MIN_LOG2_N, max_log2_n + 1):
+        params["ln"] = log2_n
+        start = time.perf_counter()
+        derive_key("calibration", params)
+        if time.perf_counter() - start > target_seconds:
+            break
+        best = log2_n
+    return best
+
@@ -0,0 +1,360 @@
+"""Persistent keyring and background key rotation.
+
+Items are encrypted with envelope encryption: the payload is encrypted under a
+random per-item data key, and that data key is sealed twice, first under the
+passkey-derived key and then under a keyring master key:
+
+    wrapped_key = seal(master[key_id], seal(passkey_key, data_key))
+
+The item records ``key_id`` and ``wrapped_key``. Rotating the master key only
+has to re-seal the outer layer of each wrapped key, which needs neither the
+passkey nor the payload, so a multi-GB store rotates by rewriting a few
+hundred bytes of metadata per item while the app keeps serving.
+
+The keyring file holds the master keys items are still sealed under and is
+written atomically with owner-only permissions. Old keys are needed until a
+rotation finishes; a day after that (so that payloads sealed just before the
+rotation can still be saved) the keys no stored item uses any more are
+retired, i.e. removed from the file, unless the store keeps backup points,
+whose items may still be sealed under them. It also holds the secret that per-user chunk IDs and keys are derived from (see
+chunking.py); that secret is never rotated, since chunk IDs must stay stable.
+
+Several processes (the app, the CLI, the HTTP API) may share one keyring.
+Every change re-reads the file and merges into it under an fcntl lock on
+``<keyring>.lock``, so nothing another process wrote is lost, and a process
+re-reads the file when it meets a key ID it does not know or the file has
+changed since it was last read.
+"""
+import base64
+import contextlib
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+try:
+    import fcntl
+except ImportError:  # Windows: the keyring is only locked within the process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+KEY_SIZE = 32
+NONCE_SIZE = 12
+DEFAULT_BATCH_SIZE = 500
+KEY_RETIRE_AGE = 24 * 3600  # seconds a rotated-to key is active before unused old keys are retired
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def _b64encode(data):
+    return base64.b64encode(data).decode("utf-8")
+
+
+def seal(key, plaintext, aad=b""):
+    """Encrypt a small value with AES-256-GCM, returning nonce | ciphertext"""
+    nonce = os.urandom(NONCE_SIZE)
+    return nonce + AESGCM(key).encrypt(nonce, plaintext, aad)
+
+
+def unseal(key, sealed, aad=b""):
+    """Reverse seal(); raises cryptography.exceptions.InvalidTag on a wrong key"""
+    return AESGCM(key).decrypt(sealed[:NONCE_SIZE], sealed[NONCE_SIZE:], aad)
+
+
+class Keyring:
+    """Master keys persisted to a JSON file, one of which is active"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._data = {"active": None, "keys": {}}
+        self._token = None
+        with self._lock, self._file_lock():
+            if not self.refresh():
+                self._create_key(self._data)
+                self._save(self._data)
+                logger.info(f"Created keyring: {path}")
+
+    @contextlib.contextmanager
+    def _file_lock(self):
+        """Hold the keyring's advisory file lock, shared by every process using it"""
+        with open(f"{self.path}.lock", "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            yield
+
+    def refresh(self):
+        """Re-read the keyring file if it changed since it was last read, returning False if there is none"""
+        with self._lock:
+            try:
+                stat = os.stat(self.path)
+            except FileNotFoundError:
+                return False
+            token = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+            if token != self._token:
+                with open(self.path, "r") as f:
+                    self._data = json.load(f)
+                self._token = token
+            return True
+
+    def _save(self, data):
+        tmp_path = f"{self.path}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self._data = data
+        stat = os.stat(self.path)
+        self._token = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def _update(self, change):
+        """Apply change(data) to the keyring as it is on disk and save it, under the file lock"""
+        with self._lock, self._file_lock():
+            self.refresh()
+            data = {**self._data, "keys": dict(self._data["keys"])}
+            result = change(data)
+            self._save(data)
+            return result
+
+    @staticmethod
+    def _create_key(data):
+        key_id = f"k{len(data['keys']) + 1}-{secrets.token_hex(4)}"
+        data["keys"][key_id] = {
+            "key": _b64encode(os.urandom(KEY_SIZE)),
+            "created": time.strftime(TIME_FORMAT),
+        }
+        data["active"] = key_id
+        return key_id
+
+    @property
+    def active_id(self):
+        """ID of the key new items are sealed under"""
+        return self._data["active"]
+
+    def key_ids(self):
+        """Return every key ID, oldest first"""
+        with self._lock:
+            return list(self._data["keys"])
+
+    def created(self, key_id):
+        """Return when a key was created, in seconds since the epoch"""
+        with self._lock:
+            return time.mktime(time.strptime(self._data["keys"][key_id]["created"], TIME_FORMAT))
+
+    def _key(self, key_id):
+        if key_id not in self._data["keys"]:
+            # Another process may have rotated since this keyring was read
+            self.refresh()
+        try:
+            return base64.b64decode(self._data["keys"][key_id]["key"])
+        except KeyError:
+            raise KeyError(f"Unknown key ID: {key_id}") from None
+
+    def rotate(self):
+        """Generate a new master key, make it active and return its ID"""
+        key_id = self._update(self._create_key)
+        logger.info(f"Activated new master key: {key_id}")
+        return key_id
+
+    def wrap(self, data_key, passkey_key):
+        """Seal a data key under the passkey key, then the active master key"""
+        with self._lock:
+            self.refresh()
+            key_id = self.active_id
+            master = self._key(key_id)
+        inner = seal(passkey_key, data_key, b"data-key")
+        return key_id, _b64encode(seal(master, inner, key_id.encode("utf-8")))
+
+    def unwrap(self, key_id, wrapped_key, passkey_key):
+        """Recover a data key; raises InvalidTag if the passkey key is wrong"""
+        with self._lock:
+            master = self._key(key_id)
+        inner = unseal(master, base64.b64decode(wrapped_key), key_id.encode("utf-8"))
+        return unseal(passkey_key, inner, b"data-key")
+
+    def rewrap(self, key_id, wrapped_key):
+        """Move a wrapped key to the active master key without the passkey"""
+        with self._lock:
+            old_master = self._key(key_id)
+            self.refresh()
+            new_id = self.active_id
+            new_master = self._key(new_id)
+        inner = unseal(old_master, base64.b64decode(wrapped_key), key_id.encode("utf-8"))
+        return new_id, _b64encode(seal(new_master, inner, new_id.encode("utf-8")))
+
+    def retire(self, key_ids):
+        """Remove master keys that nothing is sealed under any more, returning the IDs removed
+
+        The active key is never removed.
+        """
+        def change(data):
+            removed = [key_id for key_id in key_ids if key_id in data["keys"] and key_id != data["active"]]
+            for key_id in removed:
+                del data["keys"][key_id]
+            return removed
+
+        removed = self._update(change)
+        if removed:
+            logger.info(f"Retired master keys: {', '.join(removed)}")
+        return removed
+
+    def chunk_secret(self, username):
+        """Return the secret a user's chunk IDs and chunk keys are derived from"""
+        with self._lock:
+            if "chunk_secret" not in self._data:
+                # Another process may have created it since this keyring was read
+                self._update(lambda data: data.setdefault("chunk_secret", _b64encode(os.urandom(KEY_SIZE))))
+            secret = base64.b64decode(self._data["chunk_secret"])
+        return hmac.new(secret, f"chunks:{username}".encode("utf-8"), hashlib.sha256).digest()
+
+
+class RotationJob:
+    """Re-seal every item's wrapped key under the active master key
+
+    Runs on a background thread in batches. After each batch it writes a
+    checkpoint (target key and the users already finished), so a restarted
+    process resumes where it stopped instead of starting over. Items are
+    written with compare-and-put, so an item changed or deleted by a user
+    mid-rotation is never overwritten with stale metadata.
+
+    Once it is done, retire_old_keys() removes the old master keys no item
+    uses. lock, if given, is held while it scans the store and retires keys;
+    writers that re-seal stale items before storing them hold it too (see
+    Vault._put), so an item is never stored under a key just removed.
+    """
+
+    def __init__(self, store, keyring, checkpoint_path, batch_size=DEFAULT_BATCH_SIZE, lock=None):
+        self.store = store
+        self.keyring = keyring
+        self.checkpoint_path = checkpoint_path
+        self.batch_size = batch_size
+        self._retire_lock = lock if lock is not None else threading.Lock()
+        self.rotated = 0
+        self.skipped = 0
+        self.error = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _load_checkpoint(self):
+        if not os.path.exists(self.checkpoint_path):
+            return None
+        with open(self.checkpoint_path, "r") as f:
+            return json.load(f)
+
+    def _save_checkpoint(self, checkpoint):
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(checkpoint, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def pending(self):
+        """Return True if a rotation was started and has not finished"""
+        checkpoint = self._load_checkpoint()
+        return bool(checkpoint) and not checkpoint.get("complete")
+
+    def running(self):
+        """Return True while the background thread is working"""
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Start (or resume) the rotation on a background thread"""
+        with self._lock:
+            if self.running():
+                return False
+            self.error = None
+            self._thread = threading.Thread(target=self._run_in_background, name="key-rotation", daemon=True)
+            self._thread.start()
+            return True
+
+    def _run_in_background(self):
+        try:
+            self.run()
+        except Exception as e:
+            self.error = str(e)
+            logger.error(f"Key rotation failed: {str(e)}")
+
+    def run(self):
+        """Rotate synchronously, resuming from the checkpoint if it targets the active key"""
+        target = self.keyring.active_id
+        checkpoint = self._load_checkpoint()
+        if not checkpoint or checkpoint.get("target") != target:
+            checkpoint = {"target": target, "done_users": [], "rotated": 0, "complete": False}
+        done_users = set(checkpoint["done_users"])
+        self.rotated = checkpoint["rotated"]
+
+        for username in self.store.users():
+            if username in done_users:
+                continue
+            batch = []
+            for label, item in self.store.list_items(username).items():
+                if "key_id" not in item or item["key_id"] == target:
+                    continue
+                key_id, wrapped_key = self.keyring.rewrap(item["key_id"], item["wrapped_key"])
+                batch.append((username, label, item, {**item, "key_id": key_id, "wrapped_key": wrapped_key}))
+                if len(batch) >= self.batch_size:
+                    self._commit(batch, checkpoint)
+                    batch = []
+            self._commit(batch, checkpoint)
+            checkpoint["done_users"].append(username)
+            self._save_checkpoint(checkpoint)
+
+        checkpoint["complete"] = True
+        self._save_checkpoint(checkpoint)
+        logger.info(f"Key rotation to {target} complete: {self.rotated} items re-sealed")
+        self.retire_old_keys()
+
+    def retire_old_keys(self, min_age=KEY_RETIRE_AGE):
+        """Retire the old master keys no stored item is sealed under, returning their IDs
+
+        Only once the rotation to the active key is complete and that key has
+        been active for min_age seconds, so a payload sealed under the old key
+        just before the rotation can still be saved meanwhile (it is re-sealed
+        on the way in). Nothing is retired while the store keeps backup points.
+        """
+        target = self.keyring.active_id
+        checkpoint = self._load_checkpoint()
+        if (self.keyring.key_ids() == [target] or not checkpoint or checkpoint.get("target") != target
+                or not checkpoint.get("complete") or time.time() - self.keyring.created(target) < min_age):
+            return []
+        backups = self.store.backups
+        if backups is not None and backups.has_points():
+            logger.info("Keeping old master keys: backup points may refer to items sealed under them")
+            return []
+        with self._retire_lock:
+            self.store.refresh_if_stale()
+            in_use = {item.get("key_id") for _, _, item in self.store.entries()}
+            # An item changed mid-rotation (skipped) may still use an old key; that key stays
+            return self.keyring.retire([key_id for key_id in self.keyring.key_ids()
+                                        if key_id != target and key_id not in in_use])
+
+    def _commit(self, batch, checkpoint):
+        if not batch:
+            return
+        written = self.store.compare_and_put(batch)
+        # The checkpoint must not get ahead of what is on disk
+        self.store.flush().result()
+        self.rotated += written
+        self.skipped += len(batch) - written
+        checkpoint["rotated"] = self.rotated
+        self._save_checkpoint(checkpoint)
+
+    def status(self):
+        """Return a small dict describing progress, for display"""
+        return {
+            "target": self.keyring.active_id,
+            "running": self.running(),
+            "pending": self.pending(),
+            "rotated": self.rotated,
+            "skipped": self.skipped,
+            "error": self.error,
+        }
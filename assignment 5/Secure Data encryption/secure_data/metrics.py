@@ -0,0 +1,215 @@
+"""In-process metrics for the app's hot paths.
+
+Durations and byte counts are recorded into fixed-bucket histograms, one per
+operation (encrypt, decrypt, save, load, authenticate, rerun, ...), plus an
+error counter. Recording is a bisect and a few additions under a lock, cheap
+enough to leave on in production.
+
+The registry is process-wide, like the store, so every session feeds the
+same histograms. It can be exported in the Prometheus text format either
+over HTTP (start_http_server) or by periodically rewriting a file
+(start_file_flusher) for node_exporter's textfile collector or similar.
+"""
+import bisect
+import contextlib
+import functools
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "secure_app"
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BYTES_BUCKETS = tuple(1024 * 4 ** i for i in range(11))  # 1KB .. 1GB
+DEFAULT_FLUSH_INTERVAL = 15
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus style"""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Estimate a quantile by linear interpolation within its bucket"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                if index == len(self.buckets):
+                    return lower
+                return lower + (self.buckets[index] - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+
+class MetricsRegistry:
+    """Thread-safe collection of per-operation histograms and error counters"""
+
+    def __init__(self, prefix=PREFIX):
+        self.prefix = prefix
+        self._seconds = {}
+        self._bytes = {}
+        self._errors = {}
+        self._lock = threading.Lock()
+
+    def observe(self, op, seconds):
+        """Record one operation's duration in seconds"""
+        with self._lock:
+            histogram = self._seconds.get(op)
+            if histogram is None:
+                histogram = self._seconds[op] = Histogram(LATENCY_BUCKETS)
+            histogram.observe(seconds)
+
+    def observe_bytes(self, op, nbytes):
+        """Record the number of bytes one operation processed"""
+        with self._lock:
+            histogram = self._bytes.get(op)
+            if histogram is None:
+                histogram = self._bytes[op] = Histogram(BYTES_BUCKETS)
+            histogram.observe(nbytes)
+
+    def count_error(self, op):
+        """Count one failed operation"""
+        with self._lock:
+            self._errors[op] = self._errors.get(op, 0) + 1
+
+    @contextlib.contextmanager
+    def timer(self, op):
+        """Time the enclosed block, recording it even if it raises"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(op, time.perf_counter() - start)
+
+    def timed(self, op):
+        """Decorator that times every call of a function"""
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.timer(op):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def summary(self):
+        """Return one row per operation (count, p50/p99 ms, total bytes, errors), for display"""
+        with self._lock:
+            ops = sorted(set(self._seconds) | set(self._bytes) | set(self._errors))
+            rows = []
+            for op in ops:
+                seconds = self._seconds.get(op)
+                nbytes = self._bytes.get(op)
+                rows.append({
+                    "operation": op,
+                    "count": seconds.count if seconds else 0,
+                    "p50_ms": round(seconds.quantile(0.5) * 1000, 3) if seconds else None,
+                    "p99_ms": round(seconds.quantile(0.99) * 1000, 3) if seconds else None,
+                    "total_s": round(seconds.sum, 3) if seconds else 0.0,
+                    "bytes": int(nbytes.sum) if nbytes else 0,
+                    "errors": self._errors.get(op, 0),
+                })
+            return rows
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            self._render_histograms(lines, f"{self.prefix}_operation_seconds",
+                                    "Duration of app operations in seconds", self._seconds)
+            self._render_histograms(lines, f"{self.prefix}_operation_bytes",
+                                    "Bytes processed by app operations", self._bytes)
+            name = f"{self.prefix}_operation_errors_total"
+            lines.append(f"# HELP {name} Failed app operations")
+            lines.append(f"# TYPE {name} counter")
+            for op, count in sorted(self._errors.items()):
+                lines.append(f'{name}{{op="{op}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _render_histograms(lines, name, help_text, histograms):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} histogram")
+        for op, histogram in sorted(histograms.items()):
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{op="{op}",le="{bound:g}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{op="{op}",le="+Inf"}} {histogram.count}')
+            lines.append(f'{name}_sum{{op="{op}"}} {histogram.sum:.6f}')
+            lines.append(f'{name}_count{{op="{op}"}} {histogram.count}')
+
+    def write_file(self, path):
+        """Atomically rewrite path with the current metrics"""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+
+REGISTRY = MetricsRegistry()
+
+
+def start_http_server(port, registry=REGISTRY, host="127.0.0.1"):
+    """Serve the registry at http://host:port/metrics on a background thread"""
+    # Imported here: http.server is slow to import and most processes never serve metrics
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logger.info(f"Serving metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+
+def start_file_flusher(path, interval=DEFAULT_FLUSH_INTERVAL, registry=REGISTRY):
+    """Rewrite path with the registry's metrics every interval seconds on a background thread"""
+    stop = threading.Event()
+
+    def flush_forever():
+        while not stop.wait(interval):
+            try:
+                registry.write_file(path)
+            except OSError as e:
+                logger.error(f"Error writing metrics file: {str(e)}")
+
+    threading.Thread(target=flush_forever, name="metrics-flush", daemon=True).start()
+    logger.info(f"Writing metrics to {path} every {interval}s")
+    return stop
+
+
+# Shortcuts onto the process-wide registry
+observe = REGISTRY.observe
+observe_bytes = REGISTRY.observe_bytes
+count_error = REGISTRY.count_error
+timer = REGISTRY.timer
+timed = REGISTRY.timed
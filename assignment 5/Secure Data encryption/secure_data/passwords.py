@@ -0,0 +1,193 @@
+"""Salted, memory-hard password hashes and the pool that verifies them.
+
+Account passwords are hashed with scrypt under a random salt, and the result
+is a self-describing string carrying everything needed to verify it:
+
+    $scrypt$ln=14,r=8,p=1$<salt, base64>$<hash, base64>
+
+so the cost can be raised without breaking existing hashes: needs_rehash()
+reports hashes below the current cost, and auth.authenticate() replaces them
+after a successful login. Unsalted SHA-256 hex digests written by earlier
+versions still verify and are always rehashed.
+
+A verification takes tens of milliseconds and 128 * r * 2**ln bytes of memory
+(16MB at ln=14), so it runs on a VerificationPool: a fixed number of worker
+threads (scrypt releases the GIL), with a limit on checks waiting for one. A
+burst beyond that limit is refused with VerifierBusy instead of queueing
+without bound. ``python -m secure_data.calibrate`` picks ln for a target
+verification time on the host.
+
+Clients of the HTTP API send their password with every request, so recent
+successful checks are remembered by VerifiedCache for a few minutes, keyed
+by an HMAC of the password under a per-process secret and the stored hash
+(changing the password invalidates them).
+"""
+import base64
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
+
+from . import config, kdf
+
+SCHEME = "scrypt"
+HASH_SIZE = 32
+SALT_SIZE = 16
+_LEGACY_HEX_LENGTH = 64  # SHA-256 hex digest
+CACHE_SIZE = 1024
+
+
+class VerifierBusy(Exception):
+    """Raised when too many password checks are already waiting for the pool"""
+
+
+def _b64encode(data):
+    return base64.b64encode(data).decode("ascii").rstrip("=")
+
+
+def _b64decode(text):
+    return base64.b64decode(text + "=" * (-len(text) % 4))
+
+
+def _scrypt(password, salt, log2_n, r, p):
+    return Scrypt(salt=salt, length=HASH_SIZE, n=2 ** log2_n, r=r, p=p).derive(password.encode("utf-8"))
+
+
+def is_legacy(stored):
+    """Return True for an unsalted SHA-256 hex digest from earlier versions"""
+    return len(stored) == _LEGACY_HEX_LENGTH and not stored.startswith("$")
+
+
+def parse(stored):
+    """Return the parameters of a hash string as {"ln", "r", "p", "salt", "hash"}"""
+    try:
+        _, scheme, settings, salt, digest = stored.split("$")
+        if scheme != SCHEME:
+            raise ValueError(scheme)
+        params = dict(setting.split("=", 1) for setting in settings.split(","))
+        return {"ln": int(params["ln"]), "r": int(params["r"]), "p": int(params["p"]),
+                "salt": _b64decode(salt), "hash": _b64decode(digest)}
+    except (ValueError, KeyError):
+        raise ValueError(f"Unknown password hash format (expected ${SCHEME}$...)") from None
+
+
+def hash_password(password, log2_n=config.PASSWORD_LOG2_N, r=kdf.DEFAULT_R, p=kdf.DEFAULT_P):
+    """Return a self-describing scrypt hash string of a password under a new random salt"""
+    if not kdf.MIN_LOG2_N <= log2_n <= kdf.MAX_LOG2_N:
+        raise ValueError(f"scrypt cost must be between 2^{kdf.MIN_LOG2_N} and 2^{kdf.MAX_LOG2_N}")
+    salt = os.urandom(SALT_SIZE)
+    digest = _scrypt(password, salt, log2_n, r, p)
+    return f"${SCHEME}$ln={log2_n},r={r},p={p}${_b64encode(salt)}${_b64encode(digest)}"
+
+
+def verify_password(password, stored):
+    """Return True if the password matches a hash string (or a legacy SHA-256 digest)"""
+    if is_legacy(stored):
+        legacy = hashlib.sha256(password.encode()).hexdigest()
+        return hmac.compare_digest(legacy, stored)
+    params = parse(stored)
+    digest = _scrypt(password, params["salt"], params["ln"], params["r"], params["p"])
+    return hmac.compare_digest(digest, params["hash"])
+
+
+def needs_rehash(stored, log2_n=config.PASSWORD_LOG2_N, r=kdf.DEFAULT_R, p=kdf.DEFAULT_P):
+    """Return True if a hash is legacy or weaker than the current cost"""
+    if is_legacy(stored):
+        return True
+    params = parse(stored)
+    return (params["ln"], params["r"], params["p"]) < (log2_n, r, p)
+
+
+class VerificationPool:
+    """Worker threads for password hashing, refusing work past a queue-depth limit"""
+
+    def __init__(self, workers=config.PASSWORD_WORKERS, max_queue=config.PASSWORD_QUEUE_DEPTH):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password")
+        # Checks running or waiting for a worker
+        self._slots = threading.BoundedSemaphore(workers + max_queue)
+
+    def submit(self, fn, *args):
+        """Run fn(*args) on a worker, returning its Future; raises VerifierBusy if the queue is full"""
+        if not self._slots.acquire(blocking=False):
+            raise VerifierBusy("Too many logins are being checked; try again shortly")
+        try:
+            future = self._executor.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+
+class VerifiedCache:
+    """Thread-safe LRU + TTL set of recently verified (username, password, stored hash) triples
+
+    Only an HMAC of each triple under a per-process random key is kept, never
+    the password or anything crackable offline.
+    """
+
+    def __init__(self, max_entries=CACHE_SIZE, ttl=config.PASSWORD_CACHE_TTL, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()  # HMAC -> expiry
+        self._lock = threading.Lock()
+        self._secret = os.urandom(32)
+
+    def _key(self, username, password, stored):
+        message = json.dumps([username, stored, password]).encode("utf-8")
+        return hmac.new(self._secret, message, hashlib.sha256).digest()
+
+    def __contains__(self, triple):
+        if self.ttl <= 0:
+            return False
+        key = self._key(*triple)
+        now = self._clock()
+        with self._lock:
+            expires = self._entries.get(key)
+            if expires is None:
+                return False
+            if expires <= now:
+                del self._entries[key]
+                return False
+            self._entries.move_to_end(key)
+            return True
+
+    def add(self, username, password, stored):
+        """Remember a successful check until the TTL passes"""
+        if self.ttl <= 0:
+            return
+        key = self._key(username, password, stored)
+        with self._lock:
+            self._entries[key] = self._clock() + self.ttl
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def default_pool():
+    """Return the process-wide verification pool, created on first use"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = VerificationPool()
+        return _pool
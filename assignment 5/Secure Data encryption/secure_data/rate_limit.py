@@ -0,0 +1,112 @@
+"""Process-wide login rate limiting.
+
+Every failed login takes a token from two buckets: one for the username and
+one for the client (IP address) it came from. A bucket holds up to its
+capacity of failures and regains one every ``lockout`` seconds. While either
+bucket is empty, attempts are rejected with the seconds until it refills,
+before any password hashing is done. A successful login refills the
+username's bucket. Attempts already being checked when a bucket empties
+still finish, so a burst can exceed the capacity by the number of checks
+running at once.
+
+The limiter is shared by every session and request in the process (the
+Streamlit app keeps one per process, the HTTP API one per server), so
+opening a new browser session does not reset it. Each key costs one
+(tokens, last update) pair. Buckets idle long enough to have refilled are
+identical to new ones and are dropped as later attempts come in; past
+max_keys the least recently used bucket is dropped first.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from . import config
+
+
+class TokenBuckets:
+    """Token buckets by key, refilling one token every interval seconds, not thread-safe on their own"""
+
+    def __init__(self, capacity, interval, max_keys=config.LOGIN_LIMITER_MAX_KEYS):
+        self.capacity = capacity
+        self.interval = interval
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> [tokens, last update], least recently used first
+
+    def tokens(self, key, now):
+        """Return the tokens in key's bucket (fractional while refilling)"""
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            return self.capacity
+        return min(self.capacity, bucket[0] + (now - bucket[1]) / self.interval)
+
+    def wait(self, key, now):
+        """Return the seconds until key has a token, 0.0 if it has one now"""
+        tokens = self.tokens(key, now)
+        return 0.0 if tokens >= 1 else (1 - tokens) * self.interval
+
+    def take(self, key, now):
+        """Take a token from key's bucket, if it has any left"""
+        self._set(key, max(0.0, self.tokens(key, now) - 1), now)
+
+    def reset(self, key):
+        """Refill key's bucket"""
+        self._buckets.pop(key, None)
+
+    def _set(self, key, tokens, now):
+        buckets = self._buckets
+        buckets[key] = [tokens, now]
+        buckets.move_to_end(key)
+        # Buckets untouched for long enough are full again; drop them, oldest first
+        full_after = self.capacity * self.interval
+        while buckets:
+            oldest = next(iter(buckets.values()))
+            if now - oldest[1] < full_after and len(buckets) <= self.max_keys:
+                break
+            buckets.popitem(last=False)
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class LoginLimiter:
+    """Limits login attempts per username and per client, safe to share between threads"""
+
+    def __init__(self, max_failures=config.LOGIN_MAX_FAILURES, lockout=config.LOCKOUT_DURATION,
+                 client_max_failures=config.LOGIN_CLIENT_MAX_FAILURES, max_keys=config.LOGIN_LIMITER_MAX_KEYS):
+        self.lockout = lockout
+        self.users = TokenBuckets(max_failures, lockout, max_keys)
+        self.clients = TokenBuckets(client_max_failures, lockout, max_keys)
+        self._lock = threading.Lock()
+
+    def retry_after(self, username=None, client=None):
+        """Return the seconds until a login attempt is allowed, 0.0 if it is allowed now"""
+        now = time.monotonic()
+        with self._lock:
+            return max(self.users.wait(username, now) if username is not None else 0.0,
+                       self.clients.wait(client, now) if client is not None else 0.0)
+
+    def failure(self, username, client=None):
+        """Record a failed login"""
+        now = time.monotonic()
+        with self._lock:
+            self.users.take(username, now)
+            if client is not None:
+                self.clients.take(client, now)
+
+    def remaining(self, username, client=None):
+        """Return how many more attempts are allowed right now"""
+        now = time.monotonic()
+        with self._lock:
+            tokens = self.users.tokens(username, now)
+            if client is not None:
+                tokens = min(tokens, self.clients.tokens(client, now))
+            return int(tokens)
+
+    def success(self, username):
+        """Record a successful login, forgetting the username's failures"""
+        with self._lock:
+            self.users.reset(username)
+
+    def __len__(self):
+        with self._lock:
+            return len(self.users) + len(self.clients)
@@ -0,0 +1,55 @@
+"""List and restore incremental backups of the JSON store.
+
+    python -m secure_data.restore --list
+    python -m secure_data.restore --at "2024-05-01 12:00:00" --output restored.json
+
+The second command writes the store as it was at that time (the newest
+retained point at or before it) to a separate file, which can replace the
+data file while the app is stopped. See backups.py for how points are kept.
+Only the json backend keeps backups; the journal, sqlite and sharded stores
+have no restore points.
+"""
+import argparse
+import json
+import sys
+import time
+
+from . import backups, config
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m secure_data.restore",
+                                     description="List and restore incremental backups of the JSON store. "
+                                                 "Without --seq or --at the newest point is restored.")
+    parser.add_argument("--data-file", default=config.DATA_FILE)
+    parser.add_argument("--list", action="store_true", help="list the retained restore points")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--seq", type=int, help="restore point number (see --list)")
+    target.add_argument("--at", help=f"newest point at or before this local time ({backups.TIME_FORMAT.replace('%', '%%')})")
+    parser.add_argument("--output", help="file to write (default: <data file>.restored)")
+    args = parser.parse_args(argv)
+
+    chains = backups.BackupChains(f"{args.data_file}.backups")
+    if not chains.has_points():
+        print(f"No restore points under {chains.directory}; only the json backend keeps backups", file=sys.stderr)
+        return 1
+    if args.list:
+        for seq, at in chains.points():
+            print(f"{seq:>8}  {time.strftime(backups.TIME_FORMAT, time.localtime(at))}")
+        return 0
+    # Points are listed to the second, so --at covers the whole second it names
+    at = time.mktime(time.strptime(args.at, backups.TIME_FORMAT)) + 0.999999 if args.at else None
+    try:
+        data = chains.restore(args.seq, at)
+    except LookupError as e:
+        print(str(e), file=sys.stderr)
+        return 1
+    output = args.output or f"{args.data_file}.restored"
+    backups.write_atomic(output, lambda f: json.dump(data, f, indent=2))
+    print(f"Wrote {sum(len(items) for items in data.values())} item(s) to {output}; "
+          f"stop the app and move it over {args.data_file} to roll back")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
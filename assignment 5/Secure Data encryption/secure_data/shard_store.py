@@ -0,0 +1,269 @@
+"""Per-user sharded storage of item metadata.
+
+Each user's items live in their own shard file, placed in a directory tree by
+a hash of the username so no directory grows too large:
+
+    <root>/<h[0:2]>/<h[2:4]>/<h>.json   {"username": ..., "version": n, "items": {label: item}}
+    <root>/<h[0:2]>/<h[2:4]>/<h>.lock   advisory lock file of the shard
+    <root>/.changes                     touched after every write (the change token)
+
+where h is the SHA-256 of the username. A write touches only the shards of
+the users it changes: for each one it takes the shard's thread lock and an
+exclusive fcntl lock on the shard's lock file, checks the shard file on disk
+against the cached copy (re-reading it if another process wrote in between,
+so its changes are not lost), applies the changes, and replaces the
+file atomically with the version bumped. Writers for different users never
+wait for each other, and readers never lock: a shard file is only ever
+replaced whole. A user whose last item is deleted keeps an empty shard file,
+so its version never goes back to 0. Other processes notice a replaced shard
+by its (mtime, size, inode), never by comparing versions.
+
+A batch spanning several users writes their shards in parallel, on up to
+write_workers threads, so a group commit costs about one shard write however
+many users it covers. It is atomic per user, not as a whole. On platforms without fcntl the locks only cover the
+current process.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .storage import Store
+
+try:
+    import fcntl
+except ImportError:  # Windows: shards are only locked within the process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+CHANGES_FILE = ".changes"
+WRITE_WORKERS = 8  # shards written at once by one batch
+
+
+class _Shard:
+    """Cached contents of one shard file"""
+
+    __slots__ = ("username", "version", "items", "token")
+
+    def __init__(self, username, version=0, items=None, token=None):
+        self.username = username
+        self.version = version
+        self.items = items if items is not None else {}
+        self.token = token
+
+
+def _stat_token(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+
+class ShardedStore(Store):
+    """One shard file per user with per-shard locks, safe to share between threads and processes"""
+
+    def __init__(self, path, write_workers=WRITE_WORKERS):
+        self.path = path
+        self.write_workers = write_workers
+        os.makedirs(path, exist_ok=True)
+        self._changes_path = os.path.join(path, CHANGES_FILE)
+        self._shards = {}  # username -> _Shard
+        self._locks = {}  # username -> threading.Lock
+        self._locks_lock = threading.Lock()
+        self._pool = None
+        self._scan()
+
+    # -- shard files ----------------------------------------------------------
+
+    def shard_path(self, username):
+        """Return the path of a user's shard file"""
+        digest = hashlib.sha256(username.encode("utf-8")).hexdigest()
+        return os.path.join(self.path, digest[:2], digest[2:4], f"{digest}.json")
+
+    def _read_shard(self, path):
+        """Return the shard stored at path, or None if there is none"""
+        token = _stat_token(path)
+        if token is None:
+            return None
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        return _Shard(data["username"], data["version"], data["items"], token)
+
+    def _write_shard(self, path, shard):
+        tmp_path = f"{path}.tmp"
+        try:
+            # json.dumps() uses the C encoder, which json.dump() to a file does not
+            data = json.dumps({"username": shard.username, "version": shard.version, "items": shard.items},
+                              separators=(",", ":"))
+            with open(tmp_path, "w") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.error(f"Error saving shard of {shard.username!r}: {str(e)}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        shard.token = _stat_token(path)
+
+    def _scan(self):
+        """Load every shard under the root directory"""
+        self.reload()
+        logger.info(f"Loaded {len(self.users())} user shards from {self.path}")
+
+    def _lock_for(self, username):
+        with self._locks_lock:
+            lock = self._locks.get(username)
+            if lock is None:
+                lock = self._locks[username] = threading.Lock()
+            return lock
+
+    def _current(self, username, path):
+        """Return the user's shard as it is on disk, re-reading it if another process replaced it
+
+        Called with the shard locked, so nothing changes it until the lock is released.
+        """
+        cached = self._shards.get(username)
+        token = _stat_token(path)
+        if cached is not None and cached.token == token:
+            return cached
+        shard = self._read_shard(path) or _Shard(username)
+        if cached is not None and cached.version != shard.version:
+            logger.info(f"Shard of {username!r} changed on disk (version {cached.version} -> {shard.version})")
+        return shard
+
+    def _update(self, username, changes):
+        """Apply [(label, item or None)] to one user's shard under its locks, returning the labels deleted"""
+        path = self.shard_path(username)
+        deleted = []
+        with self._lock_for(username):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(f"{os.path.splitext(path)[0]}.lock", "a") as lock_file:
+                # Released when the lock file is closed
+                if fcntl is not None:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+                shard = self._current(username, path)
+                items = dict(shard.items)
+                for label, item in changes:
+                    if item is not None:
+                        items[label] = item
+                    elif label in items:
+                        del items[label]
+                        deleted.append(label)
+                if items == shard.items:
+                    self._shards[username] = shard
+                    return deleted
+                # An emptied shard is kept, not removed, so its version never goes backwards
+                updated = _Shard(username, shard.version + 1, items)
+                self._write_shard(path, updated)
+                self._shards[username] = updated
+        self._touch_changes()
+        return deleted
+
+    def _touch_changes(self):
+        now = time.time_ns()
+        try:
+            os.utime(self._changes_path, ns=(now, now))
+        except FileNotFoundError:
+            open(self._changes_path, "a").close()
+
+    # -- Store interface ------------------------------------------------------
+
+    def get(self, username, label):
+        shard = self._shards.get(username)
+        return shard.items.get(label) if shard is not None else None
+
+    def put(self, username, label, item):
+        self._update(username, [(label, item)])
+
+    def put_many(self, entries):
+        self.apply(entries)
+
+    def delete(self, username, label):
+        return bool(self._update(username, [(label, None)]))
+
+    def apply(self, changes):
+        """Apply (username, label, item or None) changes, writing each affected user's shard once"""
+        by_user = {}
+        for username, label, item in changes:
+            by_user.setdefault(username, []).append((label, item))
+        if len(by_user) == 1 or self.write_workers <= 1:
+            for username, user_changes in by_user.items():
+                self._update(username, user_changes)
+            return
+        with self._locks_lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.write_workers, thread_name_prefix="shard-write")
+        # Waits for every shard, then raises the first failure
+        futures = [self._pool.submit(self._update, username, user_changes)
+                   for username, user_changes in by_user.items()]
+        for future in futures:
+            future.exception()
+        for future in futures:
+            future.result()
+
+    def list_items(self, username):
+        shard = self._shards.get(username)
+        return dict(shard.items) if shard is not None else {}
+
+    def users(self):
+        return [username for username, shard in self._shards.items() if shard.items]
+
+    def version(self, username):
+        """Return the version of a user's shard as last seen by this process (0 if it has none)"""
+        shard = self._shards.get(username)
+        return shard.version if shard is not None else 0
+
+    def change_token(self):
+        return _stat_token(self._changes_path)
+
+    def reload(self):
+        """Re-read the shards other processes have added, replaced or removed
+
+        A shard is re-read when its file's (mtime, size, inode) differs from
+        the cached copy's, and the new copy is only installed if this process
+        has not written the shard since the scan began, so its own writes are
+        never undone.
+        """
+        cached = {self.shard_path(username): shard for username, shard in self._shards.items()}
+        found = set()
+        for directory, _, files in os.walk(self.path):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(directory, name)
+                seen = cached.get(path)
+                if seen is not None and seen.token == _stat_token(path):
+                    found.add(seen.username)
+                    continue
+                try:
+                    shard = self._read_shard(path)
+                except (ValueError, KeyError) as e:
+                    logger.error(f"Error decoding shard {name}: {str(e)}")
+                    continue
+                if shard is None:
+                    continue
+                found.add(shard.username)
+                with self._lock_for(shard.username):
+                    if self._shards.get(shard.username) is seen:
+                        self._shards[shard.username] = shard
+        for path, seen in cached.items():
+            if seen.username not in found:
+                with self._lock_for(seen.username):
+                    if self._shards.get(seen.username) is seen and _stat_token(path) is None:
+                        del self._shards[seen.username]
+
+    def close(self):
+        with self._locks_lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
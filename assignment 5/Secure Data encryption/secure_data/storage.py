@@ -0,0 +1,641 @@
+"""Pluggable persistence for item metadata.
+
+Every backend implements the Store interface over items, which are small
+JSON-able dicts keyed by (username, label). Backends:
+
+    json     - the original single JSON document, rewritten on every change,
+               with incremental backups (see backups.py)
+    journal  - append-only checksummed log with background compaction
+               (see journal_store.py)
+    sqlite   - SQLite database in WAL mode with a unique (username, label) index
+    sharded  - one file per user in a hashed directory tree, with per-shard
+               locks (see shard_store.py)
+
+open_store() returns one shared instance per backend and path, since all
+Streamlit sessions run in the same process. CachedStore keeps one parsed copy
+of a backend for the whole process and StoreView gives each session a
+read-through mapping over it, so memory scales with data size, not sessions.
+With write-behind enabled, CachedStore commits writes in the background in
+coalesced batches (see group_commit.py).
+"""
+import contextlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+from collections import Counter
+from collections.abc import Mapping
+from types import MappingProxyType
+
+from . import metrics
+from .backups import BackupChains
+from .group_commit import GroupCommitWriter, completed
+from .item_index import ItemIndex
+
+logger = logging.getLogger(__name__)
+
+MAX_BACKUPS = 5  # backup chains kept per JSON store
+
+
+class Store:
+    """Interface implemented by every storage backend"""
+
+    # BackupChains recording every change, for backends that keep restore points (only JsonFileStore)
+    backups = None
+
+    def get(self, username, label):
+        """Return an item, or None if it does not exist"""
+        raise NotImplementedError
+
+    def put(self, username, label, item):
+        """Store or replace an item"""
+        raise NotImplementedError
+
+    def put_many(self, entries):
+        """Store several (username, label, item) entries"""
+        for username, label, item in entries:
+            self.put(username, label, item)
+
+    def delete(self, username, label):
+        """Delete an item, returning False if it did not exist"""
+        raise NotImplementedError
+
+    def apply(self, changes):
+        """Apply (username, label, item or None) changes in order, None deleting the item
+
+        Deleting an item that does not exist is not an error. Backends override
+        this to write a whole batch at once.
+        """
+        for username, label, item in changes:
+            if item is None:
+                self.delete(username, label)
+            else:
+                self.put(username, label, item)
+
+    def labels(self, username):
+        """Return the labels stored for a user, in insertion order"""
+        return list(self.list_items(username))
+
+    def list_items(self, username):
+        """Return a {label: item} dict for one user"""
+        raise NotImplementedError
+
+    def users(self):
+        """Return the users that have at least one item"""
+        raise NotImplementedError
+
+    def entries(self):
+        """Yield every (username, label, item) entry"""
+        for username in self.users():
+            for label, item in self.list_items(username).items():
+                yield username, label, item
+
+    def snapshot(self):
+        """Return every item as a {username: {label: item}} dict"""
+        return {username: self.list_items(username) for username in self.users()}
+
+    def change_token(self):
+        """Return a value that changes when another process modifies the store
+
+        None means external changes are not detected (single-writer backends).
+        """
+        return None
+
+    def reload(self):
+        """Re-read state that another process may have changed"""
+
+    def close(self):
+        """Release any open files or connections"""
+
+
+def _file_token(*paths):
+    """Return (mtime_ns, size) for each existing path, used as a change token"""
+    token = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            token.append((stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            token.append(None)
+    return tuple(token)
+
+
+class JsonFileStore(Store):
+    """The whole store as one JSON document, rewritten on every change
+
+    Each save also records its changes in incremental backup chains under
+    ``<path>.backups/``, from which any retained point can be restored.
+    """
+
+    def __init__(self, path, max_backups=MAX_BACKUPS):
+        self.path = path
+        self.max_backups = max_backups
+        self.backups = BackupChains(f"{path}.backups", max_chains=max_backups)
+        self._lock = threading.RLock()
+        self._data = self._load()
+        if self._data and not self.backups.has_points():
+            # The first chain's base is the store as found, before any change
+            self.backups.record(self._data, [])
+
+    def _legacy_backups(self):
+        """Return full-copy backups written by earlier versions, oldest first"""
+        directory = os.path.dirname(self.path) or "."
+        prefix = os.path.basename(self.path)
+        return sorted(os.path.join(directory, f) for f in os.listdir(directory)
+                      if f.startswith(prefix) and f.endswith(".backup"))
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            logger.info("No existing data file found")
+            return {}
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except json.JSONDecodeError as e:
+            logger.error(f"Error decoding data file: {str(e)}")
+            # Try to restore the latest backup point, then a legacy full backup
+            try:
+                return self.backups.restore()
+            except (LookupError, OSError, ValueError) as restore_error:
+                logger.error(f"Error restoring backup: {str(restore_error)}")
+            backups = self._legacy_backups()
+            if not backups:
+                raise
+            with open(backups[-1], "r") as f:
+                data = json.load(f)
+            logger.info(f"Restored data from backup: {backups[-1]}")
+            return data
+
+    def _save(self, changes):
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(self._data, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            logger.info("Data saved successfully")
+        except Exception as e:
+            logger.error(f"Error saving data: {str(e)}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.backups.record(self._data, changes)
+
+    def get(self, username, label):
+        with self._lock:
+            return self._data.get(username, {}).get(label)
+
+    def put(self, username, label, item):
+        self.put_many([(username, label, item)])
+
+    def put_many(self, entries):
+        with self._lock:
+            changes = [[username, label, item] for username, label, item in entries]
+            for username, label, item in changes:
+                self._data.setdefault(username, {})[label] = item
+            self._save(changes)
+
+    def delete(self, username, label):
+        with self._lock:
+            items = self._data.get(username, {})
+            if label not in items:
+                return False
+            del items[label]
+            if not items:
+                del self._data[username]
+            self._save([[username, label, None]])
+            return True
+
+    def apply(self, changes):
+        with self._lock:
+            changes = [[username, label, item] for username, label, item in changes]
+            for username, label, item in changes:
+                if item is not None:
+                    self._data.setdefault(username, {})[label] = item
+                elif label in self._data.get(username, {}):
+                    del self._data[username][label]
+                    if not self._data[username]:
+                        del self._data[username]
+            self._save(changes)
+
+    def list_items(self, username):
+        with self._lock:
+            return dict(self._data.get(username, {}))
+
+    def users(self):
+        with self._lock:
+            return list(self._data)
+
+    def change_token(self):
+        return _file_token(self.path)
+
+    def reload(self):
+        with self._lock:
+            self._data = self._load()
+
+
+class SQLiteStore(Store):
+    """SQLite-backed store; each operation touches only the rows involved
+
+    WAL mode lets readers proceed while another session writes, and each thread
+    gets its own connection so Streamlit sessions do not serialize on one.
+    """
+
+    def __init__(self, path, timeout=30.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        with self._connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS items (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    username TEXT NOT NULL,
+                    label TEXT NOT NULL,
+                    item TEXT NOT NULL
+                )
+            """)
+            conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS items_username_label ON items (username, label)")
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def get(self, username, label):
+        row = self._connection().execute(
+            "SELECT item FROM items WHERE username = ? AND label = ?", (username, label)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, username, label, item):
+        self.put_many([(username, label, item)])
+
+    def put_many(self, entries):
+        rows = [(username, label, json.dumps(item)) for username, label, item in entries]
+        with self._connection() as conn:
+            conn.executemany("""
+                INSERT INTO items (username, label, item) VALUES (?, ?, ?)
+                ON CONFLICT (username, label) DO UPDATE SET item = excluded.item
+            """, rows)
+
+    def delete(self, username, label):
+        with self._connection() as conn:
+            cursor = conn.execute("DELETE FROM items WHERE username = ? AND label = ?", (username, label))
+            return cursor.rowcount > 0
+
+    def apply(self, changes):
+        with self._connection() as conn:
+            for username, label, item in changes:
+                if item is None:
+                    conn.execute("DELETE FROM items WHERE username = ? AND label = ?", (username, label))
+                else:
+                    conn.execute("""
+                        INSERT INTO items (username, label, item) VALUES (?, ?, ?)
+                        ON CONFLICT (username, label) DO UPDATE SET item = excluded.item
+                    """, (username, label, json.dumps(item)))
+
+    def labels(self, username):
+        return [row[0] for row in self._connection().execute(
+            "SELECT label FROM items WHERE username = ? ORDER BY id", (username,))]
+
+    def list_items(self, username):
+        return {label: json.loads(item) for label, item in self._connection().execute(
+            "SELECT label, item FROM items WHERE username = ? ORDER BY id", (username,))}
+
+    def users(self):
+        return [row[0] for row in self._connection().execute("SELECT DISTINCT username FROM items")]
+
+    def change_token(self):
+        return _file_token(self.path, f"{self.path}-wal")
+
+    def close(self):
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+        self._local = threading.local()
+
+
+def payload_references(item):
+    """Yield the ("blob", hash) and ("manifest", ID) keys of the payload an item refers to"""
+    if "blob" in item:
+        yield "blob", item["blob"]["hash"]
+    if "chunks" in item:
+        yield "manifest", item["chunks"]["manifest"]
+
+
+class CachedStore(Store):
+    """Process-wide parsed copy of a backend, shared by every session
+
+    Reads are served from memory. Writes go to the backend first and then
+    replace the affected user's dict (copy-on-write), so a session iterating
+    a user's items never sees the dict change underneath it. ``version`` is
+    bumped on every change; refresh_if_stale() reloads from the backend when
+    its change token shows another process wrote to it.
+
+    With write_behind (seconds) above zero, writes instead update the cache at
+    once and are committed to the backend by a GroupCommitWriter; put(),
+    put_many() and flush() return a Future that completes once the change is
+    durable. Without it the returned Futures are already complete.
+    """
+
+    def __init__(self, backend, write_behind=0):
+        self.backend = backend
+        self.version = 0
+        self._lock = threading.RLock()
+        self._label_lists = {}
+        self._indexes = {}
+        self._references = None
+        self._writer = None
+        if write_behind > 0:
+            self._writer = GroupCommitWriter(self._commit, write_behind, on_failure=self._recover)
+        self._load()
+
+    def _load(self):
+        self._token = self.backend.change_token()
+        self._data = {username: MappingProxyType(items)
+                      for username, items in self.backend.snapshot().items()}
+        self._indexes = {}
+        self._references = None
+        self.version += 1
+
+    def _reload(self):
+        """Re-read the backend, keeping changes still queued for the writer"""
+        self.backend.reload()
+        self._load()
+        if self._writer is not None:
+            changes = {}
+            for username, label, item in self._writer.queued():
+                changes.setdefault(username, {})[label] = item
+            self._apply_changes(changes)
+
+    def refresh_if_stale(self):
+        """Reload if another process changed the backend, returning True if it did"""
+        token = self.backend.change_token()
+        if token is None or token == self._token:
+            return False
+        # A commit in progress changes the token too; wait for it to adopt its own change
+        committing = self._writer.commit_lock if self._writer is not None else contextlib.nullcontext()
+        with committing, self._lock:
+            if self.backend.change_token() == self._token:
+                return False
+            logger.info("Store changed on disk; reloading shared cache")
+            self._reload()
+            return True
+
+    def _write(self, operation, changes):
+        """Run a backend write and apply {username: {label: item or None}} to the cache"""
+        with self._lock:
+            unchanged_before = self.backend.change_token() == self._token
+            with metrics.timer("commit"):
+                result = operation()
+            self._apply_changes(changes)
+            # Our own write changes the token; only adopt it if nobody else wrote first
+            if unchanged_before:
+                self._token = self.backend.change_token()
+            return result
+
+    def _submit(self, changes):
+        """Apply {username: {label: item or None}} to the cache and queue it for the writer"""
+        with self._lock:
+            self._apply_changes(changes)
+            return self._writer.submit((username, label, item) for username, updates in changes.items()
+                                       for label, item in updates.items())
+
+    def _commit(self, changes):
+        """Write a batch from the writer to the backend (runs on the writer thread)"""
+        unchanged_before = self.backend.change_token() == self._token
+        with metrics.timer("commit"):
+            self.backend.apply(changes)
+        if unchanged_before:
+            with self._lock:
+                self._token = self.backend.change_token()
+
+    def _recover(self, error):
+        """Bring the cache back in line with the backend after a failed commit"""
+        with self._lock:
+            self._reload()
+
+    def _apply_changes(self, changes):
+        """Apply {username: {label: item or None}} to the cache"""
+        for username, updates in changes.items():
+            items = dict(self._data.get(username, {}))
+            for label, item in updates.items():
+                if self._references is not None:
+                    self._count_references(items.get(label), -1)
+                    self._count_references(item, 1)
+                if item is None:
+                    items.pop(label, None)
+                else:
+                    items[label] = item
+            if items:
+                self._data[username] = MappingProxyType(items)
+            else:
+                self._data.pop(username, None)
+            index = self._indexes.get(username)
+            if index is not None:
+                for label, item in updates.items():
+                    index.update(label, item)
+        self.version += 1
+
+    def _count_references(self, item, delta):
+        if item is None:
+            return
+        for key in payload_references(item):
+            self._references[key] += delta
+            if self._references[key] <= 0:
+                del self._references[key]
+
+    @property
+    def backups(self):
+        """The backend's BackupChains, or None if it keeps no restore points"""
+        return self.backend.backups
+
+    def references(self, kind, key):
+        """Return how many items refer to a blob (kind "blob") or chunk manifest (kind "manifest")
+
+        The counts are built on first use and then kept up to date by every
+        write, so a lookup does not scan the store.
+        """
+        with self._lock:
+            if self._references is None:
+                self._references = Counter(reference for items in self._data.values()
+                                           for item in items.values() for reference in payload_references(item))
+            return self._references[(kind, key)]
+
+    def get(self, username, label):
+        return self._data.get(username, {}).get(label)
+
+    def put(self, username, label, item):
+        return self.put_many([(username, label, item)])
+
+    def put_many(self, entries):
+        entries = list(entries)
+        changes = {}
+        for username, label, item in entries:
+            changes.setdefault(username, {})[label] = item
+        if self._writer is not None:
+            return self._submit(changes)
+        self._write(lambda: self.backend.put_many(entries), changes)
+        return completed()
+
+    def delete(self, username, label):
+        with self._lock:
+            if label not in self._data.get(username, {}):
+                return False
+            if self._writer is not None:
+                self._submit({username: {label: None}})
+                return True
+            return self._write(lambda: self.backend.delete(username, label), {username: {label: None}})
+
+    def flush(self):
+        """Return a Future that completes once every write made so far is durable"""
+        return self._writer.flush() if self._writer is not None else completed()
+
+    def compare_and_put(self, entries):
+        """Write (username, label, expected, item) entries whose current item is still expected
+
+        Background jobs use this so an item a user changed or deleted meanwhile
+        is not overwritten. Returns the number of items written.
+        """
+        with self._lock:
+            current = [(username, label, item) for username, label, expected, item in entries
+                       if self.get(username, label) == expected]
+            if current:
+                self.put_many(current)
+            return len(current)
+
+    def labels(self, username):
+        return list(self._data.get(username, {}))
+
+    def list_items(self, username):
+        """Return a read-only {label: item} mapping for one user (not a copy)"""
+        return self._data.get(username, MappingProxyType({}))
+
+    def count(self, username):
+        return len(self._data.get(username, ()))
+
+    def page(self, username, offset, limit):
+        """Return up to limit (label, item) pairs of a user's items, starting at offset
+
+        The user's labels are listed once per change to their items (every write
+        replaces the user's dict, so its identity tells whether the cached list is
+        current); after that a page costs only its own length.
+        """
+        items = self._data.get(username)
+        if not items:
+            return []
+        cached = self._label_lists.get(username)
+        if cached is None or cached[0] is not items:
+            cached = (items, list(items))
+            self._label_lists[username] = cached
+        return [(label, items[label]) for label in cached[1][offset:offset + limit]]
+
+    def index(self, username):
+        """Return the search index of a user's items, built on first use
+
+        Writes update the index item by item; only a reload from the backend
+        discards it.
+        """
+        with self._lock:
+            index = self._indexes.get(username)
+            if index is None:
+                index = ItemIndex(self._data.get(username))
+                self._indexes[username] = index
+            return index
+
+    def search(self, username, offset=0, limit=None, **criteria):
+        """Return (labels, total) for one page of a user's matching labels (see ItemIndex.query)"""
+        with self._lock:
+            return self.index(username).query(offset=offset, limit=limit, **criteria)
+
+    def users(self):
+        return list(self._data)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        self.backend.close()
+        _forget_store(self.backend)
+
+
+class StoreView(Mapping):
+    """Read-through {username: {label: item}} mapping over a shared store
+
+    Sessions hold one of these instead of their own parsed copy; every lookup
+    goes to the shared store, so a view costs nothing to create.
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    def __getitem__(self, username):
+        items = self.store.list_items(username)
+        if not items:
+            raise KeyError(username)
+        return items
+
+    def __iter__(self):
+        return iter(self.store.users())
+
+    def __len__(self):
+        return len(self.store.users())
+
+
+def _open_journal(path, **options):
+    from .journal_store import JournalStore
+    return JournalStore(path, **options)
+
+
+def _open_sharded(path, **options):
+    from .shard_store import ShardedStore
+    return ShardedStore(path, **options)
+
+
+BACKENDS = {
+    "json": JsonFileStore,
+    "journal": _open_journal,
+    "sqlite": SQLiteStore,
+    "sharded": _open_sharded,
+}
+
+_open_stores = {}
+_open_stores_lock = threading.Lock()
+
+
+def open_store(backend, path, seed=None, **options):
+    """Return the process-wide store for a backend and path, opening it on first use
+
+    If the store's file does not exist yet and seed is given, seed() is called
+    once to provide the initial (username, label, item) entries.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown storage backend: {backend!r} (expected one of {', '.join(BACKENDS)})")
+    key = (backend, os.path.abspath(path))
+    with _open_stores_lock:
+        store = _open_stores.get(key)
+        if store is None:
+            created = not os.path.exists(path)
+            store = BACKENDS[backend](path, **options)
+            if created and seed is not None:
+                store.put_many(seed())
+            _open_stores[key] = store
+            logger.info(f"Opened {backend} store: {path}")
+        return store
+
+
+def _forget_store(store):
+    """Drop a closed store from the process-wide table so the next open_store() reopens it"""
+    with _open_stores_lock:
+        for key, opened in list(_open_stores.items()):
+            if opened is store:
+                del _open_stores[key]
@@ -0,0 +1,196 @@
+"""Segmented streaming AEAD format for stored payloads.
+
+A payload is a header followed by fixed-size AES-256-GCM chunks:
+
+    header = MAGIC (4) | version (1) | chunk_size (4, big endian) | salt (16) | nonce_prefix (7)
+    chunk  = AESGCM(subkey, nonce_prefix | counter (4) | final_flag (1), plaintext, aad=header)
+
+Every chunk except the last carries exactly ``chunk_size`` bytes of plaintext;
+the last one is flagged in its nonce, so truncation, reordering and appended
+data are all detected. The per-payload subkey is derived from the caller's key
+with HKDF over the random header salt, which keeps nonces unique across payloads
+encrypted under the same key. Encryption and decryption only ever hold one or
+two chunks in memory.
+"""
+import io
+import os
+import struct
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+MAGIC = b"SDEs"
+VERSION = 1
+DEFAULT_CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = 16 * 1024 * 1024
+TAG_SIZE = 16
+SALT_SIZE = 16
+NONCE_PREFIX_SIZE = 7
+
+_HEADER = struct.Struct(f">4sBI{SALT_SIZE}s{NONCE_PREFIX_SIZE}s")
+HEADER_SIZE = _HEADER.size
+_HKDF_INFO = b"secure-data-encryption/stream/v1"
+
+
+class StreamFormatError(ValueError):
+    """Raised when a payload is not a well-formed stream (bad header or truncated)"""
+
+
+def is_stream_payload(data):
+    """Return True if the given leading bytes start a streaming payload"""
+    return bytes(data[:len(MAGIC)]) == MAGIC
+
+
+def encrypted_size(plaintext_size, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Return the ciphertext size for a plaintext of the given size"""
+    chunks = max(1, -(-plaintext_size // chunk_size))
+    return HEADER_SIZE + plaintext_size + chunks * TAG_SIZE
+
+
+def _derive_subkey(key, salt):
+    if len(key) != 32:
+        raise ValueError("Stream key must be 32 bytes")
+    return HKDF(algorithm=hashes.SHA256(), length=32, salt=salt, info=_HKDF_INFO).derive(key)
+
+
+def _nonce(prefix, counter, final):
+    return prefix + struct.pack(">IB", counter, 1 if final else 0)
+
+
+def _as_reader(src):
+    """Wrap bytes-like sources so they can be read chunk by chunk without copying"""
+    if isinstance(src, (bytes, bytearray, memoryview)):
+        return _BufferReader(src)
+    return src
+
+
+class _BufferReader:
+    """Minimal file-like reader over a bytes-like object (bytes, memoryview, mmap slice)"""
+
+    def __init__(self, buffer):
+        self._view = buffer if isinstance(buffer, memoryview) else memoryview(buffer)
+        self._pos = 0
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = len(self._view) - self._pos
+        chunk = self._view[self._pos:self._pos + size]
+        self._pos += len(chunk)
+        return chunk
+
+
+def _read_exact(reader, size):
+    """Read up to size bytes, looping over short reads"""
+    data = reader.read(size)
+    if data is None:
+        data = b""
+    if len(data) == size or not data:
+        return data
+    parts = [bytes(data)]
+    remaining = size - len(data)
+    while remaining:
+        more = reader.read(remaining)
+        if not more:
+            break
+        parts.append(bytes(more))
+        remaining -= len(more)
+    return b"".join(parts)
+
+
+def iter_encrypt(key, src, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield the header and encrypted chunks for the plaintext read from src"""
+    if not 0 < chunk_size <= MAX_CHUNK_SIZE:
+        raise ValueError(f"Chunk size must be between 1 and {MAX_CHUNK_SIZE} bytes")
+    reader = _as_reader(src)
+    salt = os.urandom(SALT_SIZE)
+    prefix = os.urandom(NONCE_PREFIX_SIZE)
+    header = _HEADER.pack(MAGIC, VERSION, chunk_size, salt, prefix)
+    aead = AESGCM(_derive_subkey(key, salt))
+    yield header
+
+    counter = 0
+    current = _read_exact(reader, chunk_size)
+    while True:
+        # Look one chunk ahead so the final chunk can be flagged
+        following = _read_exact(reader, chunk_size) if len(current) == chunk_size else b""
+        final = not following
+        yield aead.encrypt(_nonce(prefix, counter, final), bytes(current), header)
+        if final:
+            return
+        counter += 1
+        if counter >= 2 ** 32:
+            raise StreamFormatError("Payload too large for stream format")
+        current = following
+
+
+def read_header(reader):
+    """Read and validate a stream header, returning (header_bytes, chunk_size, salt, prefix)"""
+    header = bytes(_read_exact(reader, HEADER_SIZE))
+    if len(header) != HEADER_SIZE:
+        raise StreamFormatError("Truncated stream header")
+    magic, version, chunk_size, salt, prefix = _HEADER.unpack(header)
+    if magic != MAGIC:
+        raise StreamFormatError("Not a streaming payload")
+    if version != VERSION:
+        raise StreamFormatError(f"Unsupported stream version: {version}")
+    if not 0 < chunk_size <= MAX_CHUNK_SIZE:
+        raise StreamFormatError(f"Invalid chunk size: {chunk_size}")
+    return header, chunk_size, salt, prefix
+
+
+def iter_decrypt(key, src):
+    """Yield authenticated plaintext chunks from the payload read from src
+
+    Raises cryptography.exceptions.InvalidTag if any chunk fails authentication
+    (wrong key or tampered data) and StreamFormatError if the stream is truncated.
+    """
+    reader = _as_reader(src)
+    header, chunk_size, salt, prefix = read_header(reader)
+    aead = AESGCM(_derive_subkey(key, salt))
+    sealed_size = chunk_size + TAG_SIZE
+
+    counter = 0
+    current = _read_exact(reader, sealed_size)
+    while True:
+        if len(current) < TAG_SIZE:
+            raise StreamFormatError("Truncated stream payload")
+        following = _read_exact(reader, sealed_size) if len(current) == sealed_size else b""
+        final = not following
+        yield aead.decrypt(_nonce(prefix, counter, final), bytes(current), header)
+        if final:
+            return
+        counter += 1
+        current = following
+
+
+def encrypt_stream(key, src, dst, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Encrypt src (file-like or bytes) into the writable dst, returning bytes written"""
+    written = 0
+    for piece in iter_encrypt(key, src, chunk_size):
+        dst.write(piece)
+        written += len(piece)
+    return written
+
+
+def decrypt_stream(key, src, dst):
+    """Decrypt src (file-like or bytes) into the writable dst, returning bytes written"""
+    written = 0
+    for piece in iter_decrypt(key, src):
+        dst.write(piece)
+        written += len(piece)
+    return written
+
+
+def encrypt_bytes(key, data, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Encrypt an in-memory buffer and return the payload bytes"""
+    out = io.BytesIO()
+    encrypt_stream(key, data, out, chunk_size)
+    return out.getvalue()
+
+
+def decrypt_bytes(key, payload):
+    """Decrypt an in-memory payload and return the plaintext bytes"""
+    out = io.BytesIO()
+    decrypt_stream(key, payload, out)
+    return out.getvalue()
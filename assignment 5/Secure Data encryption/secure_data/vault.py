@@ -0,0 +1,668 @@
+"""Encrypted item storage without any UI.
+
+A Vault ties together the metadata store, the blob store, the derived-key
+cache and the keyring, and implements storing, loading, encrypting and
+decrypting items on top of them. It is meant to be created once per process
+and shared: the Streamlit app caches one for every session, and scripts and
+workers can create their own.
+
+Files of at least chunking.MIN_ITEM_SIZE are split into content-defined
+chunks that are stored once per user (see chunking.py and chunk_index.py);
+their item payload is an encrypted manifest listing the chunks.
+
+Items encrypted before per-item key derivation used a key held in the
+Streamlit session; the methods that may decrypt such items take that key as
+``session_key`` (the Fernet key bytes) and refuse legacy payloads without it.
+"""
+import base64
+import contextlib
+import hashlib
+import io
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from cryptography.exceptions import InvalidTag
+from cryptography.fernet import Fernet
+
+from . import chunking, compression, config, kdf, metrics, stream_crypto
+from .auth import hash_passkey
+from .blob_store import BlobStore
+from .chunk_index import ChunkIndex
+from .key_management import Keyring, RotationJob
+from .storage import CachedStore, JsonFileStore, StoreView, open_store
+from .vault_export import write_archive
+
+logger = logging.getLogger(__name__)
+
+# Payload helpers: items reference an out-of-line blob, older items embed base64 text
+PAYLOAD_FIELDS = ("blob", "kdf", "key_id", "wrapped_key", "compression", "chunks", "encrypted_text")
+FINGERPRINT_LENGTH = 16
+CHUNK_BATCH_SIZE = 32  # chunks acquired in the index per transaction
+ORPHAN_MANIFEST_AGE = 24 * 3600  # seconds before an unreferenced manifest's chunks are released
+
+
+def get_payload(data_info):
+    """Return the payload fields of an item (blob reference, KDF parameters, legacy inline text)"""
+    return {key: data_info[key] for key in PAYLOAD_FIELDS if key in data_info}
+
+
+def payload_fingerprint(data_info, length=FINGERPRINT_LENGTH):
+    """Return a short hex fingerprint of an item's ciphertext"""
+    if "blob" in data_info:
+        return data_info["blob"]["hash"][:length]
+    return hashlib.sha256(data_info["encrypted_text"].encode()).hexdigest()[:length]
+
+
+def describe_payload(data_info):
+    """Return a one-line summary of an item's encrypted payload (never the ciphertext itself)"""
+    if "blob" in data_info:
+        size = data_info["blob"]["size"]
+    else:
+        size = len(data_info["encrypted_text"]) * 3 // 4
+    codec = f", {data_info['compression']}" if "compression" in data_info else ""
+    if "chunks" in data_info:
+        codec = f", {data_info['chunks']['count']} chunks"
+    return f"sha256:{payload_fingerprint(data_info)}… ({size} bytes{codec})"
+
+
+def encode_binary_data(binary_data):
+    """Convert binary data to base64 string for storage"""
+    return base64.b64encode(binary_data).decode('utf-8')
+
+
+def decode_binary_data(encoded_data):
+    """Convert base64 string back to binary data"""
+    return base64.b64decode(encoded_data.encode('utf-8'))
+
+
+class Vault:
+    """Items and their encrypted payloads, shared by every caller in a process"""
+
+    def __init__(self, backend=config.STORAGE_BACKEND, path=None, blob_dir=config.BLOB_DIR,
+                 keyring_file=config.KEYRING_FILE, legacy_data_file=config.DATA_FILE,
+                 kdf_log2_n=config.KDF_LOG2_N, key_cache_size=config.KEY_CACHE_SIZE,
+                 key_cache_ttl=config.KEY_CACHE_TTL, spool_size=config.DOWNLOAD_SPOOL_SIZE,
+                 upload_workers=config.UPLOAD_WORKERS, export_workers=config.EXPORT_WORKERS,
+                 compression=config.COMPRESSION, dedup=config.DEDUP, chunk_index_file=config.CHUNK_INDEX_FILE,
+                 write_behind_ms=config.WRITE_BEHIND_MS):
+        if backend not in config.STORE_PATHS:
+            raise ValueError(f"Unknown storage backend: {backend}")
+        self.backend = backend
+        self.path = path or config.STORE_PATHS[backend]
+        self.legacy_data_file = legacy_data_file
+        self.kdf_log2_n = kdf_log2_n
+        self.spool_size = spool_size
+        self.upload_workers = upload_workers
+        self.export_workers = export_workers
+        self.compression = compression
+        self.dedup = dedup
+
+        # Encrypted payloads live out of line; item metadata only keeps blob references
+        self.blob_store = BlobStore(blob_dir)
+        self.key_cache = kdf.DerivedKeyCache(max_entries=key_cache_size, ttl=key_cache_ttl)
+        self.keyring = Keyring(keyring_file)
+        self.chunk_index = ChunkIndex(chunk_index_file)
+        seed = self.read_legacy_data if backend != "json" else None
+        self.store = CachedStore(open_store(backend, self.path, seed=seed), write_behind=write_behind_ms / 1000)
+        if self.store.backups is None:
+            logger.warning(f"The {backend} store keeps no backup restore points; only the json backend does")
+        self.migrate_inline_payloads()
+        # Held while an item is replaced or deleted, so two writers never release the same payload,
+        # and while old master keys are retired, so no write re-seals an item under one
+        self._replace_lock = threading.Lock()
+        self.rotation_job = RotationJob(self.store, self.keyring, f"{keyring_file}.rotation",
+                                        lock=self._replace_lock)
+
+    # Persistence
+
+    def read_legacy_data(self):
+        """Return (username, label, item) entries from a DATA_FILE written by the JSON backend"""
+        if not os.path.exists(self.legacy_data_file):
+            return []
+        logger.info(f"Importing legacy data file {self.legacy_data_file} into the {self.backend} store")
+        return list(JsonFileStore(self.legacy_data_file).entries())
+
+    def migrate_inline_payloads(self):
+        """Move legacy inline base64 payloads into the blob store
+
+        Afterwards the store only holds metadata (label, type, file_info,
+        timestamp, passkey hash), so loading it scales with the item count.
+        """
+        migrated = []
+        for username, label, item in self.store.entries():
+            if "encrypted_text" in item:
+                payload = decode_binary_data(item["encrypted_text"])
+                item = {key: value for key, value in item.items() if key != "encrypted_text"}
+                item["blob"] = self.blob_store.put_bytes(payload)
+                migrated.append((username, label, item))
+        if migrated:
+            self.store.put_many(migrated)
+            logger.info(f"Moved {len(migrated)} inline payloads to the blob store")
+
+    @metrics.timed("save")
+    def save_item(self, username, data_name, data_info, wait=False):
+        """Persist one item through the configured store
+
+        Returns a Future that completes once the item is durable (writes are
+        committed in the background; see group_commit.py). With wait, the
+        call itself blocks until then. The payload of an item it overwrites is
+        released once the write is durable, as for delete_item().
+        """
+        durable = self._put([(username, data_name, data_info)])
+        if wait:
+            durable.result()
+        logger.info("Data saved successfully")
+        return durable
+
+    @metrics.timed("save")
+    def save_items(self, entries, wait=False):
+        """Persist several (username, label, item) entries in one batched write, like save_item()"""
+        entries = list(entries)
+        durable = self._put(entries)
+        if wait:
+            durable.result()
+        logger.info(f"Saved {len(entries)} items")
+        return durable
+
+    def _put(self, entries):
+        """Write (username, label, item) entries, releasing the payloads they overwrite once durable
+
+        Items sealed under a master key that a rotation has since replaced
+        (encrypted before the rotation, saved after) are re-sealed under the
+        active key first, so the old key can be retired.
+        """
+        with self._replace_lock:
+            entries = [(username, label, self._reseal_if_stale(item)) for username, label, item in entries]
+            latest = {}
+            replaced = []
+            for username, label, item in entries:
+                key = (username, label)
+                previous = latest[key] if key in latest else self.store.get(username, label)
+                if previous is not None:
+                    replaced.append(previous)
+                latest[key] = item
+            durable = self.store.put_many(entries)
+            self._release_unreferenced(replaced, durable)
+        return durable
+
+    def _reseal_if_stale(self, item):
+        key_id = item.get("key_id")
+        if key_id is None or key_id == self.keyring.active_id:
+            return item
+        new_id, wrapped_key = self.keyring.rewrap(key_id, item["wrapped_key"])
+        return {**item, "key_id": new_id, "wrapped_key": wrapped_key}
+
+    def _release_unreferenced(self, items, durable):
+        """Release the payloads of removed items that no stored item refers to, once durable completes"""
+        released = set()
+        for data_info in items:
+            if "blob" not in data_info:
+                continue
+            digest = data_info["blob"]["hash"]
+            if digest in released or self.store.references("blob", digest):
+                continue
+            released.add(digest)
+            durable.add_done_callback(lambda done, data_info=data_info: self._release_payload(done, data_info))
+
+    @metrics.timed("load")
+    def load_data(self):
+        """Return a read-through {username: {label: item}} view of the shared store
+
+        The parsed store is shared by every caller; it is only re-read when
+        another process has changed it on disk.
+        """
+        if self.store.refresh_if_stale():
+            logger.info("Data reloaded successfully")
+        return StoreView(self.store)
+
+    def list_page(self, username, page, page_size, **criteria):
+        """Return (page of (label, item) pairs, total items, page number) for one user
+
+        page is 0-based and clamped to the last page, so a page that emptied
+        after deletes falls back to the one before it. Without criteria items
+        come in insertion order; otherwise criteria are search, filter and sort
+        options for ItemIndex.query() and total counts the matches.
+        """
+        page_size = max(1, page_size)
+        if not criteria:
+            total = self.store.count(username)
+            page = min(max(0, page), max(0, (total - 1) // page_size))
+            return self.store.page(username, page * page_size, page_size), total, page
+        with metrics.timer("search"):
+            labels, total = self.store.search(username, page * page_size, page_size, **criteria)
+            if not labels and page:
+                # The page is past the end, e.g. after deletes; show the last one
+                page = max(0, (total - 1) // page_size)
+                labels, total = self.store.search(username, page * page_size, page_size, **criteria)
+        items = self.store.list_items(username)
+        return [(label, items[label]) for label in labels if label in items], total, page
+
+    @metrics.timed("delete")
+    def delete_item(self, username, data_name):
+        """Delete an item, then release its blob once no other item references it
+
+        The blob is only removed after the deletion is durable, so a crash
+        never leaves a stored item pointing at a missing blob.
+        """
+        with self._replace_lock:
+            data_info = self.store.get(username, data_name)
+            if data_info is None or not self.store.delete(username, data_name):
+                return False
+            self._release_unreferenced([data_info], self.store.flush())
+        return True
+
+    def _release_payload(self, durable, data_info):
+        """Remove a deleted or overwritten item's blob and chunks once the change is durable
+
+        While the store keeps backup points, the payload is held instead until
+        no retained point can restore an item that uses it (see backups.py).
+        """
+        if durable.exception() is not None:
+            logger.error(f"Keeping the blob of an item whose removal failed: {str(durable.exception())}")
+            return
+        backups = self.store.backups
+        if backups is not None and backups.has_points():
+            try:
+                backups.hold({key: data_info[key] for key in ("blob", "chunks") if key in data_info})
+            except Exception as e:
+                logger.error(f"Error holding blob {data_info['blob']['hash']}: {str(e)}")
+            self.release_held_payloads()
+            return
+        self._delete_payload(data_info)
+
+    def _delete_payload(self, data_info):
+        """Delete a payload's blob and drop its chunk references"""
+        try:
+            self.blob_store.delete(data_info["blob"])
+            if "chunks" in data_info:
+                self.release_chunks(data_info["chunks"]["manifest"])
+        except Exception as e:
+            logger.error(f"Error releasing blob {data_info['blob']['hash']}: {str(e)}")
+
+    def release_held_payloads(self):
+        """Delete held payloads that neither a retained backup point nor a stored item refers to
+
+        Returns the number deleted.
+        """
+        backups = self.store.backups
+        if backups is None:
+            return 0
+        released = set()
+        for payload in backups.expired_holds():
+            digest = payload["blob"]["hash"]
+            if digest in released or self.store.references("blob", digest):
+                continue
+            released.add(digest)
+            self._delete_payload(payload)
+        if released:
+            logger.info(f"Released {len(released)} payloads no backup point refers to")
+        return len(released)
+
+    def release_chunks(self, manifest_id):
+        """Drop a chunk manifest's references, deleting chunks nothing else uses"""
+        self.chunk_index.release(manifest_id, lambda chunk_id: self.blob_store.delete({"hash": chunk_id}))
+
+    def collect_chunks(self, min_age=ORPHAN_MANIFEST_AGE):
+        """Release chunk manifests no item refers to, e.g. from uploads that were never saved
+
+        Only manifests older than min_age seconds are considered, so uploads
+        still waiting to be saved are left alone, and manifests held for backup
+        points are kept. Held payloads whose points have expired are deleted
+        first. Returns the number of orphans released.
+        """
+        self.release_held_payloads()
+        backups = self.store.backups
+        held = {payload["chunks"]["manifest"] for payload in backups.held()
+                if "chunks" in payload} if backups is not None else set()
+        orphans = [manifest_id for manifest_id in self.chunk_index.manifests(older_than=time.time() - min_age)
+                   if manifest_id not in held and not self.store.references("manifest", manifest_id)]
+        for manifest_id in orphans:
+            self.release_chunks(manifest_id)
+        if orphans:
+            logger.info(f"Released {len(orphans)} orphaned chunk manifests")
+        return len(orphans)
+
+    def dedup_stats(self, username=None):
+        """Return chunk counts and sizes for one user (or everyone); see ChunkIndex.stats()"""
+        return self.chunk_index.stats(username)
+
+    def resume_rotation(self):
+        """Resume a key rotation interrupted by a restart, or retire the keys a finished one replaced"""
+        if self.rotation_job.pending():
+            logger.info("Resuming interrupted key rotation")
+            self.rotation_job.start()
+        else:
+            self.rotation_job.retire_old_keys()
+
+    # Payload crypto
+
+    def payload_key(self, payload, passkey, session_key=None):
+        """Return the key for a payload
+
+        Current items unwrap their data key with the passkey-derived key and the
+        keyring; older items use the passkey-derived key directly, and items from
+        before key derivation use the legacy session key.
+        """
+        if isinstance(payload, dict) and "kdf" in payload:
+            passkey_key = self.key_cache.get_or_derive(passkey, payload["kdf"])
+            if "key_id" in payload:
+                return self.keyring.unwrap(payload["key_id"], payload["wrapped_key"], passkey_key)
+            return passkey_key
+        if session_key is None:
+            raise ValueError("Legacy payloads need the session key")
+        return base64.urlsafe_b64decode(session_key)
+
+    @contextlib.contextmanager
+    def open_payload(self, payload):
+        """Yield the raw ciphertext of a payload; blobs are memory-mapped, not read"""
+        if isinstance(payload, str):
+            yield decode_binary_data(payload)
+        elif "blob" in payload:
+            with self.blob_store.map(payload["blob"]) as data:
+                yield data
+        else:
+            yield decode_binary_data(payload["encrypted_text"])
+
+    def verify_passkey(self, data_info, passkey):
+        """Check a passkey against an item
+
+        Items with KDF parameters keep no passkey hash: the passkey is correct if
+        the key it derives authenticates the first chunk of the payload.
+        """
+        if "kdf" not in data_info:
+            return hash_passkey(passkey) == data_info.get("passkey")
+        try:
+            if "key_id" in data_info:
+                # Unwrapping the data key already authenticates the passkey
+                self.payload_key(data_info, passkey)
+                return True
+            with self.open_payload(data_info) as payload:
+                chunks = stream_crypto.iter_decrypt(self.payload_key(data_info, passkey), payload)
+                try:
+                    next(chunks)
+                finally:
+                    chunks.close()
+            return True
+        except InvalidTag:
+            return False
+        except KeyError as e:
+            # The item is sealed under a master key this keyring does not have
+            logger.error(f"Error verifying passkey: {str(e)}")
+            return False
+
+    @metrics.timed("encrypt")
+    def encrypt_data(self, data, passkey, is_binary=False, content_type=None, size=None, username=None):
+        """Encrypt data into the blob store under a fresh per-item data key
+
+        The data key is wrapped with the passkey-derived key and the active
+        keyring master key. Returns the payload fields to store on the item: the
+        blob reference, the KDF parameters, the key ID, the wrapped key and the
+        compression codec, if any. Binary data may be bytes or a readable
+        file-like object (e.g. an uploaded file), which is consumed chunk by
+        chunk instead of being copied whole. content_type and size (the MIME
+        type and length of binary data, when known) guide the choice of codec.
+        Given the owner's username, large data is chunked and deduplicated
+        against the user's other items.
+        """
+        try:
+            if is_binary:
+                if isinstance(data, str) or not (isinstance(data, (bytes, bytearray, memoryview)) or hasattr(data, 'read')):
+                    raise ValueError("Binary data must be bytes or a file-like object")
+                data_to_encrypt = data
+            else:
+                if not isinstance(data, str):
+                    raise ValueError("Text data must be string")
+                data_to_encrypt = data.encode()
+                content_type = "text/plain"
+
+            params = kdf.new_params(self.kdf_log2_n)
+            passkey_key = self.key_cache.get_or_derive(passkey, params)
+            return self.seal_payload(data_to_encrypt, passkey_key, params, content_type, size, username)
+        except Exception as e:
+            metrics.count_error("encrypt")
+            logger.error(f"Encryption error: {str(e)}")
+            return None
+
+    def seal_payload(self, data, passkey_key, params, content_type=None, size=None, username=None):
+        """Compress (if worthwhile) and encrypt bytes or a file-like object into the blob store
+
+        With a username and dedup on, data of at least chunking.MIN_ITEM_SIZE
+        (or of unknown size) is stored as deduplicated chunks instead.
+        """
+        if size is None:
+            size = compression.source_size(data)
+        chunked = (username is not None and self.dedup == "on"
+                   and (size is None or size >= chunking.MIN_ITEM_SIZE))
+        codec = None
+        if self.compression == "auto":
+            sample, data = compression.sample_source(data)
+            codec = compression.choose_codec(content_type, sample, size)
+            if codec and not chunked:
+                data = compression.compressing_reader(data, codec)
+        data_key = os.urandom(32)
+        key_id, wrapped_key = self.keyring.wrap(data_key, passkey_key)
+        if chunked:
+            manifest_id, manifest, count = self.seal_chunks(username, data, codec)
+            try:
+                blob = self.blob_store.put_chunks(stream_crypto.iter_encrypt(data_key, manifest))
+            except BaseException:
+                self.release_chunks(manifest_id)
+                raise
+        else:
+            blob = self.blob_store.put_chunks(stream_crypto.iter_encrypt(data_key, data))
+        metrics.observe_bytes("encrypt", blob["size"])
+        payload = {
+            "blob": blob,
+            "kdf": params,
+            "key_id": key_id,
+            "wrapped_key": wrapped_key
+        }
+        if chunked:
+            payload["chunks"] = {"manifest": manifest_id, "count": count}
+        elif codec:
+            payload["compression"] = codec
+        return payload
+
+    def seal_chunks(self, username, data, codec=None):
+        """Store the chunks of data that the user does not have yet
+
+        Each chunk is compressed with codec (when that helps) and encrypted
+        under a key derived from its content with the user's chunk secret, so
+        an identical chunk always maps to the same stored blob. References are
+        taken in the chunk index before any blob is written. Returns (manifest
+        ID, manifest bytes, chunk count); the manifest lists every chunk with
+        its key and size, and must itself be stored encrypted.
+        """
+        secret = self.keyring.chunk_secret(username)
+        manifest_id = uuid.uuid4().hex
+        entries = []
+        batch = []
+
+        def flush():
+            sizes = [(chunk_id, len(chunk)) for chunk_id, _, chunk in batch]
+            new = self.chunk_index.acquire(username, manifest_id, sizes)
+            for chunk_id, chunk_key, chunk in batch:
+                # A chunk referenced before may still be missing if its first upload crashed
+                if chunk_id in new or not self.blob_store.exists(chunk_id):
+                    packed = chunking.pack_chunk(chunk, codec)
+                    sealed = stream_crypto.encrypt_bytes(chunk_key, packed, len(packed))
+                    ref = self.blob_store.put_named(chunk_id, [sealed])
+                    metrics.observe_bytes("encrypt", ref["size"])
+                    new.discard(chunk_id)
+            batch.clear()
+
+        try:
+            for chunk in chunking.iter_chunks(data):
+                chunk_id, chunk_key = chunking.chunk_ids(secret, chunk)
+                entries.append([chunk_id, base64.b64encode(chunk_key).decode("utf-8"), len(chunk)])
+                batch.append((chunk_id, chunk_key, chunk))
+                if len(batch) >= CHUNK_BATCH_SIZE:
+                    flush()
+            if batch:
+                flush()
+        except BaseException:
+            self.release_chunks(manifest_id)
+            raise
+        return manifest_id, json.dumps({"chunks": entries}).encode("utf-8"), len(entries)
+
+    @metrics.timed("encrypt_batch")
+    def encrypt_files(self, files, passkey, on_progress=None, content_types=None, username=None):
+        """Encrypt several readable files concurrently under one passkey
+
+        The passkey is stretched once for the whole batch (the files share KDF
+        parameters) while every file still gets its own random data key. Files
+        are encrypted on a pool of upload_workers threads; on_progress(done, total)
+        is called on the calling thread as each one finishes. content_types gives
+        each file's MIME type (default: the file's ``type`` attribute, as on
+        uploaded files). username, the owner, enables chunk deduplication as in
+        encrypt_data(). Returns a list of (file, payload) pairs in input order,
+        with payload None for failures.
+        """
+        params = kdf.new_params(self.kdf_log2_n)
+        passkey_key = self.key_cache.get_or_derive(passkey, params)
+        if content_types is None:
+            content_types = [getattr(file, "type", None) for file in files]
+
+        def encrypt_one(file, content_type):
+            file.seek(0)
+            return self.seal_payload(file, passkey_key, params, content_type, username=username)
+
+        payloads = {}
+        with ThreadPoolExecutor(max_workers=max(1, self.upload_workers), thread_name_prefix="upload") as pool:
+            futures = {pool.submit(encrypt_one, file, content_type): index
+                       for index, (file, content_type) in enumerate(zip(files, content_types))}
+            for done, future in enumerate(as_completed(futures), 1):
+                index = futures[future]
+                try:
+                    payloads[index] = future.result()
+                except Exception as e:
+                    metrics.count_error("encrypt")
+                    logger.error(f"Encryption error for {getattr(files[index], 'name', index)}: {str(e)}")
+                    payloads[index] = None
+                if on_progress:
+                    on_progress(done, len(files))
+        return [(file, payloads[index]) for index, file in enumerate(files)]
+
+    @metrics.timed("decrypt")
+    def decrypt_data(self, encrypted_data, passkey, is_binary=False, session_key=None):
+        """Decrypt an item payload (see get_payload) or a legacy inline base64 string
+
+        Blob payloads are read through a memory map, so the ciphertext is paged in
+        as it is decrypted rather than copied onto the heap first.
+        """
+        try:
+            out = io.BytesIO()
+            self.decrypt_into(encrypted_data, passkey, out, session_key)
+            decrypted_data = out.getvalue()
+
+            if is_binary:
+                return decrypted_data
+            else:
+                return decrypted_data.decode()
+        except Exception as e:
+            metrics.count_error("decrypt")
+            logger.error(f"Decryption error: {str(e)}")
+            return None
+
+    @metrics.timed("decrypt")
+    def decrypt_to_file(self, encrypted_data, passkey, size_hint=None, session_key=None):
+        """Decrypt a payload chunk by chunk into a rewound file object
+
+        Plaintexts larger than spool_size go to an unbuffered temporary file on
+        disk, so peak memory stays at one chunk regardless of file size. Returns
+        None if the payload cannot be decrypted. The caller is responsible for
+        closing the returned file.
+        """
+        if size_hint is not None and size_hint <= self.spool_size:
+            out = io.BytesIO()
+        else:
+            out = tempfile.TemporaryFile(buffering=0)
+        try:
+            self.decrypt_into(encrypted_data, passkey, out, session_key)
+            out.seek(0)
+            return out
+        except Exception as e:
+            out.close()
+            metrics.count_error("decrypt")
+            logger.error(f"Decryption error: {str(e)}")
+            return None
+
+    def decrypt_into(self, encrypted_data, passkey, out, session_key=None):
+        """Decrypt a payload chunk by chunk into the writable out, returning the bytes written
+
+        Raises InvalidTag for a wrong passkey; the other decrypt methods wrap
+        this and return None instead.
+        """
+        key = self.payload_key(encrypted_data, passkey, session_key)
+        codec = encrypted_data.get("compression") if isinstance(encrypted_data, dict) else None
+        chunked = isinstance(encrypted_data, dict) and "chunks" in encrypted_data
+        start = out.tell()
+        with self.open_payload(encrypted_data) as payload:
+            if chunked:
+                manifest = io.BytesIO()
+                self.decrypt_payload(payload, key, manifest, session_key)
+            elif codec:
+                sink = compression.DecompressingWriter(out, codec)
+                self.decrypt_payload(payload, key, sink, session_key)
+                sink.close()
+            else:
+                self.decrypt_payload(payload, key, out, session_key)
+        if chunked:
+            self.decrypt_chunks(json.loads(manifest.getvalue()), out)
+        written = out.tell() - start
+        metrics.observe_bytes("decrypt", written)
+        return written
+
+    def decrypt_chunks(self, manifest, out):
+        """Write the chunks listed in a decrypted manifest into out, in order"""
+        for chunk_id, chunk_key, size in manifest["chunks"]:
+            with self.blob_store.map(self.blob_store.ref(chunk_id)) as data:
+                packed = stream_crypto.decrypt_bytes(base64.b64decode(chunk_key), data)
+            out.write(chunking.unpack_chunk(packed, size))
+
+    @staticmethod
+    def decrypt_payload(payload, key, out, session_key=None):
+        """Decrypt raw payload bytes in the streaming format (or a legacy Fernet token) into out"""
+        if stream_crypto.is_stream_payload(payload):
+            stream_crypto.decrypt_stream(key, payload, out)
+        else:
+            # Items stored before the streaming format were Fernet tokens
+            if session_key is None:
+                raise ValueError("Legacy payloads need the session key")
+            out.write(Fernet(session_key).decrypt(bytes(payload)))
+
+    def export_size(self, username):
+        """Return the approximate plaintext size of a user's items, before an export"""
+        return sum(item.get("file_info", {}).get("size") or item.get("blob", {}).get("size", 0)
+                   for item in self.store.list_items(username).values())
+
+    @metrics.timed("export")
+    def export(self, username, passkey, out, on_progress=None, session_key=None):
+        """Decrypt every item of a user into a zip archive written to out
+
+        Items are decrypted on export_workers threads and streamed into the
+        archive one at a time (see vault_export.py). Items the passkey does not
+        open are skipped and listed in the archive's manifest. Returns the manifest.
+        """
+        passkey_hash = hash_passkey(passkey)
+
+        def decrypt_item(label, item):
+            payload = get_payload(item)
+            if "kdf" in item:
+                try:
+                    self.payload_key(payload, passkey)
+                except (InvalidTag, KeyError):
+                    return None
+            elif item.get("passkey") != passkey_hash:
+                return None
+            size_hint = item.get("file_info", {}).get("size") or item.get("blob", {}).get("size")
+            return self.decrypt_to_file(payload, passkey, size_hint=size_hint, session_key=session_key)
+
+        items = self.store.list_items(username).items()
+        return write_archive(out, items, decrypt_item, workers=self.export_workers, on_progress=on_progress)
@@ -0,0 +1,113 @@
+"""Streaming export of many items into one zip archive.
+
+Items are decrypted on a pool of worker threads and each plaintext is copied
+into the archive as soon as it is ready, so the archive is built incrementally
+on disk. Only a bounded window of items is in flight at once, which keeps
+memory flat whether the vault holds ten items or ten thousand.
+
+The archive holds one entry per exported item plus ``manifest.json``, which
+lists every exported entry and the labels that were skipped (for example
+because the passkey given does not open them).
+"""
+import json
+import logging
+import os
+import shutil
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = min(8, os.cpu_count() or 1)
+COPY_BUFFER_SIZE = 1024 * 1024
+MANIFEST_NAME = "manifest.json"
+
+
+def _safe_name(name):
+    """Make a label or file name usable as a single archive path component"""
+    name = name.replace("/", "_").replace("\\", "_").strip()
+    return name if name not in ("", ".", "..") else "_"
+
+
+def entry_name(label, item):
+    """Return the archive path for an item: label/filename for files, label.txt for text"""
+    if item.get("type") == "file":
+        filename = item.get("file_info", {}).get("filename") or "data"
+        return f"{_safe_name(label)}/{_safe_name(filename)}"
+    return f"{_safe_name(label)}.txt"
+
+
+def write_archive(out, items, decrypt_item, workers=DEFAULT_WORKERS, on_progress=None):
+    """Decrypt (label, item) pairs in parallel and stream them into a zip written to out
+
+    decrypt_item(label, item) runs on a worker thread and returns a rewound
+    readable file holding the plaintext, or None to skip the item; the
+    returned file is closed once copied. on_progress(done, total) is called on
+    the calling thread after each item. Returns the manifest dict.
+    """
+    items = list(items)
+    manifest = {"created": time.strftime("%Y-%m-%d %H:%M:%S"), "items": [], "skipped": []}
+    used_names = set()
+    window = max(1, workers) * 2
+
+    with zipfile.ZipFile(out, "w", compression=zipfile.ZIP_STORED, allowZip64=True) as archive, \
+            ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="export") as pool:
+        pending = {}
+        next_index = 0
+        done = 0
+        while next_index < len(items) or pending:
+            # Keep at most `window` items decrypted but not yet written
+            while next_index < len(items) and len(pending) < window:
+                label, item = items[next_index]
+                pending[pool.submit(decrypt_item, label, item)] = (label, item)
+                next_index += 1
+
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                label, item = pending.pop(future)
+                try:
+                    plaintext = future.result()
+                except Exception as e:
+                    logger.error(f"Export error for {label}: {str(e)}")
+                    plaintext = None
+                if plaintext is None:
+                    manifest["skipped"].append(label)
+                else:
+                    with plaintext:
+                        name = _unique_name(entry_name(label, item), used_names)
+                        _copy_into(archive, name, plaintext)
+                    manifest["items"].append({
+                        "label": label,
+                        "name": name,
+                        "type": item.get("type", "text"),
+                        "timestamp": item.get("timestamp"),
+                    })
+                done += 1
+                if on_progress:
+                    on_progress(done, len(items))
+
+        archive.writestr(MANIFEST_NAME, json.dumps(manifest, indent=2))
+    logger.info(f"Exported {len(manifest['items'])} items ({len(manifest['skipped'])} skipped)")
+    return manifest
+
+
+def _unique_name(name, used_names):
+    candidate, suffix = name, 2
+    while candidate in used_names or candidate == MANIFEST_NAME:
+        root, ext = os.path.splitext(name)
+        candidate = f"{root} ({suffix}){ext}"
+        suffix += 1
+    used_names.add(candidate)
+    return candidate
+
+
+def _copy_into(archive, name, src):
+    """Copy a readable file into a new archive entry without loading it whole"""
+    src.seek(0, os.SEEK_END)
+    size = src.tell()
+    src.seek(0)
+    info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+    info.file_size = size
+    with archive.open(info, "w", force_zip64=size >= zipfile.ZIP64_LIMIT) as dst:
+        shutil.copyfileobj(src, dst, COPY_BUFFER_SIZE)
@@ -1,15 +1,19 @@
 import streamlit as st
-import hashlib
 from cryptography.fernet import Fernet
 import time
-import json
 import os
-import base64
-import io
+import math
+import tempfile
 from PIL import Image
 import numpy as np
 import logging
-from datetime import datetime
+
+# Start of this script run, for the rerun timing recorded at the bottom
+SCRIPT_START = time.perf_counter()
+
+# Crypto, storage and accounts live in the headless secure_data package
+from secure_data import LoginLimiter, Vault, VerifierBusy, auth, config, describe_payload, get_payload, metrics
+from secure_data.journal_store import JournalLockedError
 
 # Configure logging
 logging.basicConfig(
@@ -18,11 +22,28 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# App configuration and environment variables
-DATA_FILE = os.getenv('SECURE_APP_DATA_FILE', 'encrypted_data.json')
-MAX_FILE_SIZE = int(os.getenv('SECURE_APP_MAX_FILE_SIZE', 200 * 1024 * 1024))  # 200MB default
+# App configuration and environment variables (storage and crypto settings: secure_data/config.py)
+ADMIN_USERS = set(os.getenv('SECURE_APP_ADMIN_USERS', 'admin').split(','))
+MAX_FILE_SIZE = config.MAX_FILE_SIZE
+EXPORT_MAX_SIZE = config.EXPORT_MAX_SIZE
 SESSION_TIMEOUT = int(os.getenv('SECURE_APP_SESSION_TIMEOUT', 30 * 60))  # 30 minutes default
-LOCKOUT_DURATION = int(os.getenv('SECURE_APP_LOCKOUT_DURATION', 30))  # 30 seconds default
+LOCKOUT_DURATION = config.LOCKOUT_DURATION
+PREVIEW_MAX_SIZE = 10 * 1024 * 1024  # largest decrypted image shown inline
+TEXT_PREVIEW_SIZE = 10000  # bytes of decrypted text shown inline
+PAGE_SIZE = int(os.getenv('SECURE_APP_PAGE_SIZE', 24))  # items listed per page
+PAGE_SIZE_OPTIONS = sorted({12, 24, 48, 96, PAGE_SIZE})
+SORT_OPTIONS = {  # label -> (sort key, descending); None keeps the stored order
+    "Stored order": None,
+    "Newest first": ("timestamp", True),
+    "Oldest first": ("timestamp", False),
+    "Label A-Z": ("label", False),
+    "Label Z-A": ("label", True),
+    "Largest first": ("size", True),
+    "Smallest first": ("size", False),
+}
+METRICS_PORT = int(os.getenv('SECURE_APP_METRICS_PORT', 0))  # Prometheus endpoint on localhost; 0 disables
+METRICS_FILE = os.getenv('SECURE_APP_METRICS_FILE', '')  # metrics file rewritten periodically; empty disables
+METRICS_FLUSH_INTERVAL = int(os.getenv('SECURE_APP_METRICS_FLUSH_INTERVAL', metrics.DEFAULT_FLUSH_INTERVAL))  # seconds
 
 # App configuration and styling
 st.set_page_config(
@@ -388,15 +409,10 @@ def initialize_session_state():
             st.session_state.authenticated = False
             st.session_state.username = ""
             st.session_state.stored_data = {}
-            st.session_state.failed_attempts = 0
-            st.session_state.lockout_time = 0
             st.session_state.last_activity = time.time()
             st.session_state.key = Fernet.generate_key()
             st.session_state.cipher = Fernet(st.session_state.key)
-            st.session_state.user_accounts = {
-                "admin": hashlib.sha256("admin123".encode()).hexdigest(),
-                "user1": hashlib.sha256("password1".encode()).hexdigest()
-            }
+            st.session_state.user_accounts = auth.default_accounts()
             st.session_state.init_complete = True
             logger.info("Session state initialized successfully")
     except Exception as e:
@@ -417,65 +433,121 @@ def check_session_timeout():
             st.rerun()
         st.session_state.last_activity = current_time
 
-# Update save_data function with better error handling and backup
-def save_data():
-    try:
-        # Create backup with timestamp
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        backup_file = f"{DATA_FILE}.{timestamp}.backup"
-        
-        if os.path.exists(DATA_FILE):
-            os.replace(DATA_FILE, backup_file)
-            logger.info(f"Created backup: {backup_file}")
-        
-        # Save new data
-        with open(DATA_FILE, "w") as f:
-            json.dump(st.session_state.stored_data, f, indent=2)
-        logger.info("Data saved successfully")
-        
-        # Keep only last 5 backups
-        backups = sorted([f for f in os.listdir() if f.startswith(DATA_FILE) and f.endswith('.backup')])
-        for old_backup in backups[:-5]:
-            os.remove(old_backup)
-            logger.info(f"Removed old backup: {old_backup}")
-            
-    except Exception as e:
-        logger.error(f"Error saving data: {str(e)}")
-        # Restore from backup if available
-        if os.path.exists(backup_file):
-            os.replace(backup_file, DATA_FILE)
-            logger.info("Restored from backup after save error")
-        raise
+# Persistence: one vault (store, blobs and keys) shared by all sessions
+@st.cache_resource
+def get_vault():
+    """Return the process-wide vault, resuming an interrupted key rotation and releasing orphaned chunks"""
+    vault = Vault()
+    vault.resume_rotation()
+    vault.collect_chunks()
+    return vault
 
-# Update load_data function with better error handling
 def load_data():
+    """Attach this session's read-through view of the shared store"""
     try:
-        if os.path.exists(DATA_FILE):
-            with open(DATA_FILE, "r") as f:
-                data = json.load(f)
-                st.session_state.stored_data = data
-                logger.info("Data loaded successfully")
-        else:
-            logger.info("No existing data file found")
-    except json.JSONDecodeError as e:
-        logger.error(f"Error decoding data file: {str(e)}")
-        st.error("Error loading data: Corrupted data file")
-        # Try to restore from latest backup
-        backups = sorted([f for f in os.listdir() if f.startswith(DATA_FILE) and f.endswith('.backup')], reverse=True)
-        if backups:
-            try:
-                with open(backups[0], "r") as f:
-                    data = json.load(f)
-                    st.session_state.stored_data = data
-                    logger.info(f"Restored data from backup: {backups[0]}")
-                    st.success("✅ Data restored from backup")
-            except Exception as backup_error:
-                logger.error(f"Error restoring from backup: {str(backup_error)}")
-                st.error("Unable to restore data from backup")
+        st.session_state.stored_data = get_vault().load_data()
+    except JournalLockedError:
+        # Reported once by main(), which stops the run
+        pass
     except Exception as e:
+        metrics.count_error("load")
         logger.error(f"Error loading data: {str(e)}")
         st.error(f"Error loading data: {str(e)}")
 
+def upload_labels(file_label, files):
+    """Return one unique label per uploaded file
+
+    A single file takes the label as given; in a multi-file upload the label
+    (if any) prefixes each file name.
+    """
+    if len(files) == 1 and file_label:
+        return [file_label]
+    labels = []
+    for file in files:
+        label = f"{file_label} - {file.name}" if file_label else file.name
+        candidate, suffix = label, 2
+        while candidate in labels:
+            candidate = f"{label} ({suffix})"
+            suffix += 1
+        labels.append(candidate)
+    return labels
+
+# Search, filter and sort controls for item listings, answered from the per-user index
+def search_controls(username, key):
+    """Render the search controls and return the chosen criteria for Vault.list_page()"""
+    def first_page():
+        st.session_state[f"{key}_page"] = 0
+
+    criteria = {}
+    with st.expander("🔎 Search, filter and sort"):
+        col1, col2 = st.columns([3, 1])
+        with col1:
+            text = st.text_input("Search labels", key=f"{key}_search", on_change=first_page)
+        with col2:
+            match = st.selectbox("Match", ["contains", "starts with"], key=f"{key}_match", on_change=first_page)
+        if text:
+            criteria["contains" if match == "contains" else "prefix"] = text
+
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            item_type = st.selectbox("Type", ["All", "text", "file"], key=f"{key}_type", on_change=first_page)
+        with col2:
+            mime_types = ["All"] + get_vault().store.index(username).mime_types()
+            mime_type = st.selectbox("File type", mime_types, key=f"{key}_mime", on_change=first_page)
+        with col3:
+            sort = st.selectbox("Sort by", list(SORT_OPTIONS), key=f"{key}_sort", on_change=first_page)
+        if item_type != "All":
+            criteria["item_type"] = item_type
+        if mime_type != "All":
+            criteria["mime_type"] = mime_type
+
+        col1, col2 = st.columns(2)
+        with col1:
+            since = st.date_input("Created from", value=None, key=f"{key}_since", on_change=first_page)
+        with col2:
+            until = st.date_input("Created until", value=None, key=f"{key}_until", on_change=first_page)
+        if since:
+            criteria["since"] = since.strftime("%Y-%m-%d")
+        if until:
+            criteria["until"] = until.strftime("%Y-%m-%d")
+
+    if SORT_OPTIONS[sort] is not None:
+        criteria["sort"], criteria["descending"] = SORT_OPTIONS[sort]
+    elif criteria:
+        # Filtered results come from the index, which orders stored items by time
+        criteria["sort"] = "timestamp"
+    return criteria
+
+# Page controls for item listings; only the items on the current page are rendered
+def paginate(username, key, criteria=None):
+    """Render page controls and return the (label, item) pairs on the current page"""
+    page_size = st.session_state.get("page_size", PAGE_SIZE)
+    page_key = f"{key}_page"
+    entries, total, page = get_vault().list_page(username, st.session_state.get(page_key, 0), page_size,
+                                                 **(criteria or {}))
+    st.session_state[page_key] = page
+    pages = max(1, -(-total // page_size))
+
+    def go_to(target):
+        st.session_state[page_key] = target
+
+    col1, col2, col3, col4 = st.columns([1, 2, 1, 1])
+    with col1:
+        st.button("◀ PREV", key=f"{key}_prev", disabled=page == 0, on_click=go_to, args=(page - 1,),
+                  use_container_width=True)
+    with col2:
+        first = page * page_size + 1 if total else 0
+        st.markdown(f"Items {first}–{page * page_size + len(entries)} of {total} (page {page + 1} of {pages})")
+    with col3:
+        st.button("NEXT ▶", key=f"{key}_next", disabled=page >= pages - 1, on_click=go_to, args=(page + 1,),
+                  use_container_width=True)
+    with col4:
+        st.selectbox("Per page", PAGE_SIZE_OPTIONS, index=PAGE_SIZE_OPTIONS.index(page_size), key="page_size",
+                     label_visibility="collapsed")
+    if not entries:
+        st.markdown('<div class="info-box">No items match the search.</div>', unsafe_allow_html=True)
+    return entries
+
 # Add file size check
 def validate_file_size(file):
     if file.size > MAX_FILE_SIZE:
@@ -488,10 +560,6 @@ def display_store_data():
     st.markdown('<div class="panel">', unsafe_allow_html=True)
     st.markdown('<h2 class="subheader">📂 Store Data Securely</h2>', unsafe_allow_html=True)
     
-    # Initialize user data storage
-    if st.session_state.username not in st.session_state.stored_data:
-        st.session_state.stored_data[st.session_state.username] = {}
-    
     # Create tabs for different data types
     tab1, tab2 = st.tabs(["📝 Text Data", "📁 File Data"])
     
@@ -553,12 +621,13 @@ def display_store_data():
         with col1:
             file_name = st.text_input("💼 File Label", 
                                     placeholder="Enter a name for your file",
-                                    help="This label will help you identify your file later",
+                                    help="This label will help you identify your file later; with several files it prefixes each file name",
                                     key="file_label")
             
-            uploaded_file = st.file_uploader("📁 Upload File", 
-                                           help="Select a file to encrypt",
-                                           key="file_upload")
+            uploaded_files = st.file_uploader("📁 Upload Files", 
+                                            help="Select one or more files to encrypt",
+                                            accept_multiple_files=True,
+                                            key="file_upload")
             
             file_passkey = st.text_input("🔑 Encryption Key", 
                                         type="password",
@@ -573,25 +642,37 @@ def display_store_data():
                                                key="file_confirm")
         
         with col2:
-            st.markdown("""
+            st.markdown(f"""
             <div class="info-box" style="margin-top: 3.7rem;">
                 <h4 style="color: #4FB0FF; margin-bottom: 1rem;">📁 File Guidelines</h4>
                 <ul style="font-size: 0.9rem;">
                     <li>Supported file types: All</li>
-                    <li>Max file size: 200MB</li>
+                    <li>Max file size: {MAX_FILE_SIZE/1024/1024:.0f}MB</li>
+                    <li>Several files can be uploaded at once</li>
                     <li>Use unique passkeys</li>
                     <li>Keep original files safe</li>
                 </ul>
             </div>
             """, unsafe_allow_html=True)
         
+        if uploaded_files:
+            for uploaded_file in uploaded_files:
+                is_valid, error_message = validate_file_size(uploaded_file)
+                if not is_valid:
+                    st.error(f"{uploaded_file.name}: {error_message}")
+                    return
+        
         # File preview area with debug info
-        if uploaded_file is not None:
-            is_valid, error_message = validate_file_size(uploaded_file)
-            if not is_valid:
-                st.error(error_message)
-                return
-            
+        if uploaded_files and len(uploaded_files) > 1:
+            st.markdown(f"#### 📄 {len(uploaded_files)} Files Selected")
+            st.write(f"Total Size: {sum(f.size for f in uploaded_files)/1024:.2f} KB")
+            st.dataframe([{
+                "File Name": f.name,
+                "File Type": f.type if f.type else 'application/octet-stream',
+                "Size (KB)": round(f.size / 1024, 2)
+            } for f in uploaded_files], use_container_width=True, hide_index=True)
+        elif uploaded_files:
+            uploaded_file = uploaded_files[0]
             try:
                 file_type = uploaded_file.type if uploaded_file.type else 'application/octet-stream'
                 file_size = uploaded_file.size
@@ -628,64 +709,55 @@ def display_store_data():
         # Handle file data saving with improved error handling
         if save_file_btn:
             try:
-                if not file_name:
-                    st.error("⚠️ Please provide a file label!")
-                elif not uploaded_file:
+                if not uploaded_files:
                     st.error("⚠️ Please upload a file!")
+                elif len(uploaded_files) == 1 and not file_name:
+                    st.error("⚠️ Please provide a file label!")
                 elif not file_passkey:
                     st.error("⚠️ Please enter a passkey!")
                 elif file_passkey != confirm_file_passkey:
                     st.error("⚠️ Passkeys do not match!")
                 else:
-                    # Debug progress
-                    st.info("🔄 Processing file...")
+                    # Encrypt every file on the worker pool, tracking progress in one bar
+                    progress = st.progress(0.0, text=f"🔒 Encrypting {len(uploaded_files)} file(s)...")
+                    def show_progress(done, total):
+                        progress.progress(done / total, text=f"🔒 Encrypted {done} of {total} file(s)")
+                    results = get_vault().encrypt_files(uploaded_files, file_passkey, on_progress=show_progress,
+                                                             username=st.session_state.username)
                     
-                    # Read file data
-                    file_data = uploaded_file.getvalue()
-                    st.info(f"📦 Read {len(file_data)} bytes from file")
-                    
-                    file_info = {
-                        "filename": uploaded_file.name,
-                        "type": uploaded_file.type if uploaded_file.type else 'application/octet-stream',
-                        "size": uploaded_file.size
-                    }
+                    timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
+                    entries = []
+                    failed = []
+                    for label, (uploaded_file, encrypted_file) in zip(upload_labels(file_name, uploaded_files), results):
+                        if encrypted_file is None:
+                            failed.append(uploaded_file.name)
+                            continue
+                        entries.append((st.session_state.username, label, {
+                            **encrypted_file,
+                            "timestamp": timestamp,
+                            "type": "file",
+                            "file_info": {
+                                "filename": uploaded_file.name,
+                                "type": uploaded_file.type if uploaded_file.type else 'application/octet-stream',
+                                "size": uploaded_file.size
+                            }
+                        }))
                     
-                    # Encrypt file data
-                    st.info("🔒 Encrypting file data...")
-                    hashed_passkey = hash_passkey(file_passkey)
-                    encrypted_file = encrypt_data(file_data, file_passkey, is_binary=True)
+                    # Store every encrypted file in one batched write
+                    if entries:
+                        get_vault().save_items(entries)
+                    progress.empty()
                     
-                    if encrypted_file:
-                        # Store encrypted file data
-                        if st.session_state.username not in st.session_state.stored_data:
-                            st.session_state.stored_data[st.session_state.username] = {}
-                        
-                        st.session_state.stored_data[st.session_state.username][file_name] = {
-                            "encrypted_text": encrypted_file,
-                            "passkey": hashed_passkey,
-                            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
-                            "type": "file",
-                            "file_info": file_info
-                        }
-                        
-                        # Save to file
-                        st.info("💾 Saving encrypted data...")
-                        save_data()
-                        st.success("✅ File encrypted and stored successfully!")
-                        
-                        # Debug information
-                        st.write("File Details:")
-                        st.json({
-                            "label": file_name,
-                            "original_size": file_info["size"],
-                            "encrypted_size": len(encrypted_file),
-                            "type": file_info["type"]
-                        })
-                        
-                        time.sleep(1)
-                        st.rerun()
-                    else:
-                        st.error("❌ Encryption failed! Please try again.")
+                    if failed:
+                        st.error(f"❌ Encryption failed for: {', '.join(failed)}. Please try again.")
+                    if entries:
+                        st.success(f"✅ {len(entries)} file(s) encrypted and stored successfully!")
+                        st.json([{
+                            "label": label,
+                            "original_size": item["file_info"]["size"],
+                            "encrypted_size": item["blob"]["size"],
+                            "type": item["file_info"]["type"]
+                        } for _, label, item in entries])
             except Exception as e:
                 st.error(f"❌ Error storing file: {str(e)}")
                 st.error("Detailed error information:")
@@ -697,6 +769,16 @@ def display_store_data():
 def main():
     check_session_timeout()
     
+    # Resume a key rotation interrupted by a restart
+    try:
+        get_vault()
+    except JournalLockedError as e:
+        # The CLI or API has the journal open; nothing can be read or saved until it stops
+        logger.error(f"Error opening the store: {str(e)}")
+        st.error(f"Cannot open the store: {str(e)}")
+        st.stop()
+    get_metrics_exporter()
+    
     # Add version information
     st.sidebar.markdown("---")
     st.sidebar.markdown("### System Information")
@@ -705,11 +787,11 @@ def main():
     
     st.markdown('<h1 class="main-header">Secure Data Encryption System</h1>', unsafe_allow_html=True)
     
-    # Check if user is locked out
-    current_time = time.time()
-    if st.session_state.lockout_time > current_time:
-        st.markdown(f'<div class="error-msg">🔒 Account locked. Try again in {int(st.session_state.lockout_time - current_time)} seconds.</div>', unsafe_allow_html=True)
-        st.session_state.authenticated = False
+    # Check if this client is locked out
+    if not st.session_state.authenticated:
+        retry_after = get_login_limiter().retry_after(client=client_address())
+        if retry_after:
+            st.markdown(f'<div class="error-msg">🔒 Too many failed attempts. Try again in {math.ceil(retry_after)} seconds.</div>', unsafe_allow_html=True)
     
     # Show login form if not authenticated
     if not st.session_state.authenticated:
@@ -725,6 +807,10 @@ def main():
             logout()
             st.rerun()
         
+        if st.session_state.username in ADMIN_USERS:
+            display_key_management()
+            display_metrics()
+        
         if choice == "Home":
             display_home()
         elif choice == "Store Data":
@@ -736,6 +822,45 @@ def main():
         elif choice == "Change Password":
             display_login()
 
+# Key management panel (admins only)
+def display_key_management():
+    keyring = get_vault().keyring
+    job = get_vault().rotation_job
+    status = job.status()
+    
+    with st.sidebar.expander("🔑 Key Management"):
+        st.text(f"Active key: {keyring.active_id}")
+        st.text(f"Keys in keyring: {len(keyring.key_ids())}")
+        
+        if status["running"]:
+            st.info(f"🔄 Rotation in progress: {status['rotated']} items re-sealed")
+        elif status["error"]:
+            st.error(f"❌ Rotation failed: {status['error']}")
+        elif status["pending"]:
+            st.warning("⚠️ A key rotation has not finished")
+            if st.button("▶️ RESUME ROTATION", use_container_width=True, key="resume_rotation"):
+                job.start()
+                st.rerun()
+        
+        if st.button("🔄 ROTATE MASTER KEY", use_container_width=True, key="rotate_key", disabled=status["running"]):
+            keyring.rotate()
+            job.start()
+            st.rerun()
+
+# Metrics panel (admins only)
+def display_metrics():
+    with st.sidebar.expander("📈 Metrics"):
+        exporter = get_metrics_exporter()
+        if exporter:
+            st.caption(f"Exported to {exporter}")
+        rows = metrics.REGISTRY.summary()
+        if rows:
+            st.dataframe(rows, use_container_width=True, hide_index=True)
+        else:
+            st.info("No operations recorded yet")
+        if st.button("🔄 REFRESH", use_container_width=True, key="refresh_metrics"):
+            st.rerun()
+
 # Login page
 def display_login():
     # Show logout button if authenticated
@@ -777,17 +902,22 @@ def display_login():
                 st.markdown('<div style="text-align: right;"><a href="#" style="color: #4FB0FF; text-decoration: none; font-size: 0.9rem;">Forgot Password?</a></div>', unsafe_allow_html=True)
             
             if st.button("LOGIN", use_container_width=True, key="login_button"):
-                if authenticate(username, password):
-                    st.markdown('<div class="success-msg">✅ Login successful!</div>', unsafe_allow_html=True)
-                    time.sleep(1)
-                    st.rerun()
+                try:
+                    logged_in = authenticate(username, password)
+                except auth.LoginRateLimited as e:
+                    st.markdown(f'<div class="error-msg">🔒 Too many failed attempts! Try again in {math.ceil(e.retry_after)} seconds.</div>', unsafe_allow_html=True)
+                except VerifierBusy:
+                    st.markdown('<div class="error-msg">⏳ The server is busy checking logins. Please try again in a moment.</div>', unsafe_allow_html=True)
                 else:
-                    st.session_state.failed_attempts += 1
-                    if st.session_state.failed_attempts >= 3:
-                        st.session_state.lockout_time = time.time() + 30
-                        st.markdown('<div class="error-msg">🔒 Too many failed attempts! Account locked for 30 seconds.</div>', unsafe_allow_html=True)
+                    if logged_in:
+                        st.markdown('<div class="success-msg">✅ Login successful!</div>', unsafe_allow_html=True)
+                        time.sleep(1)
+                        st.rerun()
+                    remaining = get_login_limiter().remaining(username, client_address())
+                    if remaining:
+                        st.markdown(f'<div class="error-msg">❌ Invalid credentials! Attempts remaining: {remaining}</div>', unsafe_allow_html=True)
                     else:
-                        st.markdown(f'<div class="error-msg">❌ Invalid credentials! Attempts remaining: {3 - st.session_state.failed_attempts}</div>', unsafe_allow_html=True)
+                        st.markdown(f'<div class="error-msg">🔒 Too many failed attempts! Locked for {LOCKOUT_DURATION} seconds.</div>', unsafe_allow_html=True)
             
             st.markdown('<div class="divider"></div>', unsafe_allow_html=True)
             
@@ -816,13 +946,20 @@ def display_login():
                     st.markdown('<div class="error-msg">⚠️ All fields are required!</div>', unsafe_allow_html=True)
                 elif new_password != confirm_new_password:
                     st.markdown('<div class="error-msg">⚠️ New passwords do not match!</div>', unsafe_allow_html=True)
-                elif change_password(st.session_state.username, old_password, new_password):
-                    st.markdown('<div class="success-msg">✅ Password updated successfully!</div>', unsafe_allow_html=True)
-                    time.sleep(1)
-                    logout()
-                    st.rerun()
                 else:
-                    st.markdown('<div class="error-msg">❌ Current password is incorrect!</div>', unsafe_allow_html=True)
+                    try:
+                        changed = change_password(st.session_state.username, old_password, new_password)
+                    except auth.LoginRateLimited as e:
+                        st.markdown(f'<div class="error-msg">🔒 Too many failed attempts! Try again in {math.ceil(e.retry_after)} seconds.</div>', unsafe_allow_html=True)
+                    except VerifierBusy:
+                        st.markdown('<div class="error-msg">⏳ The server is busy checking logins. Please try again in a moment.</div>', unsafe_allow_html=True)
+                    else:
+                        if changed:
+                            st.markdown('<div class="success-msg">✅ Password updated successfully!</div>', unsafe_allow_html=True)
+                            time.sleep(1)
+                            logout()
+                            st.rerun()
+                        st.markdown('<div class="error-msg">❌ Current password is incorrect!</div>', unsafe_allow_html=True)
             
             st.markdown('</div>', unsafe_allow_html=True)
         
@@ -852,8 +989,8 @@ def display_home():
     <div class="info-box">
     <h3>Security Features:</h3>
     <ul>
-        <li>Data is encrypted using Fernet symmetric encryption</li>
-        <li>Passkeys are hashed using SHA-256</li>
+        <li>Data is encrypted with AES-256-GCM in individually authenticated chunks</li>
+        <li>Passkeys are stretched with salted scrypt key derivation</li>
         <li>Built-in protection against brute force attacks</li>
         <li>Data is stored persistently but securely</li>
     </ul>
@@ -872,7 +1009,7 @@ def display_retrieve_data():
         # Show list of stored data
         st.markdown('<div class="info-box">Select data to decrypt:</div>', unsafe_allow_html=True)
         
-        for data_name, data_info in st.session_state.stored_data[username].items():
+        for data_name, data_info in paginate(username, "retrieve", search_controls(username, "retrieve")):
             with st.expander(f"{'📄' if data_info['type'] == 'text' else '📁'} {data_name} - {data_info['type'].upper()}"):
                 # Show data info
                 st.markdown(f"""
@@ -895,14 +1032,19 @@ def display_retrieve_data():
                 col1, col2 = st.columns([1, 1])
                 with col1:
                     if st.button("🔓 DECRYPT", key=f"btn_decrypt_{data_name}", use_container_width=True):
-                        if hash_passkey(decrypt_passkey) == data_info["passkey"]:
+                        if get_vault().verify_passkey(data_info, decrypt_passkey):
                             try:
-                                # Decrypt data
-                                decrypted_data = decrypt_data(
-                                    data_info["encrypted_text"],
-                                    decrypt_passkey,
-                                    is_binary=(data_info['type'] == 'file')
-                                )
+                                # Decrypt data; files are streamed to a temporary file
+                                if data_info['type'] == 'file':
+                                    decrypted_data = get_vault().decrypt_to_file(
+                                        get_payload(data_info),
+                                        decrypt_passkey,
+                                        size_hint=data_info['file_info']['size'],
+                                        session_key=st.session_state.key
+                                    )
+                                else:
+                                    decrypted_data = get_vault().decrypt_data(get_payload(data_info), decrypt_passkey,
+                                                                              session_key=st.session_state.key)
                                 
                                 if decrypted_data:
                                     st.markdown('<div class="success-msg">✅ Decryption successful!</div>', unsafe_allow_html=True)
@@ -920,11 +1062,15 @@ def display_retrieve_data():
                                             mime=file_info['type']
                                         )
                                         
-                                        # Preview for supported file types
-                                        if file_info['type'].startswith('image'):
-                                            st.image(decrypted_data, caption="Decrypted Image")
+                                        # Preview for supported file types, reading only what is shown
+                                        if file_info['type'].startswith('image') and file_info['size'] <= PREVIEW_MAX_SIZE:
+                                            decrypted_data.seek(0)
+                                            st.image(decrypted_data.read(), caption="Decrypted Image")
                                         elif file_info['type'].startswith('text'):
-                                            st.text_area("Decrypted Content", decrypted_data.decode(), height=100)
+                                            decrypted_data.seek(0)
+                                            content = decrypted_data.read(TEXT_PREVIEW_SIZE).decode('utf-8', errors='replace')
+                                            st.text_area("Decrypted Content", content + ('...' if file_info['size'] > TEXT_PREVIEW_SIZE else ''), height=100)
+                                        decrypted_data.close()
                             except Exception as e:
                                 st.markdown(f'<div class="error-msg">⚠️ Decryption failed: {str(e)}</div>', unsafe_allow_html=True)
                         else:
@@ -954,41 +1100,45 @@ def display_my_data():
         </div>
         """, unsafe_allow_html=True)
     else:
+        display_export(username)
+        stats = get_vault().dedup_stats(username)
+        if stats["referenced_bytes"] > stats["unique_bytes"]:
+            st.caption(f"♻️ Deduplication: {stats['referenced_bytes']/1024/1024:.1f} MB of file chunks "
+                       f"stored as {stats['unique_bytes']/1024/1024:.1f} MB")
+        entries = paginate(username, "my_data", search_controls(username, "my_data"))
+        
         # Create tabs for different views
         tab1, tab2 = st.tabs(["📊 Grid View", "📑 List View"])
         
         with tab1:
-            # Create a grid of cards for data items
-            for i in range(0, len(st.session_state.stored_data[username]), 3):
+            # Create a grid of cards for the items on this page
+            for i in range(0, len(entries), 3):
                 cols = st.columns(3)
-                for j in range(3):
-                    if i + j < len(st.session_state.stored_data[username]):
-                        data_name = list(st.session_state.stored_data[username].keys())[i + j]
-                        data_info = st.session_state.stored_data[username][data_name]
+                for j, (data_name, data_info) in enumerate(entries[i:i + 3]):
+                    with cols[j]:
+                        st.markdown(f"""
+                        <div style="padding: 1rem; background-color: rgba(13, 25, 42, 0.7); border-radius: 8px; border: 1px solid rgba(79, 176, 255, 0.3); margin-bottom: 1rem;">
+                            <h4 style="color: #4FB0FF; margin-bottom: 0.5rem;">{data_name}</h4>
+                            <p style="font-size: 0.8rem; color: #aaa;">Created: {data_info.get('timestamp', 'Unknown')}</p>
+                        </div>
+                        """, unsafe_allow_html=True)
                         
-                        with cols[j]:
-                            st.markdown(f"""
-                            <div style="padding: 1rem; background-color: rgba(13, 25, 42, 0.7); border-radius: 8px; border: 1px solid rgba(79, 176, 255, 0.3); margin-bottom: 1rem;">
-                                <h4 style="color: #4FB0FF; margin-bottom: 0.5rem;">{data_name}</h4>
-                                <p style="font-size: 0.8rem; color: #aaa;">Created: {data_info.get('timestamp', 'Unknown')}</p>
-                            </div>
-                            """, unsafe_allow_html=True)
-                            
-                            # Add buttons for each card
-                            col1, col2 = st.columns(2)
-                            with col1:
-                                if st.button("🔓 VIEW", key=f"view_{data_name}", use_container_width=True):
-                                    st.session_state.selected_data = data_name
-                                    st.session_state.view_mode = True
-                            with col2:
-                                if st.button("🗑️ DELETE", key=f"delete_{data_name}", use_container_width=True):
-                                    st.session_state.selected_data = data_name
-                                    st.session_state.delete_mode = True
+                        # Add buttons for each card
+                        col1, col2 = st.columns(2)
+                        with col1:
+                            if st.button("🔓 VIEW", key=f"view_{data_name}", use_container_width=True):
+                                st.session_state.selected_data = data_name
+                                st.session_state.view_mode = True
+                        with col2:
+                            if st.button("🗑️ DELETE", key=f"delete_{data_name}", use_container_width=True):
+                                st.session_state.selected_data = data_name
+                                st.session_state.delete_mode = True
         
         with tab2:
-            for data_name, data_info in st.session_state.stored_data[username].items():
+            for data_name, data_info in entries:
                 with st.expander(f"📄 {data_name} - Created: {data_info.get('timestamp', 'Unknown date')}"):
-                    st.text_area("🔒 Encrypted Data", data_info["encrypted_text"], height=100, disabled=True)
+                    st.markdown("🔒 **Encrypted Data**")
+                    st.code(describe_payload(data_info), language=None)
                     
                     col1, col2, col3 = st.columns([2, 1, 1])
                     
@@ -999,9 +1149,9 @@ def display_my_data():
                     
                     with col2:
                         if st.button("🔓 DECRYPT", key=f"btn_decrypt_{data_name}", use_container_width=True):
-                            if hash_passkey(decrypt_passkey) == data_info["passkey"]:
+                            if get_vault().verify_passkey(data_info, decrypt_passkey):
                                 try:
-                                    decrypted = decrypt_data(data_info["encrypted_text"], decrypt_passkey)
+                                    decrypted = get_vault().decrypt_data(get_payload(data_info), decrypt_passkey, session_key=st.session_state.key)
                                     st.markdown('<div class="success-msg">✅ Decryption successful!</div>', unsafe_allow_html=True)
                                     st.code(decrypted)
                                 except:
@@ -1010,8 +1160,7 @@ def display_my_data():
                     with col3:
                         if st.button("🗑️ DELETE", key=f"btn_delete_{data_name}", use_container_width=True):
                             if data_name in st.session_state.stored_data[username]:
-                                del st.session_state.stored_data[username][data_name]
-                                save_data()
+                                get_vault().delete_item(username, data_name)
                                 st.markdown('<div class="success-msg">✅ Data deleted successfully!</div>', unsafe_allow_html=True)
                                 st.rerun()
     
@@ -1026,16 +1175,17 @@ def display_my_data():
         """, unsafe_allow_html=True)
         
         st.markdown(f"### 🔍 Viewing: {data_name}")
-        st.text_area("Encrypted Data", data_info["encrypted_text"], height=100, disabled=True)
+        st.markdown("**Encrypted Data**")
+        st.code(describe_payload(data_info), language=None)
         
         decrypt_passkey = st.text_input("Enter passkey to decrypt", type="password", key="modal_decrypt")
         
         col1, col2 = st.columns(2)
         with col1:
             if st.button("🔓 DECRYPT", use_container_width=True):
-                if hash_passkey(decrypt_passkey) == data_info["passkey"]:
+                if get_vault().verify_passkey(data_info, decrypt_passkey):
                     try:
-                        decrypted = decrypt_data(data_info["encrypted_text"], decrypt_passkey)
+                        decrypted = get_vault().decrypt_data(get_payload(data_info), decrypt_passkey, session_key=st.session_state.key)
                         st.markdown('<div class="success-msg">✅ Decryption successful!</div>', unsafe_allow_html=True)
                         st.code(decrypted)
                     except:
@@ -1065,8 +1215,7 @@ def display_my_data():
         col1, col2 = st.columns(2)
         with col1:
             if st.button("🗑️ DELETE", use_container_width=True, type="primary"):
-                del st.session_state.stored_data[username][data_name]
-                save_data()
+                get_vault().delete_item(username, data_name)
                 del st.session_state.delete_mode
                 del st.session_state.selected_data
                 st.markdown('<div class="success-msg">✅ Data deleted successfully!</div>', unsafe_allow_html=True)
@@ -1082,61 +1231,81 @@ def display_my_data():
     
     st.markdown('</div>', unsafe_allow_html=True)
 
+# Bulk export of all of a user's items
+def display_export(username):
+    with st.expander("📦 Export All Data"):
+        st.markdown("Decrypt every item the passkey opens into a single zip archive.")
+        export_passkey = st.text_input("🔑 Passkey", type="password", key="export_passkey")
+        if st.button("📦 EXPORT", use_container_width=True, key="export_btn"):
+            if not export_passkey:
+                st.error("⚠️ Please enter a passkey!")
+                return
+            # Streamlit keeps a download in memory until the session ends, so archives are capped
+            too_large = (f"Use `python -m secure_data.cli decrypt` for more than "
+                         f"{EXPORT_MAX_SIZE/1024/1024:.0f}MB (SECURE_APP_EXPORT_MAX_SIZE)")
+            if get_vault().export_size(username) > EXPORT_MAX_SIZE:
+                st.error(f"❌ Your items are too large to export here. {too_large}.")
+                return
+            progress = st.progress(0.0, text="🔓 Decrypting items...")
+            def show_progress(done, total):
+                progress.progress(done / total, text=f"🔓 Exported {done} of {total} item(s)")
+            with tempfile.TemporaryFile(buffering=0) as archive:
+                try:
+                    manifest = get_vault().export(username, export_passkey, archive, on_progress=show_progress,
+                                                  session_key=st.session_state.key)
+                except Exception as e:
+                    logger.error(f"Export error: {str(e)}")
+                    st.error(f"❌ Export failed: {str(e)}")
+                    return
+                progress.empty()
+                if manifest["skipped"]:
+                    st.warning(f"⚠️ {len(manifest['skipped'])} item(s) could not be opened with this passkey: "
+                               f"{', '.join(manifest['skipped'])}")
+                if not manifest["items"]:
+                    return
+                if archive.tell() > EXPORT_MAX_SIZE:
+                    st.error(f"❌ The archive is too large to download here. {too_large}.")
+                    return
+                archive.seek(0)
+                st.success(f"✅ {len(manifest['items'])} item(s) exported!")
+                # Reads the archive now; it is deleted when the with block closes it
+                st.download_button(
+                    "⬇️ Download Archive",
+                    archive,
+                    file_name=f"{username}_export_{time.strftime('%Y%m%d_%H%M%S')}.zip",
+                    mime="application/zip",
+                    use_container_width=True
+                )
+
 # Add these core functions after the logging setup and before the main app code
 
-def hash_passkey(passkey):
-    """Hash the passkey using SHA-256"""
-    return hashlib.sha256(passkey.encode()).hexdigest()
+@st.cache_resource
+def get_metrics_exporter():
+    """Start the configured metrics exporters once per process and describe where they write"""
+    targets = []
+    if METRICS_PORT:
+        server = metrics.start_http_server(METRICS_PORT)
+        targets.append(f"http://127.0.0.1:{server.server_address[1]}/metrics")
+    if METRICS_FILE:
+        metrics.start_file_flusher(METRICS_FILE, METRICS_FLUSH_INTERVAL)
+        targets.append(METRICS_FILE)
+    return ", ".join(targets)
 
-def encode_binary_data(binary_data):
-    """Convert binary data to base64 string for storage"""
-    return base64.b64encode(binary_data).decode('utf-8')
+@st.cache_resource
+def get_login_limiter():
+    """Return the process-wide login rate limiter, shared by every session"""
+    return LoginLimiter()
 
-def decode_binary_data(encoded_data):
-    """Convert base64 string back to binary data"""
-    return base64.b64decode(encoded_data.encode('utf-8'))
-
-def encrypt_data(data, passkey, is_binary=False):
-    """Encrypt data using Fernet encryption"""
-    try:
-        if is_binary:
-            if not isinstance(data, bytes):
-                raise ValueError("Binary data must be bytes")
-            data_to_encrypt = data
-        else:
-            if not isinstance(data, str):
-                raise ValueError("Text data must be string")
-            data_to_encrypt = data.encode()
-        
-        encrypted_data = st.session_state.cipher.encrypt(data_to_encrypt)
-        return base64.b64encode(encrypted_data).decode('utf-8')
-    except Exception as e:
-        logger.error(f"Encryption error: {str(e)}")
-        return None
-
-def decrypt_data(encrypted_data, passkey, is_binary=False):
-    """Decrypt data using Fernet decryption"""
-    try:
-        decoded_data = decode_binary_data(encrypted_data)
-        decrypted_data = st.session_state.cipher.decrypt(decoded_data)
-        
-        if is_binary:
-            return decrypted_data
-        else:
-            return decrypted_data.decode()
-    except Exception as e:
-        logger.error(f"Decryption error: {str(e)}")
-        return None
+def client_address():
+    """Return the client's IP address, or None when it is not known (localhost, or Streamlit before 1.45)"""
+    return getattr(getattr(st, "context", None), "ip_address", None)
 
 def authenticate(username, password):
-    """Authenticate user credentials"""
-    if username in st.session_state.user_accounts:
-        hashed_password = hash_passkey(password)
-        if st.session_state.user_accounts[username] == hashed_password:
-            st.session_state.authenticated = True
-            st.session_state.username = username
-            st.session_state.failed_attempts = 0
-            return True
+    """Authenticate user credentials, raising auth.LoginRateLimited while the user or client is locked out"""
+    if auth.login(get_login_limiter(), st.session_state.user_accounts, username, password, client_address()):
+        st.session_state.authenticated = True
+        st.session_state.username = username
+        return True
     return False
 
 def logout():
@@ -1147,13 +1316,8 @@ def logout():
 
 def change_password(username, old_password, new_password):
     """Change user password"""
-    if username in st.session_state.user_accounts:
-        hashed_old_password = hash_passkey(old_password)
-        if st.session_state.user_accounts[username] == hashed_old_password:
-            st.session_state.user_accounts[username] = hash_passkey(new_password)
-            logger.info(f"Password changed for user: {username}")
-            return True
-    return False
+    return auth.change_password(st.session_state.user_accounts, username, old_password, new_password,
+                                get_login_limiter(), client_address())
 
 # Load data at startup
 load_data()
@@ -1162,5 +1326,8 @@ if __name__ == "__main__":
     try:
         main()
     except Exception as e:
+        metrics.count_error("rerun")
         logger.error(f"Application error: {str(e)}")
-        st.error("An unexpected error occurred. Please refresh the page or contact support.") 
\ No newline at end of file
+        st.error("An unexpected error occurred. Please refresh the page or contact support.")
+    finally:
+        metrics.observe("rerun", time.perf_counter() - SCRIPT_START) 
\ No newline at end of file
@@ -0,0 +1,62 @@
+"""Shared fixtures for the secure_data tests.
+
+Costs are lowered before the package is imported (config reads the
+environment once), so key derivation and password hashing stay fast.
+"""
+import os
+import subprocess
+import sys
+
+os.environ.setdefault("SECURE_APP_KDF_LOG2_N", "10")
+os.environ.setdefault("SECURE_APP_PASSWORD_LOG2_N", "10")
+
+import pytest  # noqa: E402
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+from secure_data import Vault  # noqa: E402
+
+
+def vault_paths(directory, backend="journal"):
+    """Return Vault keyword arguments placing every file under directory"""
+    return {
+        "backend": backend,
+        "path": os.path.join(directory, f"store.{backend}"),
+        "blob_dir": os.path.join(directory, "blobs"),
+        "keyring_file": os.path.join(directory, "keyring.json"),
+        "legacy_data_file": os.path.join(directory, "encrypted_data.json"),
+        "chunk_index_file": os.path.join(directory, "chunk_index.db"),
+        "kdf_log2_n": 10,
+    }
+
+
+@pytest.fixture
+def make_vault(tmp_path):
+    """Return a factory of Vaults sharing tmp_path, as separate processes would"""
+    vaults = []
+
+    def make(backend="journal", **overrides):
+        vault = Vault(**{**vault_paths(str(tmp_path), backend), **overrides})
+        vaults.append(vault)
+        return vault
+
+    yield make
+    for vault in vaults:
+        vault.store.close()
+
+
+def run_processes(code, count, *args):
+    """Run count Python processes executing code (argv[1:] = index, *args) at once; return their stdout"""
+    env = {**os.environ, "PYTHONPATH": APP_DIR}
+    processes = [
+        subprocess.Popen([sys.executable, "-c", code, str(index), *map(str, args)],
+                         stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env, text=True)
+        for index in range(count)
+    ]
+    outputs = []
+    for process in processes:
+        stdout, stderr = process.communicate(timeout=120)
+        assert process.returncode == 0, stderr
+        outputs.append(stdout)
+    return outputs
@@ -0,0 +1,133 @@
+"""HTTP API: request framing on keep-alive connections."""
+import asyncio
+import base64
+import io
+
+import pytest
+
+from secure_data.api import MAX_DISCARD_SIZE, VaultAPI
+
+AUTH = "Basic " + base64.b64encode(b"admin:admin123").decode("ascii")
+
+
+@pytest.fixture
+def api(make_vault):
+    api = VaultAPI(make_vault(), workers=2)
+    yield api
+    api.pool.shutdown(wait=True)
+
+
+def exchange(api, *requests):
+    """Send raw requests on one connection; return [(status, headers, body)] for each response read"""
+    async def run():
+        server = await asyncio.start_server(api.handle_connection, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        responses = []
+        for request in requests:
+            writer.write(request)
+            await writer.drain()
+            try:
+                head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 10)
+            except asyncio.IncompleteReadError:
+                break
+            lines = head.decode("latin-1").split("\r\n")
+            headers = dict(line.lower().split(": ", 1) for line in lines[1:] if line)
+            body = await reader.readexactly(int(headers["content-length"]))
+            responses.append((int(lines[0].split()[1]), headers, body))
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        return responses
+
+    return asyncio.run(run())
+
+
+def request(method, path, body=b"", headers=()):
+    lines = [f"{method} {path} HTTP/1.1", "Host: localhost", f"Authorization: {AUTH}", *headers]
+    if body or method == "PUT":
+        lines.append(f"Content-Length: {len(body)}")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body
+
+
+def test_store_retrieve_delete(api):
+    passkey = "X-Passkey: secret"
+    responses = exchange(api,
+                         request("PUT", "/items/note?type=text", b"hello", [passkey]),
+                         request("GET", "/items/note", headers=[passkey]),
+                         request("GET", "/items/note", headers=["X-Passkey: wrong"]),
+                         request("GET", "/items"),
+                         request("DELETE", "/items/note"),
+                         request("GET", "/items/note", headers=[passkey]))
+    assert [status for status, _, _ in responses] == [201, 200, 403, 200, 204, 404]
+    assert responses[1][2] == b"hello"
+    assert b'"label": "note"' in responses[3][2]
+
+
+@pytest.mark.parametrize("length", ["abc", "-5", "+5", "1e3"])
+def test_bad_content_length_is_rejected(api, length):
+    raw = f"GET /health HTTP/1.1\r\nContent-Length: {length}\r\n\r\n".encode("latin-1")
+    responses = exchange(api, raw, request("GET", "/health"))
+    # The connection is closed after the 400, so the second request gets no answer
+    assert len(responses) == 1
+    status, headers, _ = responses[0]
+    assert status == 400 and headers["connection"] == "close"
+
+
+def test_body_on_get_is_not_parsed_as_the_next_request(api):
+    smuggled = request("DELETE", "/items/note")
+    responses = exchange(api,
+                         request("PUT", "/items/note?type=text", b"hello", ["X-Passkey: secret"]),
+                         request("GET", "/health", smuggled),
+                         request("GET", "/items"))
+    assert [status for status, _, _ in responses] == [201, 200, 200]
+    assert responses[1][1]["connection"] == "keep-alive"
+    assert b'"total": 1' in responses[2][2]
+
+
+def test_large_body_on_get_closes_the_connection(api):
+    responses = exchange(api, request("GET", "/items", b"x" * (MAX_DISCARD_SIZE + 1)), request("GET", "/health"))
+    assert len(responses) == 1
+    assert responses[0][0] == 413 and responses[0][1]["connection"] == "close"
+
+
+class FailingSpool(io.BytesIO):
+    """A decrypted spool file whose second read fails, as a dying disk would"""
+
+    reads = 0
+
+    def read(self, size=-1):
+        self.reads += 1
+        if self.reads > 1:
+            raise OSError("read error")
+        return super().read(100)
+
+
+def test_failure_mid_download_resets_the_connection(api, monkeypatch):
+    exchange(api, request("PUT", "/items/note?type=text", b"x" * 1000, ["X-Passkey: secret"]))
+    monkeypatch.setattr(api.vault, "decrypt_to_file", lambda *args: FailingSpool(b"x" * 1000))
+
+    async def run():
+        server = await asyncio.start_server(api.handle_connection, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(request("GET", "/items/note", headers=["X-Passkey: secret"]))
+        received = b""
+        try:
+            while True:
+                data = await asyncio.wait_for(reader.read(65536), 10)
+                if not data:
+                    break
+                received += data
+        except ConnectionResetError:
+            pass
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        return received
+
+    received = asyncio.run(run())
+    head, body = received.split(b"\r\n\r\n", 1)
+    assert head.startswith(b"HTTP/1.1 200") and b"Content-Length: 1000" in head
+    # The body stops short and no 500 response follows it
+    assert body == b"x" * 100
@@ -0,0 +1,175 @@
+"""Incremental backup chains: restore points, chain rollover and crash recovery."""
+import copy
+import json
+import os
+
+import pytest
+
+from secure_data import restore
+from secure_data.backups import BackupChains
+from secure_data.chunking import MIN_ITEM_SIZE
+from secure_data.storage import JsonFileStore
+
+
+def record_saves(chains, count, history=None, start=0):
+    """Record count saves of one item each, returning the store after each point, by seq"""
+    history = history if history is not None else {}
+    data = copy.deepcopy(history[max(history)]) if history else {}
+    for index in range(start, start + count):
+        changes = [["alice", f"item{index % 7}", {"v": index}]]
+        if index % 5 == 4:
+            changes.append(["alice", f"item{(index + 3) % 7}", None])
+        for username, label, item in changes:
+            if item is None:
+                data.get(username, {}).pop(label, None)
+            else:
+                data.setdefault(username, {})[label] = item
+        chains.record(data, changes)
+        history[max(history, default=0) + 1] = copy.deepcopy(data)
+    return history
+
+
+def test_every_point_restores(tmp_path):
+    chains = BackupChains(str(tmp_path), max_chains=100, min_segment_size=0)
+    history = record_saves(chains, 40)
+    with open(tmp_path / "manifest.json") as f:
+        assert len(json.load(f)["chains"]) > 1
+    assert [seq for seq, _ in chains.points()] == list(history)
+    for seq, expected in history.items():
+        assert chains.restore(seq=seq) == expected
+    assert chains.restore() == history[40]
+
+
+def test_old_chains_are_dropped(tmp_path):
+    chains = BackupChains(str(tmp_path), max_chains=2, min_segment_size=0)
+    history = record_saves(chains, 60)
+    with open(tmp_path / "manifest.json") as f:
+        assert len(json.load(f)["chains"]) == 2
+    oldest = chains.points()[0][0]
+    assert oldest > 1
+    assert chains.restore(seq=oldest) == history[oldest]
+    with pytest.raises(LookupError):
+        chains.restore(seq=oldest - 1)
+    assert len([name for name in os.listdir(tmp_path) if name.startswith("base-")]) == 2
+
+
+def test_restore_by_time(tmp_path):
+    chains = BackupChains(str(tmp_path))
+    history = record_saves(chains, 5)
+    points = dict(chains.points())
+    assert chains.restore(at=points[3]) == history[3]
+    assert chains.restore(at=points[3] + (points[4] - points[3]) / 2) == history[3]
+    with pytest.raises(LookupError):
+        chains.restore(at=points[1] - 1)
+
+
+def test_a_new_process_continues_the_chain(tmp_path):
+    history = record_saves(BackupChains(str(tmp_path)), 5)
+    chains = BackupChains(str(tmp_path))
+    record_saves(chains, 5, history, start=5)
+    assert [seq for seq, _ in chains.points()] == list(range(1, 11))
+    assert chains.restore(seq=10) == history[10]
+
+
+@pytest.mark.parametrize("torn", ["delta", "index"])
+def test_a_torn_record_starts_a_new_chain(tmp_path, torn):
+    history = record_saves(BackupChains(str(tmp_path)), 5)
+    # A crash mid-save leaves part of a delta line, or a delta without all of its index record
+    suffix = {"delta": ".jsonl", "index": ".idx"}[torn]
+    (segment,) = [name for name in os.listdir(tmp_path) if name.endswith(suffix)]
+    with open(tmp_path / segment, "ab") as f:
+        f.write(b'{"seq":6,"time":1,"chan' if torn == "delta" else b"\x00" * 10)
+    chains = BackupChains(str(tmp_path))
+    record_saves(chains, 3, history, start=5)
+    for seq in (5, 6, 8):
+        assert chains.restore(seq=seq) == history[seq]
+    with open(tmp_path / "manifest.json") as f:
+        assert len(json.load(f)["chains"]) == 2
+
+
+def test_json_store_restores_from_backups(tmp_path, capsys):
+    path = str(tmp_path / "encrypted_data.json")
+    store = JsonFileStore(path)
+    store.put("alice", "a", {"v": 1})
+    store.put("alice", "b", {"v": 2})
+    store.delete("alice", "a")
+    with open(path, "w") as f:
+        f.write("{not json")
+    # A corrupt data file is replaced by the newest backup point
+    assert JsonFileStore(path).snapshot() == {"alice": {"b": {"v": 2}}}
+    assert restore.main(["--data-file", path, "--seq", "2"]) == 0
+    capsys.readouterr()
+    with open(f"{path}.restored") as f:
+        assert json.load(f) == {"alice": {"a": {"v": 1}, "b": {"v": 2}}}
+    assert restore.main(["--data-file", path, "--list"]) == 0
+    assert len(capsys.readouterr().out.strip().splitlines()) == 3
+
+
+
+def manifest_chains(directory):
+    with open(directory / "manifest.json") as f:
+        return json.load(f)["chains"]
+
+
+def test_resume_after_an_unreadable_newest_index(tmp_path):
+    chains = BackupChains(str(tmp_path), max_chains=100, min_segment_size=0)
+    record_saves(chains, 10)
+    newest = manifest_chains(tmp_path)[-1]
+    assert newest["first_seq"] > 1
+    os.remove(tmp_path / f"delta-{newest['id']:06d}.idx")
+    # The broken chain is replaced, and neither its points nor the older chains' are numbered again
+    chains = BackupChains(str(tmp_path), max_chains=100, min_segment_size=0)
+    chains.record({"alice": {}}, [])
+    assert manifest_chains(tmp_path)[-1]["first_seq"] == 11
+
+
+def test_holds_expire_with_their_chains(tmp_path):
+    chains = BackupChains(str(tmp_path), max_chains=2, min_segment_size=0)
+    history = record_saves(chains, 1)
+    chains.hold({"blob": {"hash": "a"}})
+    # A torn line from a crash mid-hold is skipped
+    with open(tmp_path / "held.jsonl", "ab") as f:
+        f.write(b'{"chain":1,"payl')
+    assert chains.held() == [{"blob": {"hash": "a"}}]
+    # The hold was taken in chain 1, so it lasts until chain 1 is dropped
+    while manifest_chains(tmp_path)[0]["id"] == 1:
+        assert chains.expired_holds() == []
+        record_saves(chains, 1, history, start=len(history))
+    assert chains.expired_holds() == [{"blob": {"hash": "a"}}]
+    assert chains.held() == []
+
+
+def test_payloads_outlive_the_points_that_restore_them(make_vault):
+    vault = make_vault("json")
+    backups = vault.store.backups
+    text = vault.encrypt_data("first", "passkey")
+    vault.save_item("alice", "note", {**text, "type": "text"}, wait=True)
+    data = os.urandom(MIN_ITEM_SIZE * 2)
+    chunked = vault.encrypt_data(data, "passkey", is_binary=True, username="alice")
+    vault.save_item("alice", "file", {**chunked, "type": "file"}, wait=True)
+    seq = backups.points()[-1][0]
+    vault.save_item("alice", "note", {**vault.encrypt_data("second", "passkey"), "type": "text"}, wait=True)
+    vault.delete_item("alice", "file")
+    vault.store.flush().result()
+    # The overwritten and deleted payloads are held, so the earlier point still decrypts
+    restored = backups.restore(seq=seq)["alice"]
+    assert vault.collect_chunks(min_age=0) == 0
+    assert vault.decrypt_data(restored["note"], "passkey") == "first"
+    assert vault.decrypt_data(restored["file"], "passkey", is_binary=True) == data
+    # Once no retained chain goes back that far, they are deleted
+    backups.max_chains = 1
+    backups.min_segment_size = 0
+    for index in range(20):
+        vault.save_item("alice", f"filler{index}", {**vault.encrypt_data("x", "passkey"), "type": "text"},
+                        wait=True)
+    vault.collect_chunks(min_age=0)
+    assert not vault.blob_store.exists(text["blob"]["hash"])
+    assert not vault.blob_store.exists(chunked["blob"]["hash"])
+    assert vault.dedup_stats("alice")["chunks"] == 0
+    assert backups.held() == []
+
+
+def test_other_backends_warn_that_they_keep_no_backups(make_vault, caplog):
+    vault = make_vault("journal")
+    assert vault.store.backups is None
+    assert "keeps no backup restore points" in caplog.text
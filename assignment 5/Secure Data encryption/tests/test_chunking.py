@@ -0,0 +1,96 @@
+"""Content-defined chunking, the chunk reference index and deduplicated items."""
+import io
+import os
+import random
+
+import pytest
+
+from secure_data import chunking
+from secure_data.chunk_index import ChunkIndex
+from secure_data.chunking import MAX_CHUNK_SIZE, MIN_CHUNK_SIZE, MIN_ITEM_SIZE
+
+PASSKEY = "passkey"
+
+
+def random_bytes(size, seed=0):
+    return random.Random(seed).randbytes(size)
+
+
+def test_chunks_cover_the_input_within_size_limits():
+    data = random_bytes(2 * 1024 * 1024)
+    chunks = list(chunking.iter_chunks(data))
+    assert b"".join(chunks) == data
+    assert all(MIN_CHUNK_SIZE <= len(chunk) <= MAX_CHUNK_SIZE for chunk in chunks[:-1])
+    # Files are read in blocks; the boundaries must not depend on the block size
+    assert list(chunking.iter_chunks(io.BytesIO(data), read_size=100_000)) == chunks
+
+
+def test_repetitive_data_is_cut_at_the_maximum_size():
+    chunks = list(chunking.iter_chunks(b"\x00" * (3 * MAX_CHUNK_SIZE + 10)))
+    assert [len(chunk) for chunk in chunks] == [MAX_CHUNK_SIZE] * 3 + [10]
+
+
+def test_an_insertion_only_changes_nearby_chunks():
+    data = random_bytes(2 * 1024 * 1024)
+    original = set(chunking.iter_chunks(data))
+    edited = set(chunking.iter_chunks(data[:1000] + b"inserted" + data[1000:]))
+    assert len(original & edited) >= len(original) - 2
+
+
+def test_chunk_ids_are_keyed_by_the_secret():
+    chunk = b"chunk"
+    assert chunking.chunk_ids(b"a" * 32, chunk) == chunking.chunk_ids(b"a" * 32, chunk)
+    assert chunking.chunk_ids(b"a" * 32, chunk)[0] != chunking.chunk_ids(b"b" * 32, chunk)[0]
+
+
+@pytest.mark.parametrize("codec", [None, "zlib", "bz2"])
+def test_pack_round_trip(codec):
+    for chunk in (b"a" * 5000, os.urandom(5000)):
+        assert chunking.unpack_chunk(chunking.pack_chunk(chunk, codec), len(chunk)) == chunk
+    with pytest.raises(ValueError):
+        chunking.unpack_chunk(chunking.pack_chunk(b"a" * 5000, codec), 10)
+
+
+def test_index_counts_references(tmp_path):
+    index = ChunkIndex(str(tmp_path / "chunks.db"))
+    assert index.acquire("alice", "m1", [("c1", 10), ("c2", 20), ("c1", 10)]) == {"c1", "c2"}
+    assert index.acquire("alice", "m2", [("c2", 20), ("c3", 30)]) == {"c3"}
+    # Chunks are per user
+    assert index.acquire("bob", "m3", [("c1", 10)]) == {"c1"}
+    assert index.stats("alice") == {"chunks": 3, "references": 5, "unique_bytes": 60, "referenced_bytes": 90}
+    removed = []
+    assert index.release("m1", removed.append) == 2
+    assert removed == ["c1"]
+    index.release("m2", removed.append)
+    assert sorted(removed) == ["c1", "c2", "c3"]
+    assert index.stats("alice")["chunks"] == 0 and index.stats("bob")["chunks"] == 1
+    assert index.manifests() == {"m3": "bob"}
+    index.close()
+
+
+def test_identical_files_are_stored_once(make_vault):
+    vault = make_vault()
+    data = random_bytes(4 * MIN_ITEM_SIZE)
+    for label in ("one", "two"):
+        payload = vault.encrypt_data(data, PASSKEY, is_binary=True, username="alice")
+        vault.save_item("alice", label, {**payload, "type": "file"}, wait=True)
+    stats = vault.dedup_stats("alice")
+    assert stats["referenced_bytes"] == 2 * stats["unique_bytes"] == 2 * len(data)
+    vault.delete_item("alice", "one")
+    vault.store.flush().result()
+    assert vault.decrypt_data(vault.store.get("alice", "two"), PASSKEY, is_binary=True) == data
+    vault.delete_item("alice", "two")
+    vault.store.flush().result()
+    assert vault.dedup_stats("alice")["chunks"] == 0
+
+
+def test_collect_chunks_releases_unsaved_uploads(make_vault):
+    vault = make_vault()
+    data = random_bytes(4 * MIN_ITEM_SIZE)
+    saved = vault.encrypt_data(data, PASSKEY, is_binary=True, username="alice")
+    vault.save_item("alice", "saved", {**saved, "type": "file"}, wait=True)
+    vault.encrypt_data(random_bytes(4 * MIN_ITEM_SIZE, seed=1), PASSKEY, is_binary=True, username="alice")
+    assert vault.collect_chunks(min_age=3600) == 0
+    assert vault.collect_chunks(min_age=0) == 1
+    assert vault.dedup_stats("alice")["unique_bytes"] == len(data)
+    assert vault.decrypt_data(vault.store.get("alice", "saved"), PASSKEY, is_binary=True) == data
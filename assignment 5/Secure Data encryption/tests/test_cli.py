@@ -0,0 +1,43 @@
+"""Batch CLI: encrypt/decrypt round trip and the journal lock."""
+import pytest
+
+from secure_data import cli
+from secure_data.journal_store import JournalStore
+
+
+@pytest.fixture
+def argv(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "passkey").write_text("correct horse battery")
+    return ["--backend", "journal", "--store", str(tmp_path / "store.journal"),
+            "--blob-dir", str(tmp_path / "blobs"), "--keyring", str(tmp_path / "keyring.json"),
+            "--passkey-file", str(tmp_path / "passkey"), "--quiet"]
+
+
+def test_encrypt_decrypt_round_trip(tmp_path, argv, capsys):
+    source = tmp_path / "reports"
+    (source / "q1").mkdir(parents=True)
+    (source / "q1" / "sales.csv").write_bytes(b"region,total\nnorth,10\n")
+    (source / "notes.txt").write_bytes(b"x" * 100_000)
+    assert cli.main(argv + ["encrypt", str(source), "--user", "admin", "--prefix", "reports/"]) == 0
+    assert "Encrypted 2 file(s)" in capsys.readouterr().out
+    # A second run has nothing left to do
+    assert cli.main(argv + ["encrypt", str(source), "--user", "admin", "--prefix", "reports/"]) == 0
+    assert "Encrypted 0 file(s)" in capsys.readouterr().out
+    output = tmp_path / "restored"
+    assert cli.main(argv + ["decrypt", str(output), "--user", "admin", "--prefix", "reports/"]) == 0
+    assert (output / "q1" / "sales.csv").read_bytes() == b"region,total\nnorth,10\n"
+    assert (output / "notes.txt").read_bytes() == b"x" * 100_000
+
+
+def test_refuses_a_journal_open_elsewhere(tmp_path, argv, capsys):
+    source = tmp_path / "reports"
+    source.mkdir()
+    (source / "a.txt").write_bytes(b"a")
+    # As if the app were running with the same journal
+    app_store = JournalStore(str(tmp_path / "store.journal"))
+    assert cli.main(argv + ["encrypt", str(source), "--user", "admin"]) == 2
+    assert "already open" in capsys.readouterr().err
+    app_store.close()
+    assert cli.main(argv + ["encrypt", str(source), "--user", "admin"]) == 0
+    assert "Encrypted 1 file(s)" in capsys.readouterr().out
@@ -0,0 +1,134 @@
+"""Compression: codec choice, streaming round trips and codecs recorded on vault items."""
+import io
+import random
+import zipfile
+
+import pytest
+from PIL import Image
+
+from secure_data import compression
+
+PASSKEY = "passkey"
+
+
+def text_bytes(size):
+    words = [b"invoice", b"total", b"customer", b"2024-05-01", b"paid", b"\n"]
+    rng = random.Random(0)
+    data = bytearray()
+    while len(data) < size:
+        data += rng.choice(words) + b" "
+    return bytes(data[:size])
+
+
+def mixed_bytes(size, seed=0):
+    """Binary data of about 6 bits/byte: not text, but still worth compressing"""
+    rng = random.Random(seed)
+    alphabet = bytes(range(0, 256, 4))
+    return bytes(rng.choice(alphabet) for _ in range(size))
+
+
+def image_bytes(fmt):
+    out = io.BytesIO()
+    Image.new("RGB", (256, 256), "red").save(out, fmt)
+    return out.getvalue()
+
+
+def zip_bytes():
+    out = io.BytesIO()
+    with zipfile.ZipFile(out, "w") as archive:
+        archive.writestr("notes.txt", text_bytes(100_000))
+    return out.getvalue()
+
+
+def round_trip(data, codec, read_size=1000, write_size=777):
+    """Compress data through compressing_reader() and decompress it through DecompressingWriter"""
+    reader = compression.compressing_reader(data, codec)
+    compressed = bytearray()
+    while True:
+        chunk = reader.read(read_size)
+        if not chunk:
+            break
+        compressed += chunk
+    out = io.BytesIO()
+    writer = compression.DecompressingWriter(out, codec)
+    for offset in range(0, len(compressed), write_size):
+        writer.write(compressed[offset:offset + write_size])
+    writer.close()
+    return bytes(compressed), out.getvalue()
+
+
+@pytest.mark.parametrize("codec", compression.CODECS)
+@pytest.mark.parametrize("data", [b"", text_bytes(300_000), bytes(3 * compression.OUTPUT_CHUNK_SIZE)],
+                         ids=["empty", "text", "zeros"])
+def test_streaming_round_trip(codec, data):
+    compressed, restored = round_trip(data, codec)
+    assert restored == data
+    if data:
+        assert len(compressed) < len(data) // 4
+
+
+@pytest.mark.parametrize("codec", compression.CODECS)
+def test_round_trip_from_a_sampled_file(codec):
+    data = mixed_bytes(200_000)
+    sample, source = compression.sample_source(io.BytesIO(data), size=4096)
+    assert sample == data[:4096]
+    _, restored = round_trip(source, codec, read_size=65536)
+    assert restored == data
+
+
+@pytest.mark.parametrize("codec", compression.CODECS)
+def test_truncated_stream_is_rejected(codec):
+    compressed, _ = round_trip(text_bytes(50_000), codec)
+    writer = compression.DecompressingWriter(io.BytesIO(), codec)
+    writer.write(compressed[:len(compressed) // 2])
+    with pytest.raises(ValueError, match="truncated"):
+        writer.close()
+
+
+def test_unknown_codec():
+    with pytest.raises(ValueError, match="Unknown compression codec"):
+        compression.compressing_reader(b"data", "lzma")
+    with pytest.raises(ValueError, match="Unknown compression codec"):
+        compression.DecompressingWriter(io.BytesIO(), "lzma")
+
+
+@pytest.mark.parametrize("data, mime_type", [
+    (image_bytes("JPEG"), "image/jpeg"),
+    (image_bytes("PNG"), "image/png"),
+    (zip_bytes(), "application/zip"),
+    # A generic MIME type still gets the format from its leading bytes
+    (image_bytes("JPEG"), "application/octet-stream"),
+    (image_bytes("PNG"), None),
+    (zip_bytes(), "application/octet-stream"),
+], ids=["jpeg", "png", "zip", "jpeg-generic", "png-untyped", "zip-generic"])
+def test_compressed_formats_are_stored_as_is(data, mime_type):
+    assert compression.choose_codec(mime_type, data[:compression.SAMPLE_SIZE], len(data)) is None
+
+
+def test_codec_choice():
+    sample = text_bytes(compression.SAMPLE_SIZE)
+    assert compression.choose_codec("text/csv", sample, 100_000) == "bz2"
+    assert compression.choose_codec("text/csv", sample, compression.BZ2_MAX_SIZE + 1) == "zlib"
+    assert compression.choose_codec("application/octet-stream", mixed_bytes(20_000)) == "zlib"
+    assert compression.choose_codec("text/plain", b"short") is None
+    assert compression.choose_codec("application/octet-stream", random.Random(0).randbytes(20_000)) is None
+
+
+@pytest.mark.parametrize("data, content_type, codec", [
+    (text_bytes(100_000), "text/csv", "bz2"),
+    (mixed_bytes(50_000), "application/octet-stream", "zlib"),
+    (image_bytes("PNG"), "image/png", None),
+], ids=["bz2", "zlib", "png"])
+def test_codec_survives_store_and_decrypt(make_vault, data, content_type, codec):
+    vault = make_vault()
+    payload = vault.encrypt_data(io.BytesIO(data), PASSKEY, is_binary=True, content_type=content_type)
+    assert payload.get("compression") == codec
+    vault.save_item("alice", "file", {**payload, "type": "file"}, wait=True)
+    vault.store.close()
+    # A vault reopening the store reads the codec back from the item
+    reopened = make_vault()
+    item = reopened.store.get("alice", "file")
+    assert item.get("compression") == codec
+    if codec:
+        assert item["blob"]["size"] < len(data)
+    assert reopened.decrypt_data(item, PASSKEY, is_binary=True) == data
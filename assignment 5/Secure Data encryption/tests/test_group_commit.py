@@ -0,0 +1,155 @@
+"""Group commit: batching across threads, durability of futures and failure recovery."""
+import threading
+
+import pytest
+
+from secure_data.group_commit import GroupCommitWriter
+from secure_data.storage import CachedStore, Store
+
+
+class Recorder:
+    """commit() that records each batch, optionally blocking or failing"""
+
+    def __init__(self):
+        self.batches = []
+        self.entered = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+        self.failures = 0
+
+    def __call__(self, changes):
+        self.entered.set()
+        self.release.wait(10)
+        if self.failures:
+            self.failures -= 1
+            raise OSError("disk full")
+        self.batches.append(changes)
+
+
+class MemoryStore(Store):
+    """In-memory backend whose apply() can be made to fail"""
+
+    def __init__(self):
+        self.data = {}
+        self.fail = False
+
+    def get(self, username, label):
+        return self.data.get(username, {}).get(label)
+
+    def apply(self, changes):
+        if self.fail:
+            raise OSError("disk full")
+        for username, label, item in changes:
+            items = self.data.setdefault(username, {})
+            if item is None:
+                items.pop(label, None)
+            else:
+                items[label] = item
+
+    def list_items(self, username):
+        return dict(self.data.get(username, {}))
+
+    def users(self):
+        return [username for username, items in self.data.items() if items]
+
+
+@pytest.fixture
+def recorder():
+    return Recorder()
+
+
+def test_submits_from_many_threads_share_one_commit(recorder):
+    writer = GroupCommitWriter(recorder, window=0.5)
+    start = threading.Barrier(8)
+    futures = [None] * 8
+
+    def submit(index):
+        start.wait()
+        futures[index] = writer.submit([("alice", f"item{index}", {"v": index})])
+
+    threads = [threading.Thread(target=submit, args=(index,)) for index in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for future in futures:
+        future.result(timeout=10)
+    assert len(recorder.batches) == 1 and writer.batches == 1
+    assert sorted(label for _, label, _ in recorder.batches[0]) == [f"item{index}" for index in range(8)]
+    writer.close()
+
+
+def test_the_last_change_to_a_label_wins(recorder):
+    writer = GroupCommitWriter(recorder, window=0.2)
+    writer.submit([("alice", "a", {"v": 1}), ("alice", "b", {"v": 1})])
+    writer.submit([("alice", "a", None)])
+    writer.flush().result(timeout=10)
+    assert recorder.batches == [[("alice", "a", None), ("alice", "b", {"v": 1})]]
+    assert writer.changes == 2
+    writer.close()
+
+
+def test_futures_complete_only_once_durable(recorder):
+    writer = GroupCommitWriter(recorder, window=0)
+    recorder.release.clear()
+    future = writer.submit([("alice", "a", {"v": 1})])
+    # The commit has started but not finished writing
+    assert recorder.entered.wait(10)
+    assert not future.done() and recorder.batches == []
+    recorder.release.set()
+    future.result(timeout=10)
+    assert recorder.batches == [[("alice", "a", {"v": 1})]]
+    writer.close()
+
+
+def test_max_batch_splits_commits(recorder):
+    writer = GroupCommitWriter(recorder, window=0, max_batch=2)
+    recorder.release.clear()
+    futures = [writer.submit([("alice", f"item{index}", {"v": index})]) for index in range(5)]
+    recorder.release.set()
+    for future in futures:
+        future.result(timeout=10)
+    assert all(len(batch) <= 2 for batch in recorder.batches)
+    assert sum(len(batch) for batch in recorder.batches) == 5
+    writer.close()
+
+
+def test_a_failed_commit_fails_its_futures_and_the_next_one_succeeds(recorder):
+    failures = []
+    writer = GroupCommitWriter(recorder, window=0,
+                               on_failure=lambda error: failures.append((error, writer.commit_lock.locked())))
+    recorder.failures = 1
+    with pytest.raises(OSError, match="disk full"):
+        writer.submit([("alice", "a", {"v": 1})]).result(timeout=10)
+    # on_failure ran before the future failed, while the commit lock was held
+    assert [(str(error), locked) for error, locked in failures] == [("disk full", True)]
+    writer.submit([("alice", "b", {"v": 2})]).result(timeout=10)
+    assert recorder.batches == [[("alice", "b", {"v": 2})]] and writer.batches == 1
+    writer.close()
+
+
+def test_close_commits_what_is_queued(recorder):
+    writer = GroupCommitWriter(recorder, window=0.5)
+    future = writer.submit([("alice", "a", {"v": 1})])
+    writer.close()
+    assert future.done() and recorder.batches == [[("alice", "a", {"v": 1})]]
+    with pytest.raises(RuntimeError):
+        writer.submit([])
+
+
+def test_cached_store_recovers_from_a_failed_commit():
+    backend = MemoryStore()
+    store = CachedStore(backend, write_behind=0.01)
+    store.put("alice", "a", {"v": 1}).result(timeout=10)
+    backend.fail = True
+    failed = store.put("alice", "b", {"v": 2})
+    # The cache shows the write at once, before it is durable
+    assert store.get("alice", "b") == {"v": 2}
+    with pytest.raises(OSError):
+        failed.result(timeout=10)
+    # After the failure the cache is back in line with the backend
+    assert store.list_items("alice") == {"a": {"v": 1}}
+    backend.fail = False
+    store.put("alice", "c", {"v": 3}).result(timeout=10)
+    assert store.list_items("alice") == backend.list_items("alice") == {"a": {"v": 1}, "c": {"v": 3}}
+    store.close()
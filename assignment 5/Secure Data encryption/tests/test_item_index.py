@@ -0,0 +1,124 @@
+"""Item search index: prefix and substring search, filters, sorting and updates."""
+import random
+
+import pytest
+
+from secure_data.item_index import ItemIndex, item_size
+
+WORDS = ["Report", "invoice", "Photo", "notes", "REPORT-draft", "tax"]
+MIME_TYPES = ["image/png", "application/pdf", "text/csv"]
+
+
+def make_items(count, seed=0):
+    rng = random.Random(seed)
+    items = {}
+    for index in range(count):
+        label = f"{rng.choice(WORDS)}-{index}"
+        timestamp = f"2024-01-0{rng.randint(1, 5)} {rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:00"
+        if rng.random() < 0.5:
+            items[label] = {"type": "text", "timestamp": timestamp, "blob": {"size": rng.randint(1, 500)}}
+        else:
+            items[label] = {"type": "file", "timestamp": timestamp,
+                            "file_info": {"type": rng.choice(MIME_TYPES), "size": rng.randint(1, 10 ** 6)}}
+    return items
+
+
+def reference(items, prefix=None, contains=None, item_type=None, mime_type=None, since=None, until=None,
+              sort="label", descending=False):
+    """Answer a query by checking every item"""
+    def matches(label, item):
+        return ((not prefix or label.casefold().startswith(prefix.casefold()))
+                and (not contains or contains.casefold() in label.casefold())
+                and (not item_type or item.get("type", "text") == item_type)
+                and (not mime_type or item.get("file_info", {}).get("type") == mime_type)
+                and (not since or item["timestamp"] >= since)
+                and (not until or item["timestamp"][:len(until)] <= until))
+
+    def key(label):
+        item = items[label]
+        value = {"label": label.casefold(), "timestamp": item["timestamp"], "size": item_size(item)}[sort]
+        return value, label
+
+    return sorted((label for label, item in items.items() if matches(label, item)), key=key, reverse=descending)
+
+
+QUERIES = [
+    {},
+    {"prefix": "report"},
+    {"prefix": "REPORT-D"},
+    {"contains": "port"},
+    {"contains": "-1"},
+    {"contains": "nothing"},
+    {"item_type": "file"},
+    {"mime_type": "image/png"},
+    {"item_type": "text", "mime_type": "image/png"},
+    {"since": "2024-01-02", "until": "2024-01-03"},
+    {"until": "2024-01-02"},
+    {"since": "2024-01-04 12:00"},
+    {"prefix": "photo", "item_type": "file", "sort": "size"},
+    {"contains": "in", "since": "2024-01-02", "sort": "timestamp"},
+    {"prefix": "tax", "until": "2024-01-03", "sort": "timestamp", "descending": True},
+    {"mime_type": "application/pdf", "sort": "size", "descending": True},
+    {"contains": "e", "item_type": "text", "sort": "label", "descending": True},
+]
+
+
+@pytest.mark.parametrize("criteria", QUERIES)
+@pytest.mark.parametrize("count", [10, 500])
+def test_query_matches_a_full_scan(criteria, count):
+    items = make_items(count)
+    index = ItemIndex(items)
+    expected = reference(items, **criteria)
+    labels, total = index.query(**criteria)
+    assert (labels, total) == (expected, len(expected))
+    # Every page agrees with the same slice of the full answer
+    for offset in (0, 3, 7):
+        labels, total = index.query(offset=offset, limit=4, **criteria)
+        assert (labels, total) == (expected[offset:offset + 4], len(expected))
+
+
+def test_time_ranges_cover_whole_days():
+    index = ItemIndex({
+        "before": {"timestamp": "2024-01-01 23:59:59"},
+        "start": {"timestamp": "2024-01-02 00:00:00"},
+        "end": {"timestamp": "2024-01-02 23:59:59"},
+        "after": {"timestamp": "2024-01-03 00:00:00"},
+    })
+    assert index.query(since="2024-01-02", until="2024-01-02", sort="timestamp") == (["start", "end"], 2)
+    assert index.query(until="2024-01", sort="timestamp")[1] == 4
+    assert index.query(since="2024-01-02 12", sort="timestamp") == (["end", "after"], 2)
+
+
+def test_updates_keep_the_index_current():
+    items = make_items(50)
+    index = ItemIndex(items)
+    index.update("Report-new", {"type": "file", "timestamp": "2024-02-01 00:00:00",
+                                "file_info": {"type": "image/gif", "size": 7}})
+    index.update("Report-new", {"type": "file", "timestamp": "2024-02-02 00:00:00",
+                                "file_info": {"type": "image/jpeg", "size": 9}})
+    removed = next(iter(items))
+    index.update(removed, None)
+    assert index.mime_types() == sorted(MIME_TYPES + ["image/jpeg"])
+    assert index.query(since="2024-02", sort="timestamp") == (["Report-new"], 1)
+    assert removed not in index.query(contains=removed)[0]
+    assert len(index) == 50
+
+
+def test_unknown_sort_key():
+    with pytest.raises(ValueError, match="Unknown sort key"):
+        ItemIndex().query(sort="owner")
+
+
+def test_store_search_follows_puts_and_deletes(make_vault):
+    vault = make_vault()
+    store = vault.store
+    store.put("alice", "Invoice-1", {"type": "text", "timestamp": "2024-01-01 10:00:00",
+                                     "blob": {"hash": "0" * 64, "size": 3}})
+    assert store.search("alice", contains="voice") == (["Invoice-1"], 1)
+    store.put("alice", "invoice-2", {"type": "file", "timestamp": "2024-01-02 10:00:00",
+                                     "file_info": {"type": "application/pdf", "size": 1}})
+    assert store.search("alice", prefix="INVOICE", sort="size") == (["invoice-2", "Invoice-1"], 2)
+    assert store.search("alice", mime_type="application/pdf") == (["invoice-2"], 1)
+    store.delete("alice", "invoice-2")
+    assert store.search("alice", prefix="invoice") == (["Invoice-1"], 1)
+    assert store.index("alice").mime_types() == []
@@ -0,0 +1,120 @@
+"""Journal store: replay, torn-tail recovery and compaction."""
+import os
+
+import pytest
+
+from conftest import run_processes
+from secure_data.journal_store import FILE_MAGIC, JournalCorruptError, JournalLockedError, JournalStore
+
+TRY_OPEN = """
+import sys
+from secure_data.journal_store import JournalLockedError, JournalStore
+try:
+    JournalStore(sys.argv[2]).put("u", "y", {"v": 2})
+except JournalLockedError:
+    print("locked")
+"""
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "store.journal")
+
+
+def test_replay_restores_puts_and_deletes(path):
+    store = JournalStore(path)
+    store.put("alice", "a", {"v": 1})
+    store.put_many([("alice", "b", {"v": 2}), ("bob", "c", {"v": 3})])
+    store.put("alice", "a", {"v": 4})
+    assert store.delete("bob", "c") and not store.delete("bob", "c")
+    store.apply([("alice", "d", {"v": 5}), ("alice", "d", None), ("alice", "e", {"v": 6})])
+    snapshot = store.snapshot()
+    store.close()
+    reopened = JournalStore(path)
+    assert reopened.snapshot() == snapshot == {"alice": {"a": {"v": 4}, "b": {"v": 2}, "e": {"v": 6}}}
+    assert reopened.users() == ["alice"]
+    reopened.close()
+
+
+@pytest.mark.parametrize("cut", [1, 4, 9, 20])
+def test_torn_tail_is_truncated(path, cut):
+    store = JournalStore(path)
+    store.put("alice", "a", {"v": 1})
+    store.put("alice", "b", {"v": 2})
+    size = os.path.getsize(path)
+    store.put("alice", "c", {"v": 3})
+    store.close()
+    # A crash mid-append leaves only part of the last record
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) - cut)
+    reopened = JournalStore(path)
+    assert reopened.list_items("alice") == {"a": {"v": 1}, "b": {"v": 2}}
+    assert os.path.getsize(path) == size
+    # Appends continue after the last good record
+    reopened.put("alice", "d", {"v": 4})
+    reopened.close()
+    assert sorted(JournalStore(path).labels("alice")) == ["a", "b", "d"]
+
+
+def test_corrupt_record_ends_replay(path):
+    store = JournalStore(path)
+    store.put("alice", "a", {"v": 1})
+    good_end = os.path.getsize(path)
+    store.put("alice", "b", {"v": 2})
+    store.put("alice", "c", {"v": 3})
+    store.close()
+    with open(path, "r+b") as f:
+        f.seek(good_end + 12)
+        byte = f.read(1)
+        f.seek(good_end + 12)
+        f.write(bytes([byte[0] ^ 0xFF]))
+    reopened = JournalStore(path)
+    assert reopened.list_items("alice") == {"a": {"v": 1}}
+    assert os.path.getsize(path) == good_end
+    reopened.close()
+
+
+def test_not_a_journal(path):
+    with open(path, "wb") as f:
+        f.write(b"{}")
+    with pytest.raises(JournalCorruptError):
+        JournalStore(path)
+
+
+def test_compaction_keeps_live_items(path):
+    store = JournalStore(path, compact_min_bytes=0, compact_ratio=2)
+    for version in range(50):
+        store.put_many([("alice", f"item{index}", {"v": version}) for index in range(10)])
+    store.delete("alice", "item0")
+    before = store.stats()
+    assert before["garbage_bytes"] > before["live_bytes"]
+    store.compact()
+    after = store.stats()
+    assert after["garbage_bytes"] == 0 and after["file_bytes"] < before["file_bytes"]
+    assert store.list_items("alice") == {f"item{index}": {"v": 49} for index in range(1, 10)}
+    store.put("alice", "new", {"v": 0})
+    store.close()
+    reopened = JournalStore(path)
+    assert len(reopened.labels("alice")) == 10
+    with open(path, "rb") as f:
+        assert f.read(len(FILE_MAGIC)) == FILE_MAGIC
+    reopened.close()
+
+
+def test_second_opener_is_refused(path):
+    store = JournalStore(path)
+    store.put("u", "x", {"v": 1})
+    with pytest.raises(JournalLockedError):
+        JournalStore(path)
+    # Another process is refused too, and cannot overwrite the first store's records
+    assert run_processes(TRY_OPEN, 1, path) == ["locked\n"]
+    store.put("u", "z", {"v": 3})
+    store.close()
+    reopened = JournalStore(path)
+    assert reopened.list_items("u") == {"x": {"v": 1}, "z": {"v": 3}}
+    reopened.close()
+    # Once closed, the journal can be opened elsewhere
+    assert run_processes(TRY_OPEN, 1, path) == [""]
+    reopened = JournalStore(path)
+    assert sorted(reopened.labels("u")) == ["x", "y", "z"]
+    reopened.close()
@@ -0,0 +1,172 @@
+"""Keyring rotation, and sharing one keyring between processes."""
+import json
+import os
+
+from cryptography.exceptions import InvalidTag
+import pytest
+
+from secure_data.key_management import Keyring, RotationJob, seal, unseal
+from conftest import run_processes
+
+DATA_KEY = b"d" * 32
+PASSKEY_KEY = b"p" * 32
+
+
+def test_seal_round_trip():
+    sealed = seal(PASSKEY_KEY, b"secret", b"aad")
+    assert unseal(PASSKEY_KEY, sealed, b"aad") == b"secret"
+    with pytest.raises(InvalidTag):
+        unseal(b"x" * 32, sealed, b"aad")
+
+
+def test_rotate_keeps_old_keys_and_rewraps(tmp_path):
+    keyring = Keyring(str(tmp_path / "keyring.json"))
+    old_id, wrapped = keyring.wrap(DATA_KEY, PASSKEY_KEY)
+    new_id = keyring.rotate()
+    assert new_id != old_id and keyring.active_id == new_id
+    assert keyring.unwrap(old_id, wrapped, PASSKEY_KEY) == DATA_KEY
+    key_id, rewrapped = keyring.rewrap(old_id, wrapped)
+    assert key_id == new_id
+    assert keyring.unwrap(key_id, rewrapped, PASSKEY_KEY) == DATA_KEY
+    with pytest.raises(InvalidTag):
+        keyring.unwrap(key_id, rewrapped, b"x" * 32)
+
+
+def test_unknown_key_id(tmp_path):
+    keyring = Keyring(str(tmp_path / "keyring.json"))
+    with pytest.raises(KeyError):
+        keyring.unwrap("k9-missing", "AAAA", PASSKEY_KEY)
+
+
+def test_sees_keys_rotated_by_another_keyring(tmp_path):
+    path = str(tmp_path / "keyring.json")
+    first, second = Keyring(path), Keyring(path)
+    new_id = first.rotate()
+    key_id, wrapped = first.wrap(DATA_KEY, PASSKEY_KEY)
+    assert key_id == new_id
+    assert second.unwrap(key_id, wrapped, PASSKEY_KEY) == DATA_KEY
+    # New items are sealed under the key the other keyring activated
+    assert second.wrap(DATA_KEY, PASSKEY_KEY)[0] == new_id
+
+
+def test_rotate_merges_with_the_file(tmp_path):
+    path = str(tmp_path / "keyring.json")
+    first, second = Keyring(path), Keyring(path)
+    secret = first.chunk_secret("alice")
+    first_id = first.rotate()
+    # second has not re-read the file since it was opened
+    second_id = second.rotate()
+    with open(path) as f:
+        data = json.load(f)
+    assert {first_id, second_id} <= set(data["keys"])
+    assert data["active"] == second_id
+    assert second.chunk_secret("alice") == secret
+
+
+def test_rotation_job_reseals_every_item(make_vault):
+    vault = make_vault()
+    for index in range(5):
+        payload = vault.encrypt_data(f"note {index}", "passkey")
+        vault.save_item("alice", f"note{index}", {**payload, "type": "text"}, wait=True)
+    old_id = vault.keyring.active_id
+    new_id = vault.keyring.rotate()
+    job = RotationJob(vault.store, vault.keyring, vault.rotation_job.checkpoint_path, batch_size=2)
+    job.run()
+    assert job.rotated == 5 and not job.pending()
+    for index, item in enumerate(vault.store.list_items("alice").values()):
+        assert item["key_id"] == new_id != old_id
+        assert vault.decrypt_data(item, "passkey") == f"note {index}"
+
+
+def test_other_vault_decrypts_after_rotation(make_vault):
+    # The journal backend has a single writer process; SQLite is shared
+    first, second = make_vault("sqlite"), make_vault("sqlite")
+    payload = first.encrypt_data("secret", "passkey")
+    first.save_item("alice", "note", {**payload, "type": "text"}, wait=True)
+    first.keyring.rotate()
+    first.rotation_job.run()
+    item = second.load_data()["alice"]["note"]
+    assert item["key_id"] == first.keyring.active_id
+    assert second.verify_passkey(item, "passkey")
+    assert not second.verify_passkey(item, "wrong")
+    assert second.decrypt_data(item, "passkey") == "secret"
+
+
+def test_verify_passkey_with_unknown_key_id(make_vault):
+    vault = make_vault()
+    payload = vault.encrypt_data("secret", "passkey")
+    assert not vault.verify_passkey({**payload, "key_id": "k9-missing"}, "passkey")
+
+
+ROTATE = """
+import sys
+from secure_data.key_management import Keyring
+keyring = Keyring(sys.argv[2])
+for _ in range(int(sys.argv[3])):
+    print(keyring.rotate())
+keyring.chunk_secret("alice")
+"""
+
+
+def test_processes_rotating_at_once_keep_every_key(tmp_path):
+    path = str(tmp_path / "keyring.json")
+    outputs = run_processes(ROTATE, 4, path, 5)
+    rotated = {key_id for output in outputs for key_id in output.split()}
+    assert len(rotated) == 20
+    with open(path) as f:
+        data = json.load(f)
+    # Every key any process created or rotated to survives, including the initial one
+    assert rotated < set(data["keys"])
+    assert data["active"] in rotated
+    assert "chunk_secret" in data
+    assert not os.path.exists(f"{path}.tmp")
+
+
+def test_finished_rotation_retires_old_keys(make_vault):
+    vault = make_vault()
+    payload = vault.encrypt_data("secret", "passkey")
+    vault.save_item("alice", "note", {**payload, "type": "text"}, wait=True)
+    old_id = payload["key_id"]
+    new_id = vault.keyring.rotate()
+    vault.rotation_job.run()
+    # Old keys are kept for a while after the rotation, then retired
+    assert old_id in vault.keyring.key_ids()
+    assert vault.rotation_job.retire_old_keys(min_age=0) == [old_id]
+    assert Keyring(vault.keyring.path).key_ids() == [new_id]
+    item = vault.store.get("alice", "note")
+    assert item["key_id"] == new_id
+    assert vault.decrypt_data(item, "passkey") == "secret"
+
+
+def test_payload_sealed_before_a_rotation_is_resealed_when_saved(make_vault):
+    vault = make_vault()
+    payload = vault.encrypt_data("in flight", "passkey")
+    new_id = vault.keyring.rotate()
+    vault.rotation_job.run()
+    vault.save_item("alice", "note", {**payload, "type": "text"}, wait=True)
+    assert vault.store.get("alice", "note")["key_id"] == new_id
+    vault.rotation_job.retire_old_keys(min_age=0)
+    assert vault.keyring.key_ids() == [new_id]
+    assert vault.decrypt_data(vault.store.get("alice", "note"), "passkey") == "in flight"
+
+
+def test_keys_still_in_use_are_kept(make_vault):
+    vault = make_vault()
+    payload = vault.encrypt_data("secret", "passkey")
+    vault.keyring.rotate()
+    vault.rotation_job.run()
+    # Written past the vault, as if the rotation had skipped it
+    vault.store.put("alice", "note", {**payload, "type": "text"}).result()
+    assert vault.rotation_job.retire_old_keys(min_age=0) == []
+    assert vault.decrypt_data(vault.store.get("alice", "note"), "passkey") == "secret"
+
+
+def test_keys_are_kept_for_backup_points(make_vault):
+    vault = make_vault("json")
+    payload = vault.encrypt_data("secret", "passkey")
+    vault.save_item("alice", "note", {**payload, "type": "text"}, wait=True)
+    vault.keyring.rotate()
+    vault.rotation_job.run()
+    assert vault.rotation_job.retire_old_keys(min_age=0) == []
+    restored = vault.store.backups.restore(seq=1)["alice"]["note"]
+    assert vault.decrypt_data(restored, "passkey") == "secret"
@@ -0,0 +1,89 @@
+"""Password hashes, the verification pool and the verified-password cache."""
+import hashlib
+import threading
+
+import pytest
+
+from secure_data import auth, passwords
+from secure_data.passwords import VerificationPool, VerifiedCache, VerifierBusy
+
+
+def test_hash_round_trip():
+    stored = passwords.hash_password("secret", log2_n=10)
+    assert stored.startswith("$scrypt$ln=10,r=8,p=1$")
+    assert passwords.verify_password("secret", stored)
+    assert not passwords.verify_password("Secret", stored)
+    # Every hash has its own salt
+    assert passwords.hash_password("secret", log2_n=10) != stored
+    params = passwords.parse(stored)
+    assert (params["ln"], params["r"], params["p"]) == (10, 8, 1) and len(params["hash"]) == 32
+
+
+def test_bad_hashes():
+    with pytest.raises(ValueError):
+        passwords.parse("$bcrypt$ln=10$abc$def")
+    with pytest.raises(ValueError):
+        passwords.parse("$scrypt$r=8,p=1$abc$def")
+    with pytest.raises(ValueError):
+        passwords.hash_password("secret", log2_n=4)
+
+
+def test_needs_rehash():
+    weak = passwords.hash_password("secret", log2_n=10)
+    assert passwords.needs_rehash(weak, log2_n=11)
+    assert not passwords.needs_rehash(weak, log2_n=10)
+    assert passwords.needs_rehash(hashlib.sha256(b"secret").hexdigest())
+
+
+def test_legacy_hash_is_replaced_on_login():
+    legacy = hashlib.sha256(b"secret").hexdigest()
+    assert passwords.is_legacy(legacy) and passwords.verify_password("secret", legacy)
+    accounts = {"carol": legacy}
+    assert auth.authenticate(accounts, "carol", "secret")
+    assert accounts["carol"].startswith("$scrypt$")
+    assert auth.authenticate(accounts, "carol", "secret")
+    assert not auth.authenticate(accounts, "carol", "wrong")
+    assert not auth.authenticate(accounts, "nobody", "secret")
+
+
+def test_pool_refuses_work_past_its_queue():
+    pool = VerificationPool(workers=1, max_queue=1)
+    release = threading.Event()
+    running = [pool.submit(release.wait), pool.submit(release.wait)]
+    with pytest.raises(VerifierBusy):
+        pool.submit(release.wait)
+    release.set()
+    for future in running:
+        future.result()
+    assert pool.submit(lambda: 42).result() == 42
+    pool.close()
+
+
+def test_cache_expires_and_forgets_changed_hashes():
+    now = [0.0]
+    cache = VerifiedCache(max_entries=2, ttl=10, clock=lambda: now[0])
+    cache.add("alice", "secret", "hash1")
+    assert ("alice", "secret", "hash1") in cache
+    assert ("alice", "secret", "hash2") not in cache
+    assert ("alice", "wrong", "hash1") not in cache
+    now[0] = 11
+    assert ("alice", "secret", "hash1") not in cache
+    for index in range(3):
+        cache.add(f"user{index}", "secret", "hash")
+    assert ("user0", "secret", "hash") not in cache and ("user2", "secret", "hash") in cache
+    assert VerifiedCache(ttl=0).add("alice", "secret", "hash") is None
+
+
+def test_check_password_skips_the_pool_for_recent_logins():
+    accounts = {"dave": passwords.hash_password("secret", log2_n=10)}
+    assert auth.check_password(accounts, "dave", "secret").result()
+    busy = VerificationPool(workers=1, max_queue=0)
+    release = threading.Event()
+    blocker = busy.submit(release.wait)
+    # Answered from the cache, so the full pool is never asked
+    assert auth.check_password(accounts, "dave", "secret", pool=busy).result()
+    with pytest.raises(VerifierBusy):
+        auth.check_password(accounts, "dave", "wrong", pool=busy)
+    release.set()
+    blocker.result()
+    busy.close()
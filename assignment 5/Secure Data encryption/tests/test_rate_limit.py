@@ -0,0 +1,88 @@
+"""Token-bucket login rate limiting."""
+import threading
+
+import pytest
+
+from secure_data import auth
+from secure_data.rate_limit import LoginLimiter, TokenBuckets
+
+
+def test_bucket_empties_and_refills():
+    buckets = TokenBuckets(capacity=3, interval=10)
+    for _ in range(3):
+        assert buckets.wait("alice", 0) == 0
+        buckets.take("alice", 0)
+    assert buckets.wait("alice", 0) == pytest.approx(10)
+    assert buckets.wait("alice", 4) == pytest.approx(6)
+    assert buckets.wait("alice", 10) == 0 and buckets.tokens("alice", 10) == pytest.approx(1)
+    assert buckets.tokens("alice", 100) == 3
+    # Taking from an empty bucket never pushes it below zero
+    buckets.take("bob", 0)
+    for _ in range(5):
+        buckets.take("bob", 0)
+    assert buckets.tokens("bob", 0) == 0 and buckets.wait("bob", 10) == 0
+
+
+def test_reset_refills():
+    buckets = TokenBuckets(capacity=1, interval=10)
+    buckets.take("alice", 0)
+    buckets.reset("alice")
+    assert buckets.wait("alice", 0) == 0
+
+
+def test_idle_and_excess_buckets_are_dropped():
+    buckets = TokenBuckets(capacity=2, interval=10, max_keys=3)
+    for index in range(5):
+        buckets.take(f"user{index}", 0)
+    assert len(buckets) == 3
+    # Dropped buckets are the least recently used, and are full again
+    assert buckets.tokens("user0", 0) == 2 and buckets.tokens("user4", 0) == 1
+    buckets.take("late", 25)
+    assert len(buckets) == 1
+
+
+def test_limiter_locks_out_a_username_then_allows_a_retry():
+    limiter = LoginLimiter(max_failures=2, lockout=60, client_max_failures=100)
+    assert limiter.remaining("alice") == 2
+    limiter.failure("alice", "10.0.0.1")
+    limiter.failure("alice", "10.0.0.2")
+    assert limiter.retry_after("alice") > 59
+    assert limiter.retry_after("bob", "10.0.0.1") == 0
+    limiter.success("alice")
+    assert limiter.retry_after("alice") == 0
+
+
+def test_limiter_locks_out_a_client_across_usernames():
+    limiter = LoginLimiter(max_failures=10, lockout=60, client_max_failures=3)
+    for index in range(3):
+        limiter.failure(f"user{index}", "10.0.0.1")
+    assert limiter.retry_after("new-user", "10.0.0.1") > 0
+    assert limiter.retry_after("new-user", "10.0.0.2") == 0
+    assert limiter.remaining("new-user", "10.0.0.1") == 0
+
+
+def test_limiter_is_shared_between_threads():
+    limiter = LoginLimiter(max_failures=1000, lockout=60, client_max_failures=1000)
+
+    def fail():
+        for _ in range(100):
+            limiter.failure("alice", "10.0.0.1")
+
+    threads = [threading.Thread(target=fail) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert limiter.remaining("alice") == 200
+
+
+def test_login_rejects_before_checking_the_password():
+    accounts = auth.default_accounts()
+    limiter = LoginLimiter(max_failures=2, lockout=60)
+    assert not auth.login(limiter, accounts, "admin", "wrong", "10.0.0.1")
+    assert not auth.login(limiter, accounts, "admin", "wrong", "10.0.0.1")
+    with pytest.raises(auth.LoginRateLimited) as rejected:
+        auth.login(limiter, accounts, "admin", "admin123", "10.0.0.1")
+    assert rejected.value.retry_after > 0
+    # Other accounts are not affected
+    assert auth.login(limiter, accounts, "user1", "password1", "10.0.0.1")
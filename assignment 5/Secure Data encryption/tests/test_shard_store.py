@@ -0,0 +1,90 @@
+"""Sharded store: per-user shard files shared between stores and processes."""
+import os
+
+from secure_data.shard_store import ShardedStore
+from secure_data.storage import CachedStore
+from conftest import run_processes
+
+
+def test_put_get_delete(tmp_path):
+    store = ShardedStore(str(tmp_path))
+    store.put("alice", "a", {"x": 1})
+    store.apply([("alice", "b", {"x": 2}), ("bob", "c", {"x": 3}), ("alice", "a", None)])
+    assert store.list_items("alice") == {"b": {"x": 2}}
+    assert store.get("bob", "c") == {"x": 3}
+    assert store.delete("bob", "c") and not store.delete("bob", "c")
+    assert store.users() == ["alice"]
+    assert ShardedStore(str(tmp_path)).snapshot() == store.snapshot()
+
+
+def test_emptied_shard_keeps_its_version(tmp_path):
+    store = ShardedStore(str(tmp_path))
+    store.put("alice", "a", {"x": 1})
+    store.delete("alice", "a")
+    assert store.users() == [] and store.version("alice") == 2
+    assert os.path.exists(store.shard_path("alice"))
+    store.put("alice", "b", {"x": 2})
+    assert store.version("alice") == 3
+    reopened = ShardedStore(str(tmp_path))
+    assert reopened.version("alice") == 3 and reopened.list_items("alice") == {"b": {"x": 2}}
+
+
+def test_reload_sees_a_shard_emptied_and_refilled(tmp_path):
+    first, second = ShardedStore(str(tmp_path)), ShardedStore(str(tmp_path))
+    for index in range(3):
+        first.put("alice", f"x{index}", {"v": index})
+    second.reload()
+    assert sorted(second.list_items("alice")) == ["x0", "x1", "x2"]
+    first.apply([("alice", f"x{index}", None) for index in range(3)])
+    first.put("alice", "new", {"v": 9})
+    second.reload()
+    assert second.list_items("alice") == {"new": {"v": 9}}
+    # A write from the stale store merges with the file, not its old copy
+    second.put("alice", "other", {"v": 10})
+    first.reload()
+    assert sorted(first.list_items("alice")) == ["new", "other"]
+
+
+def test_reload_drops_users_whose_shard_was_removed(tmp_path):
+    first, second = ShardedStore(str(tmp_path)), ShardedStore(str(tmp_path))
+    first.put("alice", "a", {"x": 1})
+    second.reload()
+    os.remove(first.shard_path("alice"))
+    second.reload()
+    assert second.users() == [] and second.get("alice", "a") is None
+
+
+def test_cached_store_sees_other_writers(tmp_path):
+    writer = ShardedStore(str(tmp_path))
+    cached = CachedStore(ShardedStore(str(tmp_path)))
+    writer.put("bob", "b", {"y": 2})
+    assert cached.refresh_if_stale() and cached.get("bob", "b") == {"y": 2}
+    writer.delete("bob", "b")
+    assert cached.refresh_if_stale() and cached.get("bob", "b") is None
+    assert "bob" not in cached.users()
+    cached.close()
+
+
+WRITE = """
+import sys
+from secure_data.shard_store import ShardedStore
+index, root = sys.argv[1], sys.argv[2]
+store = ShardedStore(root)
+for batch in range(50):
+    store.apply([("shared", f"p{index}-{batch}", {"v": batch}), (f"own{index}", f"i{batch}", {"v": batch})])
+    if batch % 10 == 9:
+        store.delete("shared", f"p{index}-{batch}")
+"""
+
+
+def test_processes_writing_the_same_shard(tmp_path):
+    root = str(tmp_path)
+    run_processes(WRITE, 4, root)
+    store = ShardedStore(root)
+    shared = store.list_items("shared")
+    assert len(shared) == 4 * 45
+    assert all(f"p{index}-9" not in shared and f"p{index}-8" in shared for index in range(4))
+    # 50 writes and 5 deletes per process, none lost
+    assert store.version("shared") == 4 * 55
+    for index in range(4):
+        assert len(store.list_items(f"own{index}")) == 50
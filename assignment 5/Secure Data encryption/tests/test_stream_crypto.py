@@ -0,0 +1,89 @@
+"""Streaming AEAD payload format: round trips and tamper detection."""
+import io
+import os
+
+from cryptography.exceptions import InvalidTag
+import pytest
+
+from secure_data import stream_crypto
+from secure_data.stream_crypto import HEADER_SIZE, TAG_SIZE, StreamFormatError
+
+KEY = b"k" * 32
+CHUNK = 64
+
+
+@pytest.mark.parametrize("size", [0, 1, CHUNK - 1, CHUNK, CHUNK + 1, 3 * CHUNK, 3 * CHUNK + 5])
+def test_round_trip(size):
+    plaintext = os.urandom(size)
+    payload = stream_crypto.encrypt_bytes(KEY, plaintext, CHUNK)
+    assert len(payload) == stream_crypto.encrypted_size(size, CHUNK)
+    assert stream_crypto.is_stream_payload(payload)
+    assert stream_crypto.decrypt_bytes(KEY, payload) == plaintext
+
+
+def test_round_trip_through_files():
+    plaintext = os.urandom(10 * CHUNK + 3)
+    encrypted, decrypted = io.BytesIO(), io.BytesIO()
+    stream_crypto.encrypt_stream(KEY, io.BytesIO(plaintext), encrypted, CHUNK)
+    encrypted.seek(0)
+    assert stream_crypto.decrypt_stream(KEY, encrypted, decrypted) == len(plaintext)
+    assert decrypted.getvalue() == plaintext
+
+
+def test_payloads_differ_for_equal_plaintext():
+    assert stream_crypto.encrypt_bytes(KEY, b"same") != stream_crypto.encrypt_bytes(KEY, b"same")
+
+
+def test_wrong_key():
+    payload = stream_crypto.encrypt_bytes(KEY, b"secret")
+    with pytest.raises(InvalidTag):
+        stream_crypto.decrypt_bytes(b"x" * 32, payload)
+
+
+def sealed_chunks(payload):
+    body = payload[HEADER_SIZE:]
+    return payload[:HEADER_SIZE], [body[i:i + CHUNK + TAG_SIZE] for i in range(0, len(body), CHUNK + TAG_SIZE)]
+
+
+def test_truncation_at_a_chunk_boundary_is_detected():
+    header, chunks = sealed_chunks(stream_crypto.encrypt_bytes(KEY, os.urandom(3 * CHUNK + 5), CHUNK))
+    with pytest.raises(InvalidTag):
+        stream_crypto.decrypt_bytes(KEY, header + b"".join(chunks[:2]))
+
+
+def test_truncation_inside_a_chunk_is_detected():
+    payload = stream_crypto.encrypt_bytes(KEY, os.urandom(3 * CHUNK), CHUNK)
+    with pytest.raises((InvalidTag, StreamFormatError)):
+        stream_crypto.decrypt_bytes(KEY, payload[:-5])
+    with pytest.raises(StreamFormatError):
+        stream_crypto.decrypt_bytes(KEY, payload[:HEADER_SIZE + TAG_SIZE - 1])
+    with pytest.raises(StreamFormatError):
+        stream_crypto.decrypt_bytes(KEY, payload[:HEADER_SIZE - 1])
+
+
+def test_reordered_and_appended_chunks_are_detected():
+    header, chunks = sealed_chunks(stream_crypto.encrypt_bytes(KEY, os.urandom(3 * CHUNK + 5), CHUNK))
+    with pytest.raises(InvalidTag):
+        stream_crypto.decrypt_bytes(KEY, header + chunks[1] + chunks[0] + b"".join(chunks[2:]))
+    with pytest.raises(InvalidTag):
+        stream_crypto.decrypt_bytes(KEY, header + b"".join(chunks) + chunks[0])
+
+
+def test_modified_header_or_body_is_detected():
+    payload = bytearray(stream_crypto.encrypt_bytes(KEY, os.urandom(2 * CHUNK), CHUNK))
+    flipped = bytearray(payload)
+    flipped[-1] ^= 1
+    with pytest.raises(InvalidTag):
+        stream_crypto.decrypt_bytes(KEY, bytes(flipped))
+    flipped = bytearray(payload)
+    flipped[HEADER_SIZE - 1] ^= 1  # nonce prefix
+    with pytest.raises(InvalidTag):
+        stream_crypto.decrypt_bytes(KEY, bytes(flipped))
+
+
+def test_bad_header():
+    payload = stream_crypto.encrypt_bytes(KEY, b"data")
+    with pytest.raises(StreamFormatError):
+        stream_crypto.decrypt_bytes(KEY, b"XXXX" + payload[4:])
+    with pytest.raises(StreamFormatError):
+        stream_crypto.decrypt_bytes(KEY, payload[:4] + b"\x09" + payload[5:])
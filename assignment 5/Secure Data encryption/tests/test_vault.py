@@ -0,0 +1,111 @@
+"""Vault items: saving, overwriting and deleting release payloads exactly once."""
+import json
+import os
+import zipfile
+
+import pytest
+
+from secure_data.chunking import MIN_ITEM_SIZE
+
+PASSKEY = "passkey"
+
+
+def blob_count(vault):
+    root = vault.blob_store.root
+    return sum(len(files) for directory, _, files in os.walk(root) if directory != os.path.join(root, "tmp"))
+
+
+def save_text(vault, label, text, wait=True):
+    payload = vault.encrypt_data(text, PASSKEY)
+    vault.save_item("alice", label, {**payload, "type": "text"}, wait=wait)
+    return payload
+
+
+@pytest.mark.parametrize("write_behind_ms", [0, 2])
+def test_text_round_trip(make_vault, write_behind_ms):
+    vault = make_vault(write_behind_ms=write_behind_ms)
+    save_text(vault, "note", "hello")
+    item = vault.load_data()["alice"]["note"]
+    assert vault.verify_passkey(item, PASSKEY) and not vault.verify_passkey(item, "wrong")
+    assert vault.decrypt_data(item, PASSKEY) == "hello"
+    assert vault.decrypt_data(item, "wrong") is None
+
+
+@pytest.mark.parametrize("write_behind_ms", [0, 2])
+def test_overwrite_releases_the_old_blob(make_vault, write_behind_ms):
+    vault = make_vault(write_behind_ms=write_behind_ms)
+    old = save_text(vault, "note", "first")
+    save_text(vault, "other", "kept")
+    assert blob_count(vault) == 2
+    save_text(vault, "note", "second")
+    vault.store.flush().result()
+    assert blob_count(vault) == 2
+    assert not vault.blob_store.exists(old["blob"]["hash"])
+    assert vault.decrypt_data(vault.store.get("alice", "note"), PASSKEY) == "second"
+
+
+def test_overwrite_with_the_same_payload_keeps_it(make_vault):
+    vault = make_vault()
+    payload = save_text(vault, "note", "text")
+    vault.save_item("alice", "note", {**payload, "type": "text", "renamed": True}, wait=True)
+    assert vault.blob_store.exists(payload["blob"]["hash"])
+
+
+def test_overwrite_in_one_batch(make_vault):
+    vault = make_vault()
+    save_text(vault, "note", "zero")
+    payloads = [vault.encrypt_data(text, PASSKEY) for text in ("one", "two")]
+    vault.save_items([("alice", "note", {**payload, "type": "text"}) for payload in payloads], wait=True)
+    # Payloads are released by a callback that may run just after the wait returns
+    vault.store.flush().result()
+    assert blob_count(vault) == 1
+    assert vault.decrypt_data(vault.store.get("alice", "note"), PASSKEY) == "two"
+
+
+def test_delete_keeps_a_blob_another_item_refers_to(make_vault):
+    vault = make_vault()
+    payload = save_text(vault, "note", "shared")
+    vault.save_item("bob", "copy", {**payload, "type": "text"}, wait=True)
+    assert vault.store.references("blob", payload["blob"]["hash"]) == 2
+    assert vault.delete_item("alice", "note")
+    vault.store.flush().result()
+    assert vault.blob_store.exists(payload["blob"]["hash"])
+    assert vault.delete_item("bob", "copy") and not vault.delete_item("bob", "copy")
+    vault.store.flush().result()
+    assert blob_count(vault) == 0
+
+
+def test_overwriting_a_chunked_file_releases_its_chunks(make_vault):
+    vault = make_vault()
+    first = os.urandom(MIN_ITEM_SIZE * 2)
+    second = os.urandom(MIN_ITEM_SIZE * 2)
+    for data in (first, second):
+        payload = vault.encrypt_data(data, PASSKEY, is_binary=True, username="alice")
+        assert "chunks" in payload
+        vault.save_item("alice", "file", {**payload, "type": "file"}, wait=True)
+    stats = vault.dedup_stats("alice")
+    blobs_now = blob_count(vault)
+    assert vault.decrypt_data(vault.store.get("alice", "file"), PASSKEY, is_binary=True) == second
+    vault.delete_item("alice", "file")
+    vault.store.flush().result()
+    assert blob_count(vault) == 0 < blobs_now
+    assert vault.dedup_stats("alice") != stats
+
+
+def test_export_round_trip(make_vault, tmp_path):
+    vault = make_vault()
+    save_text(vault, "note", "hello")
+    payload = vault.encrypt_data(b"\x00" * 1000, PASSKEY, is_binary=True)
+    vault.save_item("alice", "file", {**payload, "type": "file",
+                                      "file_info": {"filename": "zeros.bin", "size": 1000}}, wait=True)
+    other = vault.encrypt_data("locked", "other passkey")
+    vault.save_item("alice", "locked", {**other, "type": "text"}, wait=True)
+    assert vault.export_size("alice") >= 1000
+    with open(tmp_path / "export.zip", "w+b") as out:
+        manifest = vault.export("alice", PASSKEY, out)
+        out.seek(0)
+        with zipfile.ZipFile(out) as archive:
+            assert archive.read("note.txt") == b"hello"
+            assert archive.read("file/zeros.bin") == b"\x00" * 1000
+            assert json.loads(archive.read("manifest.json"))["skipped"] == ["locked"]
+    assert manifest["skipped"] == ["locked"] and len(manifest["items"]) == 2